@@ -0,0 +1,39 @@
+"""
+Benchmark for core.Cache.pop_batch
+Fills the cache with N escrows and measures the latency of pop_batch + release.
+Run from src/: python -m bench.cache_bench [--sizes 1000 10000 100000 1000000]
+"""
+import argparse
+import asyncio
+import random
+import time
+from core import Cache, EscrowType
+
+QUEUED_TYPES = [EscrowType.EXPIRED, EscrowType.EXTENDED, EscrowType.LINKED]
+
+async def bench_pop(size: int, batch: int, rounds: int) -> float:
+    cache = Cache()
+    rng = random.Random(size)
+    for i in range(size):
+        await cache.add(i, rng.choice(QUEUED_TYPES))
+    rounds = min(rounds, size // batch) # never drain the cache
+    start = time.perf_counter()
+    for _ in range(rounds):
+        refs = await cache.pop_batch(batch)
+        for e in refs:
+            await cache.release(e.escrow_id)
+    return (time.perf_counter() - start) / rounds
+
+async def main(sizes, batch, rounds):
+    print(f"{'entries':>10} {'pop_batch(' + str(batch) + ') us':>18}")
+    for size in sizes:
+        per_pop = await bench_pop(size, batch, rounds)
+        print(f"{size:>10} {per_pop * 1e6:>18.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--batch", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=1_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.batch, args.rounds))
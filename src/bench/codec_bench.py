@@ -0,0 +1,76 @@
+"""
+Benchmark for db.codec: stored size and encode/decode time per value.
+Payloads mirror what Storage writes: event args dicts from ArcHandler, latest:{id} records and shipment details.
+Run from src/: python -m bench.codec_bench [--count 20000]
+"""
+import argparse
+import json
+import random
+import time
+from db.codec import Codec, train_dictionary
+
+class LegacyJSON:
+    """Format 1: Storage wrote JSON text (latest:{id} nesting the event's text), DB.put json.dumps'd it again."""
+    def encode(self, value) -> bytes:
+        if isinstance(value, dict) and "state" in value:
+            value = {"state": value["state"], "data": json.dumps(value["data"])}
+        return json.dumps(json.dumps(value)).encode()
+    def decode(self, raw: bytes):
+        value = json.loads(json.loads(raw.decode()))
+        if isinstance(value, dict) and "state" in value:
+            value["data"] = json.loads(value["data"])
+        return value
+
+def payloads(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    values = []
+    for i in range(count):
+        event = {
+            "escrowId": i,
+            "buyer": "0x" + f"{rng.getrandbits(160):040x}",
+            "seller": "0x" + f"{rng.getrandbits(160):040x}",
+            "amount": rng.randrange(10**6, 10**12),
+            "shipmentId": f"SHIP-{rng.randrange(10**6):06d}",
+            "releaseTime": 1_700_000_000 + rng.randrange(10**6),
+        }
+        kind = i % 3
+        if kind == 0:
+            values.append(event)
+        elif kind == 1:
+            values.append({"state": rng.choice(["lk", "ex", "xp"]), "data": event})
+        else:
+            values.append([{"Shipid": f"SHIP-{i:06d}", "state": rng.choice(["transit", "delivered", "lost"]),
+                            "updated": 1_700_000_000 + i}])
+    return values
+
+def measure(codec, values) -> tuple[float, float, float]:
+    start = time.perf_counter()
+    encoded = [codec.encode(v) for v in values]
+    enc = time.perf_counter() - start
+    start = time.perf_counter()
+    for raw in encoded:
+        codec.decode(raw)
+    dec = time.perf_counter() - start
+    n = len(values)
+    return sum(map(len, encoded)) / n, enc / n, dec / n
+
+def main(count: int, dict_size: int):
+    values = payloads(count)
+    train = payloads(5_000, seed=1) # dictionary trained on other payloads of the same shape
+    codecs = {"json (format 1)": LegacyJSON()}
+    for name in ("orjson", "msgpack"):
+        codecs[name] = Codec(name, compress=False)
+        codecs[f"{name}+zstd"] = Codec(name, compress=True, dictionary=b"")
+        zdict = train_dictionary([codecs[name].encode(v) for v in train], dict_size)
+        codecs[f"{name}+zstd+dict"] = Codec(name, compress=True, dictionary=zdict)
+    print(f"{'codec':>20} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    for name, codec in codecs.items():
+        size, enc, dec = measure(codec, values)
+        print(f"{name:>20} {size:>8.1f} {enc * 1e6:>10.2f} {dec * 1e6:>10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20_000)
+    parser.add_argument("--dict-size", type=int, default=16384)
+    args = parser.parse_args()
+    main(args.count, args.dict_size)
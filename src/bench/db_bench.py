@@ -0,0 +1,56 @@
+"""
+Benchmark for the LMDB backend: put, put_many, get and iterate.
+Run from src/: python -m bench.db_bench [--sizes 1000 10000 100000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from db.db_lmdb import DB
+
+def bench(size: int, batch: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "data"), index_path=os.path.join(tmpdir, "index"))
+        payload = '{"escrowId": 1, "buyer": "0x' + "b" * 40 + '", "amount": 1000000}'
+        keys = [f"ec:{i}" for i in range(size)]
+        result = {}
+
+        start = time.perf_counter()
+        for key in keys[: size // 2]:
+            db.put(key, payload)
+        result["put"] = (time.perf_counter() - start) / (size // 2)
+
+        start = time.perf_counter()
+        rest = keys[size // 2:]
+        for i in range(0, len(rest), batch):
+            db.put_many((k, payload) for k in rest[i:i + batch])
+        result["put_many"] = (time.perf_counter() - start) / len(rest)
+
+        rng = random.Random(size)
+        sample = [rng.choice(keys) for _ in range(min(size, 10_000))]
+        db.cache.clear()
+        start = time.perf_counter()
+        for key in sample:
+            db.get(key)
+        result["get"] = (time.perf_counter() - start) / len(sample)
+
+        start = time.perf_counter()
+        n = sum(1 for _ in db.iterate("ec:"))
+        result["iterate"] = (time.perf_counter() - start) / n
+        db.close()
+        return result
+
+def main(sizes, batch):
+    cols = ["put", "put_many", "get", "iterate"]
+    print(f"{'entries':>10} " + " ".join(f"{c + ' us':>12}" for c in cols))
+    for size in sizes:
+        r = bench(size, batch)
+        print(f"{size:>10} " + " ".join(f"{r[c] * 1e6:>12.2f}" for c in cols))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+    main(args.sizes, args.batch)
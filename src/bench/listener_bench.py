@@ -0,0 +1,71 @@
+"""
+Throughput of ArcHandler.listen_events catching up on a backlog, against an in-process stand-in node.
+The node answers get_logs after `latency` seconds plus a per-log cost and refuses ranges with more than
+`max_results` logs, like public RPC endpoints. Events are decoded as-is and stored in a temporary LMDB.
+Run from src/: python -m bench.listener_bench [--blocks 200000 --every 4]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from core import ArcHandler, Storage
+from db.db_lmdb import DB
+from db.offload import AsyncDB
+
+class StandInEth:
+    def __init__(self, head: int, every: int, max_results: int, latency: float, per_log: float):
+        self.block_number = head
+        self.every = every
+        self.max_results = max_results
+        self.latency = latency
+        self.per_log = per_log
+        self.calls = 0
+        self.refused = 0
+
+    def get_logs(self, params):
+        self.calls += 1
+        frm, to = params["fromBlock"], params["toBlock"]
+        first = -(-frm // self.every) * self.every
+        if (to - first) // self.every + 1 > self.max_results:
+            self.refused += 1
+            time.sleep(self.latency)
+            raise ValueError({"code": -32005, "message": f"query returned more than {self.max_results} results"})
+        logs = [{"event": "EscrowCreated", "args": {"escrowId": b}, "blockNumber": b} for b in range(first, to + 1, self.every)]
+        time.sleep(self.latency + self.per_log * len(logs))
+        return logs
+
+async def run(args) -> tuple[float, ArcHandler, StandInEth]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = AsyncDB(DB(path=os.path.join(tmpdir, "data"), index_path=os.path.join(tmpdir, "index")))
+        eth = StandInEth(args.blocks - 1, args.every, args.max_results, args.latency, args.per_log)
+        arc = ArcHandler(storage=Storage(db=db), chunk=args.chunk)
+        arc.w3 = SimpleNamespace(eth=eth)
+        arc.contract = SimpleNamespace(address="0x" + "1" * 40)
+        arc._decode_log = lambda log: log
+        start = time.perf_counter()
+        task = asyncio.create_task(arc.listen_events(from_block=0))
+        while arc.stats["blocks"] < eth.block_number:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await db.close()
+        return elapsed, arc, eth
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=200_000)
+    parser.add_argument("--every", type=int, default=4, help="one event every N blocks")
+    parser.add_argument("--max-results", type=int, default=10_000)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per get_logs call")
+    parser.add_argument("--per-log", type=float, default=0.00002, help="extra seconds per returned log")
+    parser.add_argument("--chunk", type=int, default=2000, help="initial chunk")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    elapsed, arc, eth = asyncio.run(run(args))
+    events = arc.stats["events"]
+    print(f"{events} events over {args.blocks} blocks in {elapsed:.2f}s: {events / elapsed:,.0f} events/s")
+    print(f"get_logs calls {eth.calls} ({eth.refused} refused), final chunk {arc.chunk} blocks")
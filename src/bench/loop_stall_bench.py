@@ -0,0 +1,63 @@
+"""
+Event loop stall benchmark for Storage on LMDB, with the DB called inline versus through db.offload.AsyncDB.
+A heartbeat task sleeps `tick` seconds in a loop and records how late it wakes up while Storage saves
+pages of events and reads latest states.
+Run from src/: python -m bench.loop_stall_bench [--pages 200 --page-size 100]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from core import EscrowType, Storage
+from db.db_lmdb import DB
+from db.offload import AsyncDB
+
+TYPES = [EscrowType.CREATED, EscrowType.LINKED, EscrowType.EXTENDED, EscrowType.EXPIRED]
+
+async def heartbeat(tick: float, lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(tick)
+        lags.append(time.perf_counter() - start - tick)
+
+async def workload(storage: Storage, pages: int, page_size: int):
+    for p in range(pages):
+        events = [(p * page_size + i, TYPES[(p + i) % len(TYPES)], {"escrowId": p * page_size + i, "n": i})
+                  for i in range(page_size)]
+        await storage.save_escrow_events(events)
+        await storage.get_latest_many([e[0] for e in events])
+        await asyncio.sleep(0) # let other tasks in, as listen_events does between pages
+
+async def run(mode: str, pages: int, page_size: int, tick: float):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "data"), index_path=os.path.join(tmpdir, "index"))
+        storage = Storage(db=AsyncDB(db) if mode == "offload" else db)
+        lags, stop = [], asyncio.Event()
+        beat = asyncio.create_task(heartbeat(tick, lags, stop))
+        start = time.perf_counter()
+        await workload(storage, pages, page_size)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+        if mode == "offload":
+            await storage.db.close()
+        else:
+            db.close()
+    lags.sort()
+    return elapsed, statistics.median(lags), lags[int(len(lags) * 0.99)], lags[-1]
+
+def main(pages: int, page_size: int, tick: float):
+    print(f"{'mode':>8} {'total s':>8} {'p50 lag ms':>11} {'p99 lag ms':>11} {'max lag ms':>11}")
+    for mode in ("inline", "offload"):
+        elapsed, p50, p99, worst = asyncio.run(run(mode, pages, page_size, tick))
+        print(f"{mode:>8} {elapsed:>8.2f} {p50 * 1e3:>11.2f} {p99 * 1e3:>11.2f} {worst * 1e3:>11.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--tick", type=float, default=0.001)
+    args = parser.parse_args()
+    main(args.pages, args.page_size, args.tick)
@@ -0,0 +1,43 @@
+"""
+Backfill benchmark for the Postgres backends: writes N synthetic escrow events with put_many.
+Needs a scratch database, rows are written under the bf: prefix.
+Run from src/: DATABASE_URL=postgres://... python -m bench.pg_backfill [--events 1000000] [--async]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+def events(n: int, chunk: int):
+    for start in range(0, n, chunk):
+        yield [(f"bf:{i}", json.dumps({"escrowId": i, "buyer": "0x" + f"{i:040x}", "amount": i * 1000}))
+               for i in range(start, min(n, start + chunk))]
+
+def run_sync(n: int, chunk: int) -> float:
+    from db.db_postgres import DB
+    db = DB()
+    start = time.perf_counter()
+    for items in events(n, chunk):
+        db.put_many(items)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+async def run_async(n: int, chunk: int) -> float:
+    from db.db_postgres_async import DB
+    db = DB()
+    start = time.perf_counter()
+    for items in events(n, chunk):
+        await db.put_many(items)
+    elapsed = time.perf_counter() - start
+    await db.close()
+    return elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--chunk", type=int, default=50_000, help="rows per put_many call")
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    args = parser.parse_args()
+    elapsed = asyncio.run(run_async(args.events, args.chunk)) if args.use_async else run_sync(args.events, args.chunk)
+    print(f"{args.events} events in {elapsed:.1f}s ({args.events / elapsed:,.0f} events/s)")
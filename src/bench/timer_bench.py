@@ -0,0 +1,66 @@
+"""
+Benchmark for TimerScheduler backends: core.HeapTimers vs timer_wheel.TimingWheel
+Inserts N timers spread over an hour, cancels 10% of them, then drains them second by second.
+Run from src/: python -m bench.timer_bench [--sizes 10000 100000 1000000] [--memory]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from core import HeapTimers, TimerEntry
+from timer_wheel import TimingWheel
+
+HORIZON = 3600.0
+
+BACKENDS = {
+    "heap": lambda: HeapTimers(),
+    "wheel": lambda: TimingWheel(tick=0.01, start=0.0),
+}
+
+def bench(name: str, size: int, memory: bool) -> dict:
+    rng = random.Random(size)
+    dues = [rng.uniform(0, HORIZON) for _ in range(size)]
+    if memory:
+        tracemalloc.start()
+    backend = BACKENDS[name]()
+    start = time.perf_counter()
+    entries = []
+    for i, due in enumerate(dues):
+        e = TimerEntry(due_at=due, escrow_id=i, reason="recheck")
+        backend.push(e)
+        entries.append(e)
+    insert = time.perf_counter() - start
+    mem = tracemalloc.get_traced_memory()[0] if memory else 0
+    if memory:
+        tracemalloc.stop()
+    start = time.perf_counter()
+    for e in entries[::10]:
+        e.cancelled = True
+        backend.discard(e)
+    cancel = time.perf_counter() - start
+    start = time.perf_counter()
+    fired = 0
+    now = 0.0
+    while now <= HORIZON + 1:
+        fired += len(backend.pop_due(now))
+        now += 1.0
+    drain = time.perf_counter() - start
+    assert fired == size - len(entries[::10])
+    return {"insert": insert / size, "cancel": cancel / len(entries[::10]), "pop": drain / fired, "mem": mem / size}
+
+def main(sizes, memory):
+    print(f"{'backend':>7} {'timers':>9} {'insert ns':>10} {'cancel ns':>10} {'pop ns':>10}" + (f" {'bytes/timer':>12}" if memory else ""))
+    for size in sizes:
+        for name in BACKENDS:
+            r = bench(name, size, memory)
+            line = f"{name:>7} {size:>9} {r['insert'] * 1e9:>10.0f} {r['cancel'] * 1e9:>10.0f} {r['pop'] * 1e9:>10.0f}"
+            if memory:
+                line += f" {r['mem']:>12.0f}"
+            print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--memory", action="store_true", help="trace allocations during insert (slower)")
+    args = parser.parse_args()
+    main(args.sizes, args.memory)
@@ -1,11 +1,17 @@
 import json
+import os
 import logging
-import asyncio, heapq, time
+import asyncio, heapq, inspect, itertools, time
+from collections import deque
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import List, Dict, Optional
-from web3 import Web3
+import aiohttp
+from hexbytes import HexBytes
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3
+from websockets.asyncio.client import connect as ws_connect
 from db import DB
+from event_decoder import decode_log
 
 
 class EscrowType(Enum):
@@ -28,6 +34,9 @@ class EscrowRef:
     last_seen_at: float
     seen_count: int = 0
     locked: bool = False
+    retries: int = 0
+    lease_token: int = field(default=0, compare=False, repr=False)
+    lease_expires_at: Optional[float] = field(default=None, compare=False, repr=False)
 
     def __post_init__(self):
         # Priority: type first, then oldest timestamp
@@ -36,172 +45,863 @@ class EscrowRef:
     
     def refresh_index(self):
         self.sort_index = (self.etype.value, self.seen_count,self.first_seen_at)
+
+class EscrowHeap:
+    """Binary min-heap of EscrowRef indexed by escrow_id.
+    Keeps a position map so that update and remove are O(log n) instead of a full re-sort.
+    """
+    def __init__(self):
+        self._heap: List[EscrowRef] = []
+        self._pos: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, escrow_id: int):
+        return escrow_id in self._pos
+
+    def push(self, ref: EscrowRef):
+        if ref.escrow_id in self._pos:
+            self.update(ref)
+            return
+        self._heap.append(ref)
+        self._pos[ref.escrow_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def update(self, ref: EscrowRef):
+        """Restore heap order after ref.sort_index changed."""
+        i = self._pos[ref.escrow_id]
+        self._sift_up(i)
+        self._sift_down(self._pos[ref.escrow_id])
+
+    def remove(self, escrow_id: int) -> Optional[EscrowRef]:
+        i = self._pos.pop(escrow_id, None)
+        if i is None:
+            return None
+        ref = self._heap[i]
+        last = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._pos[last.escrow_id] = i
+            self._sift_up(i)
+            self._sift_down(self._pos[last.escrow_id])
+        return ref
+
+    def pop(self) -> EscrowRef:
+        return self.remove(self._heap[0].escrow_id)
+
+    def peek(self) -> Optional[EscrowRef]:
+        return self._heap[0] if self._heap else None
+
+    def clear(self):
+        self._heap.clear()
+        self._pos.clear()
+
+    @staticmethod
+    def _less(a: EscrowRef, b: EscrowRef) -> bool:
+        # escrow_id breaks ties the same way sorted() did on the dataclass
+        return (a.sort_index, a.escrow_id) < (b.sort_index, b.escrow_id)
+
+    def _sift_up(self, i: int):
+        heap, pos = self._heap, self._pos
+        ref = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not self._less(ref, heap[parent]):
+                break
+            heap[i] = heap[parent]
+            pos[heap[i].escrow_id] = i
+            i = parent
+        heap[i] = ref
+        pos[ref.escrow_id] = i
+
+    def _sift_down(self, i: int):
+        heap, pos = self._heap, self._pos
+        n = len(heap)
+        ref = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._less(heap[child + 1], heap[child]):
+                child += 1
+            if not self._less(heap[child], ref):
+                break
+            heap[i] = heap[child]
+            pos[heap[i].escrow_id] = i
+            i = child
+        heap[i] = ref
+        pos[ref.escrow_id] = i
+
 class Cache:
-    """Holds references to escrows needing AI attention."""
+    """Holds references to escrows needing AI attention.
+    Consumers check escrows out under a lease, then ack (done), nack (retry later)
+    or let the lease expire, in which case the escrow is requeued automatically.
+    """
     logging.info("Cache started")
-    def __init__(self):
+    def __init__(self, lease_ttl: Optional[float] = None, backoff_base: float = 1.0, backoff_max: float = 60.0):
         self._entries: Dict[int, EscrowRef] = {}
+        self._queue = EscrowHeap() # unlocked entries only
+        self._leases: List[tuple[float, int, int]] = [] # (expires_at, token, escrow_id)
+        self._delayed: List[tuple[float, int, int]] = [] # (ready_at, token, escrow_id) nacked entries in backoff
+        self._tokens = itertools.count(1)
+        self.lease_ttl = lease_ttl
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
         self._lock = asyncio.Lock()
+        self._changed = asyncio.Condition(self._lock)
+        self._generation = 0 # bumped whenever an escrow becomes available
 
     async def add(self, escrow_id: int, etype: EscrowType):
         logging.info(f"Cache: adding {escrow_id}:{etype.name}")
         async with self._lock:
-            if escrow_id not in self._entries:
+            ref = self._entries.get(escrow_id)
+            if ref is None:
                 now = time.time()
-                self._entries[escrow_id] = EscrowRef(
+                ref = EscrowRef(
                     escrow_id=escrow_id,
                     etype=etype,
                     first_seen_at=now,
                     last_seen_at=now
                 )
+                self._entries[escrow_id] = ref
+                self._queue.push(ref)
+                self._notify()
+            elif ref.etype != etype:
+                # escrow moved to a new state (e.g LINKED -> EXTENDED), reprioritize it
+                ref.etype = etype
+                ref.refresh_index()
+                if escrow_id in self._queue:
+                    self._queue.update(ref)
+                    self._notify()
+
+    @property
+    def pending(self) -> int:
+        """Number of escrows ready to be checked out (locked and backing-off entries excluded)."""
+        return len(self._queue)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def head_type(self) -> Optional[EscrowType]:
+        """Type of the next escrow checkout would return."""
+        head = self._queue.peek()
+        return head.etype if head else None
+
+    async def wait_changed(self, generation: int, timeout: Optional[float] = None) -> bool:
+        """Wait until an escrow became available after `generation` was read, or timeout.
+        Returns True if something changed.
+        """
+        async with self._lock:
+            if self._generation != generation:
+                return True
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._generation != generation), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
 
     async def pop_batch(self, size: int) -> List[EscrowRef]:
         """
         Selects a batch of escrows for processing, marking them as locked, but does NOT remove them from the cache.
+        Locked entries are skipped until requeued or until their lease (if lease_ttl is set) expires.
         Caller is responsible for releasing (removing) them after processing.
         """
+        return await self.checkout(size, self.lease_ttl)
+
+    async def checkout(self, size: int, ttl: Optional[float] = None) -> List[EscrowRef]:
+        """Lease up to `size` escrows for `ttl` seconds (no expiry when ttl is None).
+        Each returned ref carries a lease_token to pass back to ack/nack.
+        """
         async with self._lock:
-            batch = sorted(self._entries.values())[:size]
-            for e in batch:
+            now = time.monotonic()
+            self._reap(now)
+            batch = []
+            wall = time.time()
+            while self._queue and len(batch) < size:
+                e = self._queue.pop()
                 e.locked = True
                 e.seen_count += 1
-                e.last_seen_at = time.time()
+                e.last_seen_at = wall
                 e.refresh_index() ## needed to update sort_index
+                e.lease_token = next(self._tokens)
+                e.lease_expires_at = None
+                if ttl is not None:
+                    e.lease_expires_at = now + ttl
+                    heapq.heappush(self._leases, (e.lease_expires_at, e.lease_token, e.escrow_id))
+                batch.append(e)
             return batch
 
+    async def ack(self, escrow_id: int, token: Optional[int] = None) -> bool:
+        """Processing done: drop the escrow from the cache.
+        Returns False when the lease was lost (expired and handed to another consumer).
+        """
+        async with self._lock:
+            ref = self._entries.get(escrow_id)
+            if ref is None or not self._holds(ref, token):
+                return False
+            self._entries.pop(escrow_id)
+            return True
+
+    async def nack(self, escrow_id: int, token: Optional[int] = None, delay: Optional[float] = None) -> bool:
+        """Processing failed: put the escrow back after `delay` (exponential backoff by default)."""
+        async with self._lock:
+            ref = self._entries.get(escrow_id)
+            if ref is None or not self._holds(ref, token):
+                return False
+            self._requeue(ref, time.monotonic(), delay)
+            return True
+
+    async def requeue(self, escrow_id: int):
+        """Unlock an escrow so it can be selected again."""
+        await self.nack(escrow_id, delay=0)
+
     async def release(self, escrow_id: int):
         """Release (remove) an escrow from the cache."""
         logging.info(f"Cache: releasing {escrow_id} ")
         async with self._lock:
             self._entries.pop(escrow_id, None)
+            self._queue.remove(escrow_id)
+
+    async def reap_expired(self):
+        """Requeue escrows whose lease expired or whose backoff elapsed."""
+        async with self._lock:
+            self._reap(time.monotonic())
+
+    def _notify(self):
+        # always called with self._lock held
+        self._generation += 1
+        self._changed.notify_all()
+
+    def next_deadline(self) -> Optional[float]:
+        """time.monotonic() of the next lease expiry or backoff end, if any."""
+        heads = [h[0][0] for h in (self._leases, self._delayed) if h]
+        return min(heads) if heads else None
 
     def clear(self):
         """Clear all entries."""
         self._entries.clear()
+        self._queue.clear()
+        self._leases.clear()
+        self._delayed.clear()
 
+    def _holds(self, ref: EscrowRef, token: Optional[int]) -> bool:
+        return ref.locked and (token is None or token == ref.lease_token)
 
-@dataclass(order=True)
+    def _backoff(self, retries: int) -> float:
+        return min(self.backoff_max, self.backoff_base * 2 ** (retries - 1))
+
+    def _requeue(self, ref: EscrowRef, now: float, delay: Optional[float] = None):
+        ref.retries += 1
+        delay = self._backoff(ref.retries) if delay is None else delay
+        # a new token invalidates the pending lease deadline and any late ack from the old holder
+        ref.lease_token = next(self._tokens)
+        ref.lease_expires_at = None
+        if delay <= 0:
+            ref.locked = False
+            self._queue.push(ref)
+            self._notify()
+        else:
+            heapq.heappush(self._delayed, (now + delay, ref.lease_token, ref.escrow_id))
+
+    def _reap(self, now: float):
+        # Both heaps are lazily invalidated: an entry is stale once the ref's token moved on.
+        while self._leases and self._leases[0][0] <= now:
+            _, token, escrow_id = heapq.heappop(self._leases)
+            ref = self._entries.get(escrow_id)
+            if ref is not None and ref.locked and ref.lease_token == token:
+                logging.warning(f"Cache: lease expired for {escrow_id}, requeueing")
+                self._requeue(ref, now, delay=0) # it already waited a full ttl
+        while self._delayed and self._delayed[0][0] <= now:
+            _, token, escrow_id = heapq.heappop(self._delayed)
+            ref = self._entries.get(escrow_id)
+            if ref is not None and ref.locked and ref.lease_token == token:
+                ref.locked = False
+                self._queue.push(ref)
+                self._notify()
+
+
+@dataclass(order=True, slots=True)
 class TimerEntry:
     due_at: float
     escrow_id: int
     reason: str
     attempt: int = 1
+    cancelled: bool = field(default=False, compare=False, repr=False)
 
-class TimerScheduler:
-    """Schedules deferred re-checks."""
+class HeapTimers:
+    """Default TimerScheduler backend: a binary heap, cancelled entries are dropped lazily.
+    Backends implement push, discard, next_due, pop_due, rebuild and __len__ (see timer_wheel.TimingWheel).
+    """
     def __init__(self):
         self._heap: List[TimerEntry] = []
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def push(self, entry: TimerEntry):
+        heapq.heappush(self._heap, entry)
+        self._live += 1
+
+    def discard(self, entry: TimerEntry):
+        self._live -= 1
+        # rebuild once cancelled entries dominate the heap
+        if len(self._heap) > 2 * self._live + 64:
+            self.rebuild([e for e in self._heap if not e.cancelled])
+
+    def rebuild(self, entries):
+        self._heap = list(entries)
+        heapq.heapify(self._heap)
+        self._live = len(self._heap)
+
+    def next_due(self) -> Optional[float]:
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0].due_at if self._heap else None
+
+    def pop_due(self, now: float) -> List[TimerEntry]:
+        due = []
+        while self._heap and self._heap[0].due_at <= now:
+            e = heapq.heappop(self._heap)
+            if not e.cancelled:
+                self._live -= 1
+                due.append(e)
+        return due
+
+async def iterate_rows(rows):
+    """Rows of DB.iterate as an async generator, for sync and async backends alike."""
+    if hasattr(rows, "__aiter__"):
+        async for row in rows:
+            yield row
+    else:
+        for row in rows:
+            yield row
+
+def load_value(value):
+    """A stored record as written: dicts go through the db codec, values stored before that are JSON text."""
+    return json.loads(value) if isinstance(value, (str, bytes)) else value
+
+class TimerScheduler:
+    """Schedules deferred re-checks.
+    Keeps at most one pending timer per escrow and sleeps exactly until the next deadline,
+    waking early when an earlier timer is set.
+    The timer store is pluggable: HeapTimers by default, timer_wheel.TimingWheel for millions of timers.
+    With a db, pending timers are journalled under `tm:{escrow_id}` so they survive a restart (see load).
+    Due timers run as tasks, up to max_inflight at once and one at a time per escrow; a callback that raises
+    is retried with exponential backoff until max_attempts.
+    """
+    PREFIX = "tm"
+
+    def __init__(self, db: DB = None, flush_interval: float = 0.5, flush_size: int = 500, overdue_spacing: float = 0.05,
+                 backend=None, max_inflight: int = 8, max_attempts: int = 5, retry_base: float = 2.0, retry_max: float = 300.0):
+        self._backend = backend if backend is not None else HeapTimers()
+        self._timers: Dict[int, TimerEntry] = {} # pending timer per escrow
+        self._wakeup = asyncio.Event()
         self._stop = False
+        self.stats = {"fired": 0, "last_lag": 0.0, "max_lag": 0.0, "avg_lag": 0.0}
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.overdue_spacing = overdue_spacing # seconds between overdue timers fired after a restart
+        self._journal: Dict[int, Optional[TimerEntry]] = {} # unflushed changes, None means delete
+        self._flushing: Optional[asyncio.Future] = None # last background journal write
+        self.max_inflight = max_inflight
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._inflight: Dict[int, asyncio.Task] = {} # latest callback task per escrow
+
+    def __len__(self):
+        return len(self._timers)
 
     def stop(self):
         self._stop = True
-    def set_timer(self, escrow_id: int, delay: int, reason: str):
-        logging.info(f"TimerScheduler: setting timer {escrow_id} delay: {delay}, reason:{reason}")
-        entry = TimerEntry(due_at=time.time() + delay, escrow_id=escrow_id, reason=reason)
-        heapq.heappush(self._heap, entry)
+        self._wakeup.set()
+
+    def set_timer(self, escrow_id: int, delay: int, reason: str, replace: bool = False) -> TimerEntry:
+        """Schedule a re-check for escrow_id.
+        If the escrow already has a pending timer the earliest one is kept, unless replace is set.
+        Returns the timer that is pending afterwards.
+        """
+        return self._schedule(escrow_id, time.time() + delay, reason, replace=replace)
+
+    def _schedule(self, escrow_id: int, due_at: float, reason: str, attempt: int = 1, replace: bool = False) -> TimerEntry:
+        current = self._timers.get(escrow_id)
+        if current is not None and not replace and current.due_at <= due_at:
+            logging.info(f"TimerScheduler: keeping earlier timer {escrow_id} due in {current.due_at - time.time():.1f}s")
+            return current
+        logging.info(f"TimerScheduler: setting timer {escrow_id} delay: {due_at - time.time():.1f}, reason:{reason}, attempt:{attempt}")
+        if current is not None:
+            current.cancelled = True
+            self._backend.discard(current)
+        entry = TimerEntry(due_at=due_at, escrow_id=escrow_id, reason=reason, attempt=attempt)
+        self._timers[escrow_id] = entry
+        self._journal_write(escrow_id, entry)
+        head = self._backend.next_due()
+        self._backend.push(entry)
+        if head is None or due_at < head:
+            self._wakeup.set() # new head, the run loop is sleeping for too long
+        return entry
+
+    def cancel(self, escrow_id: int) -> bool:
+        """Drop the pending timer of escrow_id, if any."""
+        entry = self._timers.pop(escrow_id, None)
+        if entry is None:
+            return False
+        logging.info(f"TimerScheduler: cancelled timer {escrow_id}")
+        entry.cancelled = True
+        self._backend.discard(entry)
+        self._journal_write(escrow_id, None)
+        return True
+
+    def _journal_write(self, escrow_id: int, entry: Optional[TimerEntry]):
+        if self.db is None:
+            return
+        self._journal[escrow_id] = entry
+        if len(self._journal) >= self.flush_size:
+            self.flush()
+
+    def flush(self) -> Optional[asyncio.Future]:
+        """Write pending timer changes to the db in one put_many and one delete_many.
+        With an async db (db.offload.AsyncDB) the write completes in the background, its future is returned.
+        """
+        if self.db is None or not self._journal:
+            return None
+        journal, self._journal = self._journal, {}
+        puts = [(f"{self.PREFIX}:{i}", self._record(e)) for i, e in journal.items() if e is not None]
+        deletes = [f"{self.PREFIX}:{i}" for i, e in journal.items() if e is None]
+        pending = []
+        try:
+            if puts:
+                pending.append(self.db.put_many(puts))
+            if deletes:
+                pending.append(self.db.delete_many(deletes))
+        except Exception as e:
+            self._rejournal(journal, e)
+            return None
+        pending = [p for p in pending if inspect.isawaitable(p)]
+        if not pending:
+            return None
+        fut = asyncio.ensure_future(asyncio.gather(*pending))
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception() is None or self._rejournal(journal, f.exception()))
+        self._flushing = fut
+        return fut
+
+    async def drain(self):
+        """Flush what is left of the journal and wait for the writes still in flight, e.g. before closing the db."""
+        pending = {f for f in (self._flushing, self.flush()) if f is not None}
+        if pending:
+            await asyncio.wait(pending)
+
+    def _rejournal(self, journal: Dict[int, Optional[TimerEntry]], err: Exception):
+        logging.error(f"TimerScheduler: journal flush failed: {err}")
+        for i, entry in journal.items(): # retry on next flush unless changed since
+            self._journal.setdefault(i, entry)
+
+    @staticmethod
+    def _record(e: TimerEntry) -> dict:
+        return {"due_at": e.due_at, "escrow_id": e.escrow_id, "reason": e.reason, "attempt": e.attempt}
+
+    async def load(self) -> int:
+        """Reload journalled timers with one prefix scan, on sync and async dbs alike.
+        Timers that came due while we were down are spread overdue_spacing apart, most overdue first,
+        instead of all firing at once.
+        """
+        if self.db is None:
+            return 0
+        entries = sorted([TimerEntry(**load_value(v)) async for _, v in iterate_rows(self.db.iterate(f"{self.PREFIX}:"))])
+        now = time.time()
+        overdue = 0
+        for e in entries:
+            if e.due_at <= now:
+                e.due_at = now + overdue * self.overdue_spacing
+                overdue += 1
+            self._timers[e.escrow_id] = e
+        self._backend.rebuild(self._timers.values())
+        self._wakeup.set()
+        logging.info(f"TimerScheduler: reloaded {len(entries)} timers, {overdue} overdue")
+        return len(entries)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            fut = self.flush()
+            if fut is not None:
+                await asyncio.wait({fut})
+
+    def get(self, escrow_id: int) -> Optional[TimerEntry]:
+        return self._timers.get(escrow_id)
+
+    def _record_lag(self, lag: float):
+        st = self.stats
+        st["fired"] += 1
+        st["last_lag"] = lag
+        st["max_lag"] = max(st["max_lag"], lag)
+        st["avg_lag"] += (lag - st["avg_lag"]) / st["fired"]
 
     async def run(self, callback):
-        while not self._stop:
-            if not self._heap:
-                await asyncio.sleep(0.5)
-                continue
-            entry = self._heap[0]
-            delay = max(0, entry.due_at - time.time())
-            if delay == 0:
-                heapq.heappop(self._heap)
-                await callback(entry)
-            else:
-                await asyncio.sleep(min(delay,2))
+        flusher = asyncio.create_task(self._flush_loop()) if self.db is not None else None
+        running: set[asyncio.Task] = set()
+        try:
+            while not self._stop:
+                now = time.time()
+                due = self._backend.pop_due(now)
+                if not due:
+                    head = self._backend.next_due()
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), None if head is None else max(0.0, head - now))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                for entry in due:
+                    del self._timers[entry.escrow_id]
+                for entry in due:
+                    if len(running) >= self.max_inflight:
+                        await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    task = asyncio.create_task(self._fire(callback, entry, self._inflight.get(entry.escrow_id)))
+                    self._inflight[entry.escrow_id] = task
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+        finally:
+            for t in running:
+                t.cancel()
+            if flusher is not None:
+                flusher.cancel()
+                self.flush()
+
+    async def _fire(self, callback, entry: TimerEntry, previous: Optional[asyncio.Task]):
+        """Run one timer callback once any earlier callback of the same escrow finished."""
+        if previous is not None and not previous.done():
+            await asyncio.wait({previous})
+        self._record_lag(time.time() - entry.due_at)
+        try:
+            await callback(entry)
+        except Exception as e:
+            self._retry(entry, e)
+        finally:
+            # dropped from the journal only once handled, unless a new timer was set meanwhile
+            if entry.escrow_id not in self._timers:
+                self._journal_write(entry.escrow_id, None)
+            if self._inflight.get(entry.escrow_id) is asyncio.current_task():
+                del self._inflight[entry.escrow_id]
+
+    def _retry(self, entry: TimerEntry, err: Exception):
+        if entry.attempt >= self.max_attempts:
+            logging.error(f"TimerScheduler: giving up on {entry.escrow_id} after {entry.attempt} attempts: {err}")
+            return
+        delay = min(self.retry_max, self.retry_base * 2 ** (entry.attempt - 1))
+        logging.warning(f"TimerScheduler: callback failed for {entry.escrow_id} (attempt {entry.attempt}), retrying in {delay}s: {err}")
+        # keeps an earlier timer set for the escrow in the meantime
+        self._schedule(entry.escrow_id, time.time() + delay, entry.reason, attempt=entry.attempt + 1)
+
+@dataclass
+class BatchDecision:
+    """What BatchRunner did for one flush."""
+    trigger: str # "priority", "threshold", "interval" or "worker"
+    pending: int # escrows waiting when the flush started
+    size: int # escrows handed to the AI
+    latency: Optional[float] # seconds spent in ai_callback, None when handed to the worker pool
+    next_size: int # batch size chosen for the next flush
+    ok: bool = True
 
 class BatchRunner:
-    """Flushes cache to AI when threshold or time window reached."""
-    def __init__(self, cache: Cache, threshold: int = 5, interval: int = 5):
+    """Flushes cache to AI when threshold or time window reached.
+    Wakes as soon as the cache changes, flushes high-priority escrows (EXPIRED by default) right away
+    and adapts the batch size to the measured AI latency and queue depth.
+    With concurrency > 1 it runs as a worker pool instead: escrows are handed to ai_callback one
+    per call, up to `concurrency` calls at once.
+    """
+    def __init__(self, cache: Cache, threshold: int = 5, interval: int = 5, lease_ttl: Optional[float] = 300,
+                 min_batch: int = 1, max_batch: Optional[int] = None, target_latency: float = 30.0,
+                 flush_types: tuple[EscrowType, ...] = (EscrowType.EXPIRED,), concurrency: int = 1):
         self.cache = cache
         self.threshold = threshold
         self.interval = interval
+        self.lease_ttl = lease_ttl # a hung batch is handed out again once its lease expires
+        self.min_batch = min_batch
+        self.max_batch = max_batch or threshold * 4
+        self.target_latency = target_latency # seconds one batch should take at most
+        self.flush_types = flush_types
+        self.batch_size = threshold
+        self.concurrency = concurrency
+        self.decisions: deque[BatchDecision] = deque(maxlen=100)
+        self._per_item: Optional[float] = None # EWMA of AI seconds per escrow
+        self._inflight: Dict[int, asyncio.Task] = {} # worker-pool mode: latest task per escrow
         self._last_run = time.time()
-        
+
+    def _trigger(self, now: float) -> Optional[str]:
+        pending = self.cache.pending
+        if not pending:
+            return None
+        if self.cache.head_type() in self.flush_types:
+            return "priority"
+        if pending >= self.threshold:
+            return "threshold"
+        if (now - self._last_run) >= self.interval:
+            return "interval"
+        return None
+
+    def _timeout(self, now: float) -> float:
+        """Seconds until the interval elapses or a lease/backoff deadline in the cache is reached."""
+        timeout = max(0.0, self.interval - (now - self._last_run))
+        deadline = self._deadline_timeout()
+        return timeout if deadline is None else min(timeout, deadline)
+
+    def _deadline_timeout(self) -> Optional[float]:
+        """Seconds until the next lease/backoff deadline in the cache, None if there is none."""
+        deadline = self.cache.next_deadline()
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _observe(self, latency: float, size: int):
+        per_item = latency / size
+        self._per_item = per_item if self._per_item is None else 0.7 * self._per_item + 0.3 * per_item
+
+    def _resize(self, size: int, latency: float, pending: int) -> int:
+        """AIMD-style sizing: halve on slow batches, double while a backlog remains,
+        never beyond what fits in target_latency at the measured per-escrow cost."""
+        self._observe(latency, size)
+        fit = int(self.target_latency / self._per_item) if self._per_item > 0 else self.max_batch
+        if latency > self.target_latency:
+            new = min(self.batch_size // 2, fit)
+        elif pending >= self.batch_size:
+            new = min(self.batch_size * 2, fit)
+        else:
+            new = self.batch_size
+        self.batch_size = max(self.min_batch, min(self.max_batch, new))
+        return self.batch_size
+
     async def run(self, ai_callback):
+        if self.concurrency > 1:
+            return await self._run_pool(ai_callback)
         while True:
+            generation = self.cache.generation
+            await self.cache.reap_expired()
             now = time.time()
-            should_trigger = (
-            len(self.cache._entries) >= self.threshold
-            or (now - self._last_run) >= self.interval
-        )
-            if should_trigger:
-                # Decide how many to take
-                size = self.threshold if len(self.cache._entries) >= self.threshold else len(self.cache._entries)
-                
-                batch = await self.cache.pop_batch(size)
-                if batch:
-                    logging.info(f"BatchRunner: Processing {size} escrows")
-                    try:
-                        logging.info("BatchRunner: Waiting for Ai")
-                        await ai_callback(batch)
-                        for e in batch:
-                            await self.cache.release(e.escrow_id)
-                    except Exception as e:
-                        logging.error(f"BatchRunner: error: {e}")
-                        for e in batch:
-                            e.locked = False
-                self._last_run = now
-
-            await asyncio.sleep(1)
+            trigger = self._trigger(now)
+            if trigger is None:
+                if (now - self._last_run) >= self.interval:
+                    self._last_run = now
+                await self.cache.wait_changed(generation, self._timeout(now))
+                continue
+
+            pending = self.cache.pending
+            batch = await self.cache.checkout(self.batch_size, self.lease_ttl)
+            if not batch:
+                continue
+            size = len(batch)
+            logging.info(f"BatchRunner: Processing {size} escrows ({trigger})")
+            start = time.monotonic()
+            ok = True
+            try:
+                logging.info("BatchRunner: Waiting for Ai")
+                await ai_callback(batch)
+                for e in batch:
+                    await self.cache.ack(e.escrow_id, e.lease_token)
+            except Exception as e:
+                ok = False
+                logging.error(f"BatchRunner: error: {e}")
+                for e in batch:
+                    await self.cache.nack(e.escrow_id, e.lease_token)
+            latency = time.monotonic() - start
+            self._last_run = time.time()
+            decision = BatchDecision(trigger=trigger, pending=pending, size=size, latency=latency,
+                                     next_size=self._resize(size, latency, self.cache.pending), ok=ok)
+            self.decisions.append(decision)
+            logging.info(f"BatchRunner: {decision}")
+            # let producers run between back-to-back flushes
+            await asyncio.sleep(0)
+
+    async def _run_pool(self, ai_callback):
+        """Worker-pool mode. Only as many escrows as there are idle workers are checked out,
+        the rest stay queued (and prioritized) in the cache."""
+        running: set[asyncio.Task] = set()
+        try:
+            while True:
+                if len(running) >= self.concurrency:
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                generation = self.cache.generation
+                await self.cache.reap_expired()
+                pending = self.cache.pending
+                batch = await self.cache.checkout(self.concurrency - len(running), self.lease_ttl) if pending else []
+                if not batch:
+                    # workers pick escrows up as they come, there is no interval to wait for
+                    waiter = asyncio.create_task(self.cache.wait_changed(generation, self._deadline_timeout()))
+                    await asyncio.wait(running | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    continue
+                for e in batch:
+                    task = asyncio.create_task(self._process(ai_callback, e, self._inflight.get(e.escrow_id)))
+                    self._inflight[e.escrow_id] = task
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                trigger = "priority" if batch[0].etype in self.flush_types else "worker"
+                decision = BatchDecision(trigger=trigger, pending=pending, size=len(batch), latency=None,
+                                         next_size=self.concurrency - len(running))
+                self.decisions.append(decision)
+                logging.info(f"BatchRunner: {decision}")
+        finally:
+            for t in running:
+                t.cancel()
+
+    async def _process(self, ai_callback, ref: EscrowRef, previous: Optional[asyncio.Task]):
+        """Run one escrow through ai_callback, after any earlier run of the same escrow finished."""
+        if previous is not None and not previous.done():
+            # a lease expired while the escrow was still being processed, keep per-escrow order
+            await asyncio.wait({previous})
+        start = time.monotonic()
+        try:
+            await ai_callback([ref])
+            await self.cache.ack(ref.escrow_id, ref.lease_token)
+        except Exception as e:
+            logging.error(f"BatchRunner: error on {ref.escrow_id}: {e}")
+            await self.cache.nack(ref.escrow_id, ref.lease_token)
+        finally:
+            self._observe(time.monotonic() - start, 1)
+            if self._inflight.get(ref.escrow_id) is asyncio.current_task():
+                del self._inflight[ref.escrow_id]
 
 class Storage:
-    """Handles persistent and cache storage of escrow data."""
+    """Handles persistent and cache storage of escrow data.
+    Next to each `{state}:{id}` event, `latest:{id}` holds the most advanced state and its payload
+    so get_latest is a single read.
+    """
+    LATEST_ORDER = ["rf", "rl","xp","ex","lk","cn","ec"] # from last state to first
+    CHECKPOINT = "chk:events" # (block, log index) of the last event log the listener stored
+    TERMINAL = (EscrowType.REFUNDED, EscrowType.CANCELLED ,EscrowType.RELEASED, EscrowType.CREATED)
+
     def __init__(self, db:DB=None, cache:Cache=None):
         self.db = db if db else DB()
         self.cache = cache if cache else Cache()
         self.states = ["ec","lk","ex","cn","xp","rf","rl"]  # escrow states prefixes
-    async def save_escrow_event(self, escrow_id: int, type:EscrowType,event_data: str):
-        """Save escrow event data based on type.
+    async def save_escrow_event(self, escrow_id: int, type:EscrowType,event_data: dict):
+        await self.save_escrow_events([(escrow_id, type, event_data)])
+
+    async def save_escrow_events(self, events: List[tuple[int, EscrowType, dict]], checkpoint: Optional[tuple[int, int]] = None):
+        """Save (escrow_id, type, event_data) events in one DB batch, in order.
+        event_data is the event's args dict, stored as is; latest:{id} holds {"state": prefix, "data": event_data}.
+        `checkpoint` (block, log index) is written in the same batch, so it never runs ahead of or behind the events.
         CREATED ,CANCELLED, RELEASED, REFUNDED events are stored but not added to cache.
         LINKED, EXTENDED, EXPIRED events are added to cache for AI processing.
         EXTENDED is transition from LINKED
         EXPIRED is transition from EXTENDED(hold period)
+        latest:{id} only moves forward: an older state replayed after a newer one (e.g. rescanning
+        blocks) leaves it untouched.
         """
-        if type in (EscrowType.REFUNDED, EscrowType.CANCELLED ,EscrowType.RELEASED, EscrowType.CREATED):
-            logging.info(f"Storage: saving terminal states {type}:{escrow_id}")
-            self.db.put(f"{self._prefix(type)}:{escrow_id}", event_data)
+        if not events and checkpoint is None:
             return
+        current = await self._read_latest_many([e[0] for e in events]) if events else {}
+        items = []
+        for escrow_id, type, event_data in events:
+            if type in self.TERMINAL:
+                logging.info(f"Storage: saving terminal states {type}:{escrow_id}")
+            else:
+                logging.info(f"Storage: saving for processing {type}:{escrow_id}")
+            prefix = self._prefix(type)
+            items.append((f"{prefix}:{escrow_id}", event_data))
+            latest = current.get(escrow_id)
+            if latest is None or self._rank(prefix) >= self._rank(latest[0]):
+                current[escrow_id] = (prefix, event_data)
+                items.append((f"latest:{escrow_id}", {"state": prefix, "data": event_data}))
+        if checkpoint is not None:
+            items.append((self.CHECKPOINT, {"block": checkpoint[0], "log_index": checkpoint[1]}))
+        await self._db(self.db.put_many(items))
         # Only non-terminal events go to cache
-        logging.info(f"Storage: saving for processing {type}:{escrow_id}")
-        key = f"{self._prefix(type)}:{escrow_id}"
-        self.db.put(key, event_data)
-        await self.cache.add(escrow_id, type)
+        for escrow_id, type, _ in events:
+            if type not in self.TERMINAL:
+                await self.cache.add(escrow_id, type)
 
-    def get_escrow_by_id(self, escrow_id: int) -> Dict[str, str]:
+    async def get_checkpoint(self) -> Optional[tuple[int, int]]:
+        """(block, log index) saved with the last stored events, None before the first save."""
+        found, _ = await self._db(self.db.get_many([self.CHECKPOINT]))
+        raw = found.get(self.CHECKPOINT)
+        if raw is None:
+            return None
+        checkpoint = load_value(raw)
+        return (checkpoint["block"], checkpoint["log_index"])
+
+    async def _db(self, result):
+        """Value of a DB call, awaited for async backends (db_postgres_async)."""
+        return await result if inspect.isawaitable(result) else result
+
+    async def _read_latest(self, escrow_id: int) -> Optional[tuple[str, str]]:
+        return (await self._read_latest_many([escrow_id])).get(escrow_id)
+
+    async def _read_latest_many(self, escrow_ids: List[int]) -> Dict[int, tuple[str, str]]:
+        found, _ = await self._db(self.db.get_many([f"latest:{i}" for i in escrow_ids]))
+        result = {}
+        for i in escrow_ids:
+            raw = found.get(f"latest:{i}")
+            if raw is not None:
+                latest = load_value(raw)
+                result[i] = (latest["state"], latest["data"])
+        return result
+
+    def _rank(self, prefix: str) -> int:
+        return len(self.LATEST_ORDER) - self.LATEST_ORDER.index(prefix)
+
+    async def get_escrow_by_id(self, escrow_id: int) -> Dict[str, str]:
         """Retrieve escrow data by checking all possible states."""
         logging.info(f"Retrieving escrow state: #{escrow_id}")
         keys = [f"{state}:{escrow_id}" for state in self.states]
-        result = {}
-        for key in keys:
-            try:
-                tmp = self.db.get(key)
-                if tmp is not None:
-                    result[key] = tmp
-            except Exception:
-                pass
-        return result
+        found, _ = await self._db(self.db.get_many(keys))
+        return {k: v for k, v in found.items() if v is not None}
     
     async def get_latest(self, escrow_id: int) -> Optional[tuple[str, str]]:
         logging.info(f"Retrieving latest states: {escrow_id}")
-        data = self.get_escrow_by_id(escrow_id)
+        latest = await self._read_latest(escrow_id)
+        if latest is not None:
+            return latest
+        # escrows saved before latest:{id} existed
+        data = await self.get_escrow_by_id(escrow_id)
         if not data:
             return None
-        # Order by prefixes from last state to first
-        order = ["rf", "rl","xp","ex","lk","cn","ec"]
-        for p in order:
-            key = f"{p}:{escrow_id}"
-            if key in data:
-                return (p, data[key])
+        return self._pick_latest(escrow_id, data)
+
+    async def get_latest_many(self, escrow_ids: List[int]) -> Dict[int, tuple[str, str]]:
+        """Latest state of several escrows with one get_many, escrows not found are left out."""
+        result = await self._read_latest_many(escrow_ids)
+        # escrows saved before latest:{id} existed, one more get_many for all of them
+        legacy = [i for i in escrow_ids if i not in result]
+        if legacy:
+            found, _ = await self._db(self.db.get_many([f"{p}:{i}" for i in legacy for p in self.LATEST_ORDER]))
+            for i in legacy:
+                latest = self._pick_latest(i, found)
+                if latest is not None:
+                    result[i] = latest
+        return result
+
+    async def escrows_in_state(self, type: EscrowType) -> List[int]:
+        """Ids of escrows whose latest state is `type`, in id order.
+        One index scan on the normalized Postgres schema (also behind db.offload.AsyncDB), a scan of
+        latest:{id} records elsewhere.
+        """
+        prefix = self._prefix(type)
+        if hasattr(self.db, "escrow_ids"):
+            return await self._db(self.db.escrow_ids(prefix))
+        ids = []
+        async for key, raw in self._iterate("latest:"):
+            if load_value(raw)["state"] == prefix:
+                ids.append(int(key.split(":", 1)[1]))
+        return sorted(ids)
+
+    def _iterate(self, prefix: str, **kwargs):
+        return iterate_rows(self.db.iterate(prefix, **kwargs))
+
+    def _pick_latest(self, escrow_id: int, data: Dict[str, str]) -> Optional[tuple[str, str]]:
+        for p in self.LATEST_ORDER:
+            value = data.get(f"{p}:{escrow_id}")
+            if value is not None:
+                return (p, value)
         return None
-    def save_shipment_states(self, ids, details):
-        self.db.put(f"ship:{ids}", details["details"])
+    async def save_shipment_states(self, ids, details):
+        await self._db(self.db.put(f"ship:{ids}", details["details"]))
 
-    def get_shipment_state(self, ids):
-        return self.db.get(f"ship:{ids}")
+    async def get_shipment_state(self, ids):
+        return await self._db(self.db.get(f"ship:{ids}"))
         
     def _prefix(self, t: EscrowType) -> str:
         return {
@@ -214,75 +914,251 @@ class Storage:
         EscrowType.RELEASED: "rl",
         }[t]
 
+# substrings of get_logs errors that mean the block range (or its result) was too large
+RANGE_ERRORS = ("too many", "more than", "limit", "range", "-32005", "timeout", "timed out", "response size")
+
+# substrings of send errors that mean the node rejected the nonce, e.g. after a send with the same key elsewhere
+NONCE_ERRORS = ("nonce too low", "nonce too high", "invalid nonce")
+
 class ArcHandler:
     """Handle all interaction with Arc Blockchain"""
-    def __init__(self, provider_url:str=None, contract_address=None, abi:List[str]=None, agent_key:str=None, storage:Storage=None):
+    def __init__(self, provider_url:str=None, contract_address=None, abi:List[str]=None, agent_key:str=None, storage:Storage=None,
+                 chunk: int = None, max_chunk: int = None, poll_min: float = None, poll_max: float = None,
+                 ws_url: str = None, ws_retry: float = None):
+        """
+        chunk: initial blocks per get_logs, adapted to what the node accepts up to max_chunk
+        poll_min, poll_max: head polling interval bounds once caught up
+        ws_url: websocket endpoint for eth_subscribe log push, polling only without it
+        ws_retry: seconds of polling after a websocket failure before subscribing again
+        Transactions go through `aw3`, an AsyncWeb3 on one shared HTTP session, so any number of them can
+        be in flight from the event loop.
+        """
         self.w3 = Web3(Web3.HTTPProvider(provider_url)) if provider_url else None
         self.contract = self.w3.eth.contract(address=contract_address, abi=abi) if contract_address else None
+        self.aw3 = AsyncWeb3(AsyncHTTPProvider(provider_url)) if provider_url else None
+        self.acontract = self.aw3.eth.contract(address=contract_address, abi=abi) if contract_address else None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._nonce: Optional[int] = None # next nonce of the agent, handed out locally
+        self._free_nonces: List[int] = [] # heap of nonces given back by failed sends, handed out first
+        self._sending: set[int] = set() # nonces whose send the node has not answered yet
+        self._nonce_lock = asyncio.Lock()
+        self._chain_id: Optional[int] = None
         self.agent = self.w3.eth.account.from_key(agent_key) if agent_key else None
         self.storage:Storage = storage  if storage else Storage()
+        self.chunk = chunk or int(os.getenv("LOG_CHUNK", "2000"))
+        self.max_chunk = max_chunk or int(os.getenv("LOG_CHUNK_MAX", "50000"))
+        self.poll_min = poll_min or float(os.getenv("POLL_MIN", "0.5"))
+        self.poll_max = poll_max or float(os.getenv("POLL_MAX", "2"))
+        self.ws_url = ws_url or os.getenv("CHAIN_WS_URL") or None
+        self.ws_retry = ws_retry or float(os.getenv("WS_RETRY", "30"))
+        self.stats = {"blocks": 0, "events": 0} # last block processed, events stored
+        self.checkpoint: Optional[tuple[int, int]] = None # (block, log index) of the last stored log
+        self.next_block = 0 # first block not fetched yet
 
     async def listen_events(self, from_block: Optional[int]=None):
-        """Listen to all escrow events and push into storage/cache."""
+        """Listen to all escrow events and push into storage/cache.
+        Logs are fetched in chunks of `chunk` blocks, the next chunk is requested while the current one
+        is decoded and stored. Once caught up, the head is polled every poll_min seconds after blocks
+        that carried events, backing off to poll_max while nothing happens.
+        With a `ws_url` logs are pushed over an eth_subscribe subscription instead, the blocks missed
+        before it started are fetched with get_logs. When the websocket fails it polls for ws_retry
+        seconds and subscribes again.
+        Without `from_block` it resumes from the checkpoint stored with the last events (the head if there
+        is none); logs at or before the checkpoint are skipped, so every log is stored exactly once.
+        """
         logging.info("ArcHandler: Started Event listener")
-        start = from_block or self.w3.eth.block_number
+        if from_block is not None:
+            self.next_block, self.checkpoint = from_block, None
+        else:
+            self.checkpoint = await self.storage.get_checkpoint()
+            self.next_block = self.checkpoint[0] if self.checkpoint else await self._block_number()
+            if self.checkpoint:
+                logging.info(f"ArcHandler: resuming after block {self.checkpoint[0]} log {self.checkpoint[1]}")
+        if not self.ws_url:
+            return await self._poll()
+        loop = asyncio.get_running_loop()
         while True:
-            latest = self.w3.eth.block_number
-            if latest >= start:
-                logs = self.w3.eth.get_logs({"fromBlock": start, "toBlock": latest, "address": self.contract.address})
-                logging.info("ArcHandler: captured event logs")
-                for log in logs:
-                    try:
-                        decoded = self._decode_log(log)
-                        if decoded:
-                            
-                            await self.handle_event(decoded)
-                    except Exception as e:
-                        logging.error(f"Decode error: {e}")
-                start = latest + 1
-            await asyncio.sleep(2)
+            try:
+                await self._subscribe()
+            except Exception as e:
+                logging.warning(f"ArcHandler: log subscription failed, polling for {self.ws_retry}s: {e}")
+            await self._poll(until=loop.time() + self.ws_retry)
+
+    async def _poll(self, until: Optional[float] = None):
+        """Fetch logs from next_block up to the head and keep polling for new blocks.
+        Returns once caught up after the event loop time `until`, never without it.
+        """
+        loop = asyncio.get_running_loop()
+        head = await self._block_number()
+        interval = self.poll_max
+        fetch = None
+        try:
+            while True:
+                if fetch is None:
+                    if self.next_block > head:
+                        if until is not None and loop.time() >= until:
+                            return
+                        await asyncio.sleep(interval)
+                        interval = min(self.poll_max, interval * 2)
+                        head = await self._block_number()
+                        continue
+                    fetch = asyncio.create_task(self._fetch_logs(self.next_block, head))
+                logs, end = await fetch
+                self.next_block = end + 1
+                # prefetch the next chunk while this one is processed
+                fetch = asyncio.create_task(self._fetch_logs(self.next_block, head)) if self.next_block <= head else None
+                if logs:
+                    interval = self.poll_min
+                await self._store_logs(logs, end)
+                self.stats["blocks"] = end
+        finally:
+            if fetch is not None:
+                fetch.cancel()
 
+    async def _subscribe(self):
+        """Store logs pushed by an eth_subscribe("logs") subscription until the websocket closes.
+        The subscription starts before the gap up to the head is fetched, logs it pushes meanwhile wait in
+        the socket and those already fetched are skipped by the checkpoint.
+        """
+        async with ws_connect(self.ws_url) as ws:
+            await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe",
+                                      "params": ["logs", {"address": self.contract.address}]}))
+            while True:
+                reply = json.loads(await ws.recv())
+                if reply.get("id") == 1:
+                    break
+            if "error" in reply:
+                raise ConnectionError(f"eth_subscribe refused: {reply['error']}")
+            subscription = reply["result"]
+            logging.info(f"ArcHandler: subscribed to logs of {self.contract.address} ({subscription})")
+            await self._poll(until=0) # gap since the last stored block
+            async for message in ws:
+                params = json.loads(message).get("params") or {}
+                if params.get("subscription") != subscription:
+                    continue
+                log = self._format_log(params["result"])
+                if log.get("removed"):
+                    logging.warning(f"ArcHandler: ignoring log removed by a reorg at block {log['blockNumber']}")
+                    continue
+                block = log["blockNumber"]
+                if self.checkpoint and self._position(log) <= self.checkpoint:
+                    continue
+                await self._store_logs([log], block)
+                self.next_block = max(self.next_block, block)
+                self.stats["blocks"] = max(self.stats["blocks"], block)
+        raise ConnectionError("websocket closed")
 
-    def _decode_log(self, log):
-        for ev in [
-        self.contract.events.EscrowCreated,
-        self.contract.events.ShipmentLinked,
-        self.contract.events.FundsReleased,
-        self.contract.events.FundsRefunded,
-        self.contract.events.EscrowExtended,
-        self.contract.events.EscrowExpired,
-        self.contract.events.EscrowCancelled,
-    ]:
+    @staticmethod
+    def _format_log(log: dict) -> dict:
+        """A log as JSON-RPC sends it (hex quantities and strings) in the types web3's get_logs returns."""
+        log = dict(log)
+        for k in ("blockNumber", "logIndex", "transactionIndex"):
+            if isinstance(log.get(k), str):
+                log[k] = int(log[k], 16)
+        for k in ("blockHash", "transactionHash", "data"):
+            if isinstance(log.get(k), str):
+                log[k] = HexBytes(log[k])
+        if "topics" in log:
+            log["topics"] = [HexBytes(t) for t in log["topics"]]
+        if log.get("address"):
+            log["address"] = Web3.to_checksum_address(log["address"])
+        return log
+
+    async def _block_number(self) -> int:
+        return await asyncio.to_thread(lambda: self.w3.eth.block_number)
+
+    async def _fetch_logs(self, start: int, head: int) -> tuple[list, int]:
+        """get_logs from `start` for up to `chunk` blocks, returns the logs and the last block covered.
+        The chunk doubles after each full chunk the node served and halves when it refuses the range.
+        """
+        while True:
+            end = min(head, start + self.chunk - 1)
             try:
-                return ev().process_log(log)
-            except Exception:
+                logs = await asyncio.to_thread(self.w3.eth.get_logs, {"fromBlock": start, "toBlock": end, "address": self.contract.address})
+            except Exception as e:
+                if end > start and any(m in str(e).lower() for m in RANGE_ERRORS):
+                    self.chunk = max(1, (end - start + 1) // 2)
+                    logging.warning(f"ArcHandler: get_logs {start}-{end} refused, chunk now {self.chunk}: {e}")
+                    continue
+                logging.error(f"ArcHandler: get_logs {start}-{end} failed: {e}")
+                await asyncio.sleep(self.poll_max)
                 continue
-        return None
+            if end - start + 1 == self.chunk:
+                self.chunk = min(self.max_chunk, self.chunk * 2)
+            return logs, end
+
+    async def _store_logs(self, logs: list, end: int):
+        """Decode and save the logs of blocks up to `end` with the checkpoint in one batch.
+        A failed save is retried, moving on would leave the checkpoint past events that were never stored.
+        """
+        logging.info(f"ArcHandler: captured {len(logs)} event logs")
+        records = []
+        last = -1 # log index of the last log in block `end`
+        for log in logs:
+            try:
+                decoded = self._decode_log(log)
+                if decoded:
+                    position = self._position(decoded)
+                    if position[0] == end:
+                        last = max(last, position[1])
+                    if self.checkpoint and position <= self.checkpoint:
+                        continue # stored before the restart
+                    record = self._to_record(decoded)
+                    if record:
+                        records.append(record)
+            except Exception as e:
+                logging.error(f"Decode error: {e}")
+        checkpoint = max(self.checkpoint, (end, last)) if self.checkpoint else (end, last) # never moves back
+        while True:
+            try:
+                await self.storage.save_escrow_events(records, checkpoint)
+                break
+            except Exception as e:
+                logging.error(f"Error saving {len(records)} events, retrying: {e}")
+                await asyncio.sleep(self.poll_max)
+        self.checkpoint = checkpoint
+        self.stats["events"] += len(records)
+
+    @staticmethod
+    def _position(event) -> tuple[int, int]:
+        return (event["blockNumber"], event.get("logIndex", 0))
+
+    def _decode_log(self, log):
+        return decode_log(self.contract, log)
     
     async def handle_event(self, event):
         """Decode and persist event"""
         logging.info("ArcHandler: Started Processing Event")
         try:
-            escrow_id = event["args"]["escrowId"]
-            etype = event["event"]  # e.g. "EscrowCreated"
-            data = dict(event["args"])
-            logging.info(f"Event {etype} for escrow {escrow_id}")
-            # Map event name → EscrowType
-            from core import EscrowType
-            mapping = {
-                "EscrowCreated": EscrowType.CREATED,
-                "ShipmentLinked": EscrowType.LINKED,
-                "EscrowExtended": EscrowType.EXTENDED,
-                "EscrowCancelled": EscrowType.CANCELLED,
-                "EscrowExpired": EscrowType.EXPIRED,
-                "FundsRefunded": EscrowType.REFUNDED,
-                "FundsReleased": EscrowType.RELEASED,
-            }
-
-            if etype in mapping:
-                await self.storage.save_escrow_event(escrow_id=escrow_id,type= mapping[etype], event_data=json.dumps(data))
+            record = self._to_record(event)
+            if record:
+                await self.storage.save_escrow_events([record])
         except Exception as e:
             logging.error(f"Error handling event: {e}")
+
+    def _to_record(self, event) -> Optional[tuple[int, "EscrowType", dict]]:
+        """(escrow_id, type, event_data) for Storage.save_escrow_events, None for unknown events."""
+        escrow_id = event["args"]["escrowId"]
+        etype = event["event"]  # e.g. "EscrowCreated"
+        data = dict(event["args"])
+        if event.get("blockNumber") is not None:
+            data["blockNumber"] = event["blockNumber"]
+        logging.info(f"Event {etype} for escrow {escrow_id}")
+        # Map event name → EscrowType
+        mapping = {
+            "EscrowCreated": EscrowType.CREATED,
+            "ShipmentLinked": EscrowType.LINKED,
+            "EscrowExtended": EscrowType.EXTENDED,
+            "EscrowCancelled": EscrowType.CANCELLED,
+            "EscrowExpired": EscrowType.EXPIRED,
+            "FundsRefunded": EscrowType.REFUNDED,
+            "FundsReleased": EscrowType.RELEASED,
+        }
+        if etype not in mapping:
+            return None
+        # uint256 values past 64 bits (token amounts) don't fit a msgpack or orjson integer
+        data = {k: str(v) if isinstance(v, int) and v >= 2**64 else v for k, v in data.items()}
+        return (escrow_id, mapping[etype], data)
     
     ## unused
     def GetEscrows(self):
@@ -293,35 +1169,75 @@ class ArcHandler:
             logging.error(f"Error fetching escrows: {e}")
             return []
 ##
-    def _send_tx(self, fn, *args):
-        """Helper to sign and send a transaction"""
-        tx = fn(*args).build_transaction({
-            "from": self.agent.address,
-            "nonce": self.w3.eth.get_transaction_count(self.agent.address),
-            "gas": 500000,
-            "gasPrice": self.w3.to_wei("5", "gwei"),
-        })
-        signed = self.agent.sign_transaction(tx)
-        tx_hash = self.w3.eth.send_raw_transaction(signed.raw_transaction)
-        receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+    async def _send_tx(self, fn, *args):
+        """Helper to sign and send a transaction, then wait for its receipt.
+        Nonces are handed out locally so concurrent transactions don't reuse the node's pending count.
+        A failed send gives its nonce back for the next transaction while others are still being sent;
+        the count is read again from the node only when none are, or when the node rejects the nonce.
+        """
+        async with self._nonce_lock:
+            await self._open_session()
+            if self._nonce is None:
+                self._nonce = await self.aw3.eth.get_transaction_count(self.agent.address, "pending")
+                self._chain_id = await self.aw3.eth.chain_id
+            if self._free_nonces:
+                nonce = heapq.heappop(self._free_nonces)
+            else:
+                nonce = self._nonce
+                self._nonce += 1
+            self._sending.add(nonce)
+        try:
+            tx = await fn(*args).build_transaction({
+                "from": self.agent.address,
+                "nonce": nonce,
+                "chainId": self._chain_id,
+                "gas": 500000,
+                "gasPrice": Web3.to_wei("5", "gwei"),
+            })
+            signed = self.agent.sign_transaction(tx)
+            tx_hash = await self.aw3.eth.send_raw_transaction(signed.raw_transaction)
+        except Exception as e:
+            async with self._nonce_lock:
+                self._sending.discard(nonce)
+                if not self._sending or any(m in str(e).lower() for m in NONCE_ERRORS):
+                    # the node's pending count covers every sent transaction, and it is right after a nonce error
+                    self._nonce = None
+                    self._free_nonces.clear()
+                else:
+                    # later nonces are still being sent, reloading the count now could hand them out twice
+                    heapq.heappush(self._free_nonces, nonce)
+            raise
+        self._sending.discard(nonce)
+        receipt = await self.aw3.eth.wait_for_transaction_receipt(tx_hash)
         return dict(receipt)
 
+    async def _open_session(self):
+        """Share one aiohttp session (and its connection pool) between all transactions."""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=int(os.getenv("TX_CONNECTIONS", "100")))
+            self._session = await self.aw3.provider.cache_async_session(aiohttp.ClientSession(connector=connector))
+
+    async def close(self):
+        if self._session is not None:
+            await self.aw3.provider.disconnect()
+            self._session = None
+
     async def Release(self, id, reason:str):
         """add query shipment"""
-        return await asyncio.to_thread(self._send_tx, self.contract.functions.releaseFunds, id, reason)
+        return await self._send_tx(self.acontract.functions.releaseFunds, id, reason)
 
     async def Refund(self, id, reason:str):
-        return await asyncio.to_thread(self._send_tx, self.contract.functions.refund, id, reason)
+        return await self._send_tx(self.acontract.functions.refund, id, reason)
 
     async def ExtendEscrow(self, id, secs, reason:str):
-        return await asyncio.to_thread(self._send_tx, self.contract.functions.extendEscrow, id, secs, reason)
+        return await self._send_tx(self.acontract.functions.extendEscrow, id, secs, reason)
 
     async def FinalizeExpiredRefund(self, id, reason:str):
-        return await asyncio.to_thread(self._send_tx, self.contract.functions.finalizeExpiredRefund, id, reason)
+        return await self._send_tx(self.acontract.functions.finalizeExpiredRefund, id, reason)
     
     async def _check_shipment(self, id):
         """Peform a additionnal check to ensure that shipment was indeed delivered"""
         val = await self.storage.get_latest(id) ## the latest should either be LINKED or EXTENDED
         if val:
-            valdict = json.loads(val[1])
+            valdict = load_value(val[1])
             return valdict["shipmentId"]
\ No newline at end of file
@@ -11,12 +11,18 @@ class DummyDB:
         self.store[key] = value
     def get(self, key):
         return self.store.get(key)
+    def put_many(self, items):
+        for key, value in items:
+            self.put(key, value)
+    def get_many(self, keys):
+        found = {k: self.store[k] for k in keys if k in self.store}
+        return found, [k for k in keys if k not in found]
 
 @pytest.mark.asyncio
-async def test_full_pipeline_lifecycle():
+async def test_full_pipeline_lifecycle(tmp_path):
     # Setup
     cache = Cache()
-    db = DB()
+    db = DB(path=str(tmp_path / "db"))
     storage = Storage(db=db, cache=cache)
     scheduler = TimerScheduler()
     runner_results = []
@@ -62,11 +68,11 @@ async def test_full_pipeline_lifecycle():
     assert reintroduced == [3]
 
 @pytest.mark.asyncio
-async def test_check_shipment():
+async def test_check_shipment(tmp_path):
     cache = Cache()
-    db = DB()
+    db = DB(path=str(tmp_path / "db"))
     storage = Storage(db=db, cache=cache)
     scheduler = TimerScheduler()
-    arc = ArcHandler()
+    arc = ArcHandler(storage=storage)
     await arc.storage.save_escrow_event(17, EscrowType.LINKED, "{\"shipmentId\":\"123\"}")
     assert await arc._check_shipment(17) == "123"
@@ -1,5 +1,6 @@
-import asyncio, time, pytest
+import asyncio, os, tempfile, time, pytest
 from core import ArcHandler, Cache, EscrowType, Storage, TimerScheduler, BatchRunner
+from db import DB
 import logging
 import json
 
@@ -76,6 +77,169 @@ async def test_timer_scheduler_orders_multiple():
     task.cancel()
     assert order == [1, 2]
 
+@pytest.mark.asyncio
+async def test_timer_scheduler_wakes_for_earlier_timer():
+    fired = []
+    async def cb(entry): fired.append((entry.escrow_id, time.time()))
+    sched = TimerScheduler()
+    sched.set_timer(1, delay=10, reason="late")
+    task = asyncio.create_task(sched.run(cb))
+    await asyncio.sleep(0.05)
+    start = time.time()
+    sched.set_timer(2, delay=0.1, reason="early")
+    await asyncio.sleep(0.3)
+    task.cancel()
+    assert [i for i, _ in fired] == [2]
+    assert fired[0][1] - start < 0.2
+    assert sched.stats["fired"] == 1
+    assert sched.stats["max_lag"] < 0.1
+
+def test_timer_scheduler_keeps_earliest_per_escrow():
+    sched = TimerScheduler()
+    first = sched.set_timer(5, delay=10, reason="recheck")
+    assert sched.set_timer(5, delay=30, reason="later") is first
+    earlier = sched.set_timer(5, delay=2, reason="sooner")
+    assert sched.get(5) is earlier
+    replaced = sched.set_timer(5, delay=60, reason="replace", replace=True)
+    assert sched.get(5) is replaced
+    assert len(sched) == 1
+
+@pytest.mark.asyncio
+async def test_timer_scheduler_cancel():
+    fired = []
+    async def cb(entry): fired.append(entry.escrow_id)
+    sched = TimerScheduler()
+    sched.set_timer(1, delay=0.1, reason="a")
+    sched.set_timer(2, delay=0.1, reason="b")
+    assert sched.cancel(1)
+    assert not sched.cancel(1)
+    task = asyncio.create_task(sched.run(cb))
+    await asyncio.sleep(0.3)
+    task.cancel()
+    assert fired == [2]
+
+@pytest.mark.asyncio
+async def test_timer_scheduler_slow_callback_does_not_block_others():
+    fired = []
+    async def cb(entry):
+        if entry.escrow_id == 1:
+            await asyncio.sleep(1)
+        fired.append(entry.escrow_id)
+    sched = TimerScheduler(max_inflight=4)
+    sched.set_timer(1, delay=0, reason="slow")
+    sched.set_timer(2, delay=0.05, reason="fast")
+    task = asyncio.create_task(sched.run(cb))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    assert fired == [2]
+
+@pytest.mark.asyncio
+async def test_timer_scheduler_runs_one_callback_per_escrow():
+    active, overlaps, fired = set(), [], []
+    async def cb(entry):
+        if entry.escrow_id in active:
+            overlaps.append(entry.escrow_id)
+        active.add(entry.escrow_id)
+        await asyncio.sleep(0.1)
+        active.discard(entry.escrow_id)
+        fired.append(entry.reason)
+    sched = TimerScheduler()
+    sched.set_timer(1, delay=0, reason="first")
+    task = asyncio.create_task(sched.run(cb))
+    await asyncio.sleep(0.02)
+    sched.set_timer(1, delay=0, reason="second")  # due while "first" is still running
+    await asyncio.sleep(0.3)
+    task.cancel()
+    assert fired == ["first", "second"]
+    assert overlaps == []
+
+@pytest.mark.asyncio
+async def test_timer_scheduler_retries_with_backoff():
+    attempts = []
+    async def cb(entry):
+        attempts.append((entry.attempt, time.time()))
+        raise RuntimeError("rpc down")
+    sched = TimerScheduler(max_attempts=3, retry_base=0.05)
+    sched.set_timer(9, delay=0, reason="release funds")
+    task = asyncio.create_task(sched.run(cb))
+    await asyncio.sleep(0.4)
+    task.cancel()
+    assert [a for a, _ in attempts] == [1, 2, 3]
+    assert attempts[2][1] - attempts[1][1] >= attempts[1][1] - attempts[0][1]
+    assert sched.get(9) is None
+
+@pytest.fixture
+def timer_db():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "data"), index_path=os.path.join(tmpdir, "index"))
+        yield db
+        db.close()
+
+@pytest.mark.asyncio
+async def test_timer_scheduler_survives_restart(timer_db):
+    sched = TimerScheduler(db=timer_db)
+    sched.set_timer(1, delay=60, reason="release funds")
+    sched.set_timer(2, delay=60, reason="recheck")
+    sched.set_timer(3, delay=60, reason="cancelled")
+    sched.cancel(3)
+    sched.flush()
+
+    restarted = TimerScheduler(db=timer_db)
+    assert await restarted.load() == 2
+    assert restarted.get(1).reason == "release funds"
+    assert restarted.get(3) is None
+
+@pytest.mark.asyncio
+async def test_timer_journal_through_async_db(timer_db):
+    from db.offload import AsyncDB
+    adb = AsyncDB(timer_db)
+    sched = TimerScheduler(db=adb)
+    sched.set_timer(1, delay=60, reason="release funds")
+    sched.set_timer(2, delay=60, reason="cancelled")
+    sched.cancel(2)
+    await sched.flush()  # written by the writer thread
+    restarted = TimerScheduler(db=adb)
+    assert await restarted.load() == 1
+    assert restarted.get(1).reason == "release funds"
+    adb._queue.put(None)
+    adb._writer.join()
+
+@pytest.mark.asyncio
+async def test_timer_drain_writes_final_flush_before_close(timer_db):
+    from db.offload import AsyncDB
+    adb = AsyncDB(timer_db)
+    sched = TimerScheduler(db=adb, flush_interval=60)
+    task = asyncio.create_task(sched.run(lambda entry: None))
+    sched.set_timer(1, delay=60, reason="release funds")
+    await asyncio.sleep(0)
+    task.cancel()  # shutdown: run() starts its last flush on the way out
+    await asyncio.gather(task, return_exceptions=True)
+    sched.set_timer(2, delay=60, reason="recheck")
+    await sched.drain()
+    assert adb._queue.empty()
+    assert [k for k, _ in timer_db.iterate("tm:")] == ["tm:1", "tm:2"]
+    await adb.close()
+
+@pytest.mark.asyncio
+async def test_timer_scheduler_staggers_overdue_timers(timer_db):
+    sched = TimerScheduler(db=timer_db)
+    sched.set_timer(1, delay=-5, reason="most overdue")
+    sched.set_timer(2, delay=-1, reason="overdue")
+    sched.flush()
+
+    fired = []
+    async def cb(entry): fired.append((entry.escrow_id, time.time()))
+    restarted = TimerScheduler(db=timer_db, overdue_spacing=0.1)
+    await restarted.load()
+    task = asyncio.create_task(restarted.run(cb))
+    await asyncio.sleep(0.3)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert [i for i, _ in fired] == [1, 2]
+    assert fired[1][1] - fired[0][1] >= 0.09
+    # fired timers are removed from the journal
+    assert list(timer_db.iterate("tm:")) == []
+
 @pytest.mark.asyncio
 async def test_batch_runner_triggers():
     c = Cache()
@@ -187,10 +351,514 @@ async def test_seen_count_affects_ordering():
     await c.add(1, EscrowType.LINKED)
     await c.add(2, EscrowType.LINKED)
     batch1 = await c.pop_batch(1)
+    await c.requeue(batch1[0].escrow_id)
     batch2 = await c.pop_batch(2)
     # Escrow 1 should now have higher seen_count, so escrow 2 comes first
     assert [e.escrow_id for e in batch2] == [2, 1]
 
+@pytest.mark.asyncio
+async def test_pop_batch_skips_locked_entries():
+    c = Cache()
+    await c.add(1, EscrowType.LINKED)
+    await c.add(2, EscrowType.LINKED)
+    first = await c.pop_batch(1)
+    second = await c.pop_batch(5)
+    assert [e.escrow_id for e in first] == [1]
+    assert [e.escrow_id for e in second] == [2]
+    assert await c.pop_batch(5) == []
+
+@pytest.mark.asyncio
+async def test_cache_add_reprioritizes_on_new_state():
+    c = Cache()
+    await c.add(1, EscrowType.LINKED)
+    await c.add(2, EscrowType.EXTENDED)
+    await c.add(1, EscrowType.EXPIRED)
+    batch = await c.pop_batch(2)
+    assert [(e.escrow_id, e.etype) for e in batch] == [(1, EscrowType.EXPIRED), (2, EscrowType.EXTENDED)]
+
+def test_escrow_heap_matches_sorted_order():
+    import random
+    from core import EscrowHeap, EscrowRef
+    rng = random.Random(7)
+    heap = EscrowHeap()
+    refs = {}
+    for i in range(500):
+        ref = EscrowRef(escrow_id=i, etype=rng.choice(list(EscrowType)), first_seen_at=rng.random(), last_seen_at=0)
+        refs[i] = ref
+        heap.push(ref)
+    for i in rng.sample(range(500), 100):
+        heap.remove(i)
+        del refs[i]
+    for i in rng.sample(sorted(refs), 100):
+        refs[i].seen_count += rng.randint(1, 3)
+        refs[i].refresh_index()
+        heap.update(refs[i])
+    popped = [heap.pop().escrow_id for _ in range(len(heap))]
+    assert popped == [r.escrow_id for r in sorted(refs.values())]
+
+@pytest.mark.asyncio
+async def test_lease_ack_removes_entry():
+    c = Cache()
+    await c.add(1, EscrowType.LINKED)
+    [ref] = await c.checkout(1, ttl=10)
+    assert await c.ack(1, ref.lease_token)
+    assert 1 not in c._entries
+
+@pytest.mark.asyncio
+async def test_lease_nack_requeues_after_backoff():
+    c = Cache(backoff_base=0.05)
+    await c.add(1, EscrowType.LINKED)
+    [ref] = await c.checkout(1, ttl=10)
+    assert await c.nack(1, ref.lease_token)
+    assert await c.checkout(1) == []  # still backing off
+    await asyncio.sleep(0.06)
+    batch = await c.checkout(1)
+    assert [e.escrow_id for e in batch] == [1]
+    assert batch[0].retries == 1
+
+@pytest.mark.asyncio
+async def test_lease_expiry_requeues_and_rejects_stale_ack():
+    c = Cache()
+    await c.add(1, EscrowType.EXPIRED)
+    [stale] = await c.checkout(1, ttl=0.05)
+    stale_token = stale.lease_token
+    await asyncio.sleep(0.1)
+    [fresh] = await c.checkout(1, ttl=10)
+    assert fresh.escrow_id == 1
+    # the first consumer lost its lease and can't ack anymore
+    assert not await c.ack(1, stale_token)
+    assert await c.ack(1, fresh.lease_token)
+
+@pytest.mark.asyncio
+async def test_batch_runner_nacks_failed_batch():
+    c = Cache(backoff_base=0.01)
+    await c.add(1, EscrowType.LINKED)
+    calls = []
+    async def flaky_ai(batch):
+        calls.append([e.escrow_id for e in batch])
+        if len(calls) == 1:
+            raise RuntimeError("model unavailable")
+    runner = BatchRunner(c, threshold=1, interval=10)
+    task = asyncio.create_task(runner.run(flaky_ai))
+    await asyncio.sleep(1.5)
+    task.cancel()
+    assert calls == [[1], [1]]
+    assert 1 not in c._entries
+
+@pytest.mark.asyncio
+async def test_batch_runner_flushes_expired_immediately():
+    c = Cache()
+    results = []
+    async def fake_ai(batch): results.extend([e.escrow_id for e in batch])
+    runner = BatchRunner(c, threshold=10, interval=10)
+    task = asyncio.create_task(runner.run(fake_ai))
+    await asyncio.sleep(0.05)
+    await c.add(7, EscrowType.EXPIRED)
+    await asyncio.sleep(0.1)
+    task.cancel()
+    assert results == [7]
+    assert runner.decisions[-1].trigger == "priority"
+
+@pytest.mark.asyncio
+async def test_batch_runner_grows_batch_under_backlog():
+    c = Cache()
+    for i in range(40):
+        await c.add(i, EscrowType.LINKED)
+    sizes = []
+    async def fake_ai(batch): sizes.append(len(batch))
+    runner = BatchRunner(c, threshold=2, interval=10, max_batch=16)
+    task = asyncio.create_task(runner.run(fake_ai))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    assert sum(sizes) == 40
+    assert sizes[:4] == [2, 4, 8, 16]
+    assert [d.size for d in runner.decisions] == sizes
+
+@pytest.mark.asyncio
+async def test_batch_runner_shrinks_batch_on_slow_ai():
+    c = Cache()
+    for i in range(8):
+        await c.add(i, EscrowType.LINKED)
+    async def slow_ai(batch): await asyncio.sleep(0.05)
+    runner = BatchRunner(c, threshold=8, interval=10, target_latency=0.01)
+    task = asyncio.create_task(runner.run(slow_ai))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    assert runner.decisions[0].size == 8
+    assert runner.decisions[0].next_size == runner.min_batch
+
+@pytest.mark.asyncio
+async def test_batch_runner_pool_runs_concurrently_with_backpressure():
+    c = Cache()
+    for i in range(10):
+        await c.add(i, EscrowType.LINKED)
+    active, peak, done = 0, 0, []
+    async def slow_ai(batch):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        # idle escrows stay in the cache instead of piling up in the runner
+        assert c.pending >= 10 - len(done) - 5
+        await asyncio.sleep(0.1)
+        done.extend(e.escrow_id for e in batch)
+        active -= 1
+    runner = BatchRunner(c, threshold=10, interval=10, concurrency=5)
+    task = asyncio.create_task(runner.run(slow_ai))
+    await asyncio.sleep(0.35)
+    task.cancel()
+    assert sorted(done) == list(range(10))
+    assert peak == 5
+
+@pytest.mark.asyncio
+async def test_batch_runner_pool_never_overlaps_same_escrow():
+    c = Cache()
+    await c.add(1, EscrowType.LINKED)
+    active, overlaps, calls = set(), [], []
+    async def slow_ai(batch):
+        ref = batch[0]
+        if ref.escrow_id in active:
+            overlaps.append(ref.escrow_id)
+        active.add(ref.escrow_id)
+        calls.append(ref.escrow_id)
+        await asyncio.sleep(0.15)
+        active.discard(ref.escrow_id)
+    # lease shorter than the AI call: escrow 1 is handed out again while still running
+    runner = BatchRunner(c, threshold=1, interval=10, concurrency=3, lease_ttl=0.05)
+    task = asyncio.create_task(runner.run(slow_ai))
+    await asyncio.sleep(0.4)
+    task.cancel()
+    assert len(calls) >= 2
+    assert overlaps == []
+
+@pytest.mark.asyncio
+async def test_batch_runner_pool_idle_does_not_spin():
+    c = Cache()
+    waits = 0
+    wait_changed = c.wait_changed
+    async def counting_wait(generation, timeout=None):
+        nonlocal waits
+        waits += 1
+        return await wait_changed(generation, timeout)
+    c.wait_changed = counting_wait
+    async def ai(batch):
+        await asyncio.sleep(0.5)
+    runner = BatchRunner(c, interval=0.05, concurrency=4)
+    task = asyncio.create_task(runner.run(ai))
+    # idle well past `interval`
+    await asyncio.sleep(0.3)
+    assert waits <= 2
+    # busy workers: the runner waits for them or for new escrows, not in a loop
+    await c.add(1, EscrowType.LINKED)
+    await asyncio.sleep(0.3)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert waits <= 4
+
+
+class StandInEth:
+    """get_logs / block_number of a node with one EscrowCreated every other block.
+    Ranges matching more than max_results logs are refused like public RPC nodes do.
+    """
+    def __init__(self, head, max_results):
+        self.block_number = head
+        self.max_results = max_results
+        self.ranges = []
+    def get_logs(self, params):
+        frm, to = params["fromBlock"], params["toBlock"]
+        logs = [{"event": "EscrowCreated", "args": {"escrowId": b}, "blockNumber": b} for b in range(frm, to + 1) if b % 2 == 0]
+        if len(logs) > self.max_results:
+            raise ValueError({"code": -32005, "message": f"query returned more than {self.max_results} results"})
+        self.ranges.append((frm, to))
+        return logs
+
+@pytest.mark.asyncio
+async def test_listen_events_chunks_adapt_to_node_limits(timer_db):
+    from types import SimpleNamespace
+    eth = StandInEth(head=999, max_results=50)
+    arc = ArcHandler(storage=Storage(db=timer_db), chunk=400, max_chunk=1000, poll_min=0.01, poll_max=0.05)
+    arc.w3 = SimpleNamespace(eth=eth)
+    arc.contract = SimpleNamespace(address="0x" + "1" * 40)
+    arc._decode_log = lambda log: log
+    task = asyncio.create_task(arc.listen_events(from_block=0))
+    for _ in range(100):
+        await asyncio.sleep(0.02)
+        if arc.stats["blocks"] == 999:
+            break
+    # caught up: new blocks are picked up by polling
+    eth.block_number = 1009
+    await asyncio.sleep(0.2)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert arc.stats["events"] == 505
+    assert eth.ranges[0][0] == 0 and eth.ranges[-1][1] == 1009
+    assert all(b[0] == a[1] + 1 for a, b in zip(eth.ranges, eth.ranges[1:]))  # contiguous, no gaps
+    assert max(to - frm + 1 for frm, to in eth.ranges) <= 100  # shrunk to what the node serves
+    assert await arc.storage.get_latest(998) is not None
+
+@pytest.mark.asyncio
+async def test_listen_events_resumes_from_checkpoint(timer_db):
+    from types import SimpleNamespace
+    storage = Storage(db=timer_db)
+    # a previous run stored block 4 up to log 0
+    await storage.save_escrow_events([(40, EscrowType.CREATED, "{}")], checkpoint=(4, 0))
+    logs = [{"event": "EscrowCreated", "args": {"escrowId": 10 * b + i}, "blockNumber": b, "logIndex": i}
+            for b, i in [(4, 0), (4, 1), (6, 0), (7, 0), (7, 1)]]
+    eth = SimpleNamespace(block_number=7, ranges=[])
+    def get_logs(params):
+        eth.ranges.append((params["fromBlock"], params["toBlock"]))
+        return [log for log in logs if params["fromBlock"] <= log["blockNumber"] <= params["toBlock"]]
+    eth.get_logs = get_logs
+    arc = ArcHandler(storage=storage, chunk=2, poll_min=0.01, poll_max=0.05)
+    arc.w3 = SimpleNamespace(eth=eth)
+    arc.contract = SimpleNamespace(address="0x" + "1" * 40)
+    arc._decode_log = lambda log: log
+    task = asyncio.create_task(arc.listen_events())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert eth.ranges[0][0] == 4
+    assert arc.stats["events"] == 4  # (4, 0) is not stored twice
+    assert await storage.get_checkpoint() == (7, 1)
+    assert await storage.get_latest(41) is not None and await storage.get_latest(71) is not None
+
+@pytest.mark.asyncio
+async def test_records_are_stored_as_dicts(timer_db):
+    storage = Storage(db=timer_db)
+    arc = ArcHandler(storage=storage)
+    event = {"event": "EscrowCreated", "args": {"escrowId": 5, "amount": 10**20, "shipmentId": "s-5"}, "blockNumber": 9}
+    record = arc._to_record(event)
+    data = {"escrowId": 5, "amount": str(10**20), "shipmentId": "s-5", "blockNumber": 9}
+    assert record == (5, EscrowType.CREATED, data)  # uint256 past 64 bits kept as a decimal string
+    await storage.save_escrow_events([record], checkpoint=(9, 0))
+    timer_db.cache.clear()
+    assert timer_db.get("ec:5") == data
+    assert timer_db.get("latest:5") == {"state": "ec", "data": data}
+    assert timer_db.get(Storage.CHECKPOINT) == {"block": 9, "log_index": 0}
+    assert await storage.get_latest(5) == ("ec", data)
+    assert await storage.get_checkpoint() == (9, 0)
+    assert await arc._check_shipment(5) == "s-5"
+    sched = TimerScheduler(db=timer_db)
+    sched.set_timer(5, delay=60, reason="recheck")
+    sched.flush()
+    assert timer_db.get("tm:5")["reason"] == "recheck"
+
+@pytest.mark.asyncio
+async def test_storage_reads_records_stored_as_json_text(timer_db):
+    # what earlier versions (and the postgres backends) hand back: JSON text, latest:{id} nesting the event's text
+    event = json.dumps({"escrowId": 6, "shipmentId": "s-6"})
+    timer_db.put_many([
+        ("latest:6", json.dumps({"state": "lk", "data": event})),
+        (Storage.CHECKPOINT, json.dumps({"block": 3, "log_index": 2})),
+        ("tm:6", json.dumps({"due_at": time.time() + 60, "escrow_id": 6, "reason": "recheck", "attempt": 0})),
+    ])
+    storage = Storage(db=timer_db)
+    assert await storage.get_latest(6) == ("lk", event)
+    assert await storage.get_checkpoint() == (3, 2)
+    assert await storage.escrows_in_state(EscrowType.LINKED) == [6]
+    assert await ArcHandler(storage=storage)._check_shipment(6) == "s-6"
+    sched = TimerScheduler(db=timer_db)
+    assert await sched.load() == 1 and sched.get(6).reason == "recheck"
+
+class FakeNode:
+    """In-process node: get_logs/block_number for the HTTP side, a websocket JSON-RPC server for
+    eth_subscribe("logs"). Logs are kept as JSON-RPC sends them, with hex quantities.
+    """
+    def __init__(self):
+        self.logs = []
+        self.block_number = 0
+        self.sockets = set()
+        self.subscriptions = 0
+        self.refuse = False
+    def get_logs(self, params):
+        return [ArcHandler._format_log(log) for log in self.logs
+                if params["fromBlock"] <= int(log["blockNumber"], 16) <= params["toBlock"]]
+    def log(self, escrow_id, block, index=0):
+        return {"address": "0x" + "1" * 40, "topics": [], "data": "0x", "removed": False,
+                "blockNumber": hex(block), "logIndex": hex(index), "transactionIndex": "0x0",
+                "transactionHash": "0x" + "ab" * 32, "blockHash": "0x" + "cd" * 32,
+                "event": "EscrowCreated", "args": {"escrowId": escrow_id}}
+    async def emit(self, log, push=True):
+        if log not in self.logs:
+            self.logs.append(log)
+        self.block_number = max(self.block_number, int(log["blockNumber"], 16))
+        for ws in list(self.sockets) if push else []:
+            await ws.send(json.dumps({"jsonrpc": "2.0", "method": "eth_subscription",
+                                      "params": {"subscription": "0x5ub", "result": log}}))
+    async def handler(self, ws):
+        if self.refuse:
+            return await ws.close()
+        async for message in ws:
+            request = json.loads(message)
+            if request["method"] == "eth_subscribe":
+                self.subscriptions += 1
+                self.sockets.add(ws)
+                await ws.send(json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": "0x5ub"}))
+        self.sockets.discard(ws)
+    async def drop(self):
+        self.refuse = True
+        for ws in list(self.sockets):
+            await ws.close()
+
+async def wait_for(condition, timeout=3.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+@pytest.mark.asyncio
+async def test_listen_events_websocket_push_with_gap_fill_and_polling_fallback(timer_db):
+    from types import SimpleNamespace
+    from websockets.asyncio.server import serve
+    node = FakeNode()
+    for block in (2, 4):
+        await node.emit(node.log(block, block))
+    node.block_number = 5
+    async with serve(node.handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        arc = ArcHandler(storage=Storage(db=timer_db), chunk=4, poll_min=0.01, poll_max=0.05,
+                         ws_url=f"ws://127.0.0.1:{port}", ws_retry=0.2)
+        arc.w3 = SimpleNamespace(eth=node)
+        arc.contract = SimpleNamespace(address="0x" + "1" * 40)
+        arc._decode_log = lambda log: log
+        task = asyncio.create_task(arc.listen_events(from_block=0))
+        try:
+            # blocks before the subscription come from get_logs
+            await wait_for(lambda: node.subscriptions == 1 and arc.stats["events"] == 2)
+            await node.emit(node.log(6, 6))
+            await node.emit(node.log(4, 4))  # already stored
+            await wait_for(lambda: arc.stats["events"] == 3)
+            # websocket down: polling picks up new blocks
+            await node.drop()
+            await node.emit(node.log(8, 8), push=False)
+            await wait_for(lambda: arc.stats["events"] == 4)
+            # websocket back: subscribe again and fill the gap
+            node.refuse = False
+            await node.emit(node.log(9, 9), push=False)
+            await wait_for(lambda: node.subscriptions == 2 and arc.stats["events"] == 5)
+            await node.emit(node.log(10, 10))
+            await wait_for(lambda: arc.stats["events"] == 6)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    assert arc.stats["events"] == 6
+    assert await arc.storage.get_checkpoint() == (10, 0)
+    assert all([await arc.storage.get_latest(i) is not None for i in (2, 4, 6, 8, 9, 10)])
+
+class FakeRPC:
+    """In-process JSON-RPC node for transactions: receipts show up `mined_after` seconds after the send.
+    Sends are accepted `send_delay` seconds after they arrive; `fail_next` rejects the next one for its nonce,
+    `fail_nonce` rejects the one with that nonce for another reason.
+    """
+    def __init__(self, mined_after):
+        self.mined_after = mined_after
+        self.sent = {} # tx hash -> (nonce, sent at)
+        self.fail_next = False
+        self.fail_nonce = None
+        self.send_delay = 0.0
+    async def handle(self, request):
+        from aiohttp import web
+        import rlp
+        from eth_utils import keccak
+        body = await request.json()
+        method, params = body["method"], body["params"]
+        result = None
+        if method == "eth_chainId":
+            result = "0x539"
+        elif method == "eth_getTransactionCount":
+            # "pending" stops at the first gap, later nonces wait in the queue
+            nonces = {n for n, _ in self.sent.values()}
+            result = hex(next(n for n in range(len(nonces) + 1) if n not in nonces))
+        elif method == "eth_sendRawTransaction":
+            if self.fail_next:
+                self.fail_next = False
+                return web.json_response({"jsonrpc": "2.0", "id": body["id"], "error": {"code": -32000, "message": "nonce too low"}})
+            raw = bytes.fromhex(params[0][2:])
+            nonce = int.from_bytes(rlp.decode(raw)[0], "big")
+            if nonce == self.fail_nonce:
+                self.fail_nonce = None
+                return web.json_response({"jsonrpc": "2.0", "id": body["id"], "error": {"code": -32000, "message": "insufficient funds for gas * price + value"}})
+            await asyncio.sleep(self.send_delay)
+            tx_hash = "0x" + keccak(raw).hex()
+            self.sent[tx_hash] = (nonce, time.monotonic())
+            result = tx_hash
+        elif method == "eth_getTransactionReceipt":
+            nonce, at = self.sent[params[0]]
+            if time.monotonic() - at >= self.mined_after:
+                result = {"transactionHash": params[0], "blockHash": "0x" + "cd" * 32, "blockNumber": hex(nonce + 1),
+                          "transactionIndex": "0x0", "status": "0x1", "gasUsed": "0x5208", "cumulativeGasUsed": "0x5208",
+                          "logs": [], "logsBloom": "0x" + "00" * 256, "from": "0x" + "1" * 40, "to": "0x" + "2" * 40,
+                          "contractAddress": None, "effectiveGasPrice": "0x1", "type": "0x0"}
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": result})
+
+@pytest.mark.asyncio
+async def test_transactions_in_flight_together_with_local_nonces():
+    from aiohttp import web
+    from eth_account import Account
+    rpc = FakeRPC(mined_after=0.0)
+    app = web.Application()
+    app.router.add_post("/", rpc.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    with open("trustmesh.json") as f:
+        abi = json.load(f)
+    arc = ArcHandler(f"http://127.0.0.1:{port}", "0x" + "2" * 40, abi, Account.create().key.hex(), storage=Storage(db=object()))
+    try:
+        # more than the default executor has threads, each waiting 0.3s on its receipt
+        count = 64
+        elapsed = {}
+        for rpc.mined_after in (0.0, 0.3):
+            start = time.monotonic()
+            receipts = await asyncio.gather(*(arc.Release(i, "delivered") for i in range(count)))
+            elapsed[rpc.mined_after] = time.monotonic() - start
+            assert all(r["status"] == 1 for r in receipts)
+        assert sorted(n for n, _ in rpc.sent.values()) == list(range(2 * count))
+        assert elapsed[0.3] < elapsed[0.0] + 0.3 * 3  # the waits overlap instead of queueing for threads
+        # a failed send resyncs the nonce from the node
+        rpc.fail_next = True
+        with pytest.raises(Exception):
+            await arc.Refund(1, "fraud")
+        await arc.Refund(2, "fraud")
+        assert sorted(n for n, _ in rpc.sent.values()) == list(range(2 * count + 1))
+    finally:
+        await arc.close()
+        await runner.cleanup()
+
+@pytest.mark.asyncio
+async def test_failed_send_gives_its_nonce_back_while_others_are_sending():
+    from aiohttp import web
+    from eth_account import Account
+    rpc = FakeRPC(mined_after=0.0)
+    app = web.Application()
+    app.router.add_post("/", rpc.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    with open("trustmesh.json") as f:
+        abi = json.load(f)
+    arc = ArcHandler(f"http://127.0.0.1:{port}", "0x" + "2" * 40, abi, Account.create().key.hex(), storage=Storage(db=object()))
+    try:
+        rpc.fail_nonce, rpc.send_delay = 3, 0.3
+        tasks = [asyncio.create_task(arc.Release(i, "delivered")) for i in range(8)]
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        failed = [t for t in tasks if t.done() and t.exception() is not None]
+        assert len(failed) == 1 and not all(t.done() for t in tasks)  # the others are still being sent
+        # sent while nonces 4..7 are in flight: reuses 3 instead of reloading the node's count
+        await arc.Refund(100, "fraud")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        nonces = [n for n, _ in rpc.sent.values()]
+        assert sorted(nonces) == list(range(8))  # unique, no gap
+        rpc.send_delay = 0.0
+        await arc.Refund(101, "fraud")
+        assert sorted(n for n, _ in rpc.sent.values()) == list(range(9))
+    finally:
+        await arc.close()
+        await runner.cleanup()
 
 def test_decode_log_returns_none_for_unknown():
     pytest.skip("Live testing")
@@ -4,6 +4,11 @@ backend = os.getenv("DB_BACKEND", "lmdb")
 if backend == "postgrestest":
     from .db_postgres_test import DB, DBError
 if backend == "postgres":
-    from .db_postgres import DB, DBError
+    if os.getenv("PG_SCHEMA", "kv") == "normalized":
+        from .db_postgres_normalized import DB, DBError
+    else:
+        from .db_postgres import DB, DBError
+elif backend == "postgres_async":
+    from .db_postgres_async import DB, DBError
 else:
     from .db_lmdb import DB, DBError
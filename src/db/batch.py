@@ -0,0 +1,50 @@
+class WriteBatch:
+    """Collects puts and deletes; the backend applies them in one transaction when the with-block exits cleanly.
+    The last operation on a key wins.
+
+        with db.batch() as b:
+            b.put("ec:1", data)
+            b.delete("tm:1")
+    """
+    def __init__(self, commit, error):
+        self._commit = commit
+        self._error = error
+        self.ops = {} # key -> value, None for a delete
+
+    def __len__(self):
+        return len(self.ops)
+
+    def put(self, key: str, value: str):
+        if not key:
+            raise self._error("Key can't be empty")
+        if not value:
+            raise self._error(f"Value can't be empty: {key}")
+        self.ops[key] = value
+
+    def delete(self, key: str):
+        if not key:
+            raise self._error("Key can't be empty")
+        self.ops[key] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.ops:
+            self._commit(self.ops)
+        return False
+
+
+class AsyncWriteBatch(WriteBatch):
+    """WriteBatch for async backends, `commit` is a coroutine function.
+
+        async with db.batch() as b:
+            b.put("ec:1", data)
+    """
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None and self.ops:
+            await self._commit(self.ops)
+        return False
@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+
+CACHE_BYTES = int(os.getenv("DB_CACHE_BYTES", 4 << 20))
+
+class LRUCache:
+    """Byte-bounded LRU read cache shared by the DB backends.
+    Entries are charged the size given to `set` (the backends pass the stored encoding plus the key).
+    A hit moves the key to the most recent end; the least recent entries are evicted once `max_bytes`
+    (or `max_entries`, when set) is exceeded. Values larger than the whole cache are not admitted.
+    Safe to share between threads (db.offload.AsyncDB reads and writes from worker threads).
+    Writers call `invalidate` after they commit, which bumps `version`. Readers note `version` before they
+    read and pass it to `set`, a value read before a write that has since been invalidated is not cached.
+    """
+    def __init__(self, max_bytes: int = CACHE_BYTES, max_entries: int = None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._items = OrderedDict() # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.version = 0 # bumped by every invalidate
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """Cached value or None, counting a hit or a miss."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, size: int, version: int = None):
+        """Cache `value`, unless `version` is given and a write was invalidated since it was read."""
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes or (self.max_entries is not None and len(self._items) > self.max_entries):
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def invalidate(self, keys):
+        """Drop written keys and make reads that started before the write skip `set`."""
+        with self._lock:
+            self.version += 1
+            for key in keys:
+                self._pop(key)
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,70 @@
+"""
+Value codecs for the LMDB backend.
+
+An encoded value is one header byte followed by the payload:
+    0x01 orjson, 0x02 msgpack, | 0x10 when the payload is zstd compressed.
+Values written before codecs existed are plain JSON text. JSON never starts with a byte below 0x20
+other than whitespace, which json.dumps does not emit, so any other first byte is read as JSON.
+
+A zstd dictionary for small event payloads is trained with `python -m db.zdict`.
+"""
+import json
+import os
+import orjson
+import ormsgpack
+import zstandard
+
+ORJSON = 0x01
+MSGPACK = 0x02
+ZSTD = 0x10
+
+CODEC = os.getenv("DB_CODEC", "msgpack")
+COMPRESS = os.getenv("DB_ZSTD", "0") == "1"
+DICT_PATH = os.getenv("DB_ZSTD_DICT", "")
+
+class CodecError(Exception):
+    pass
+
+class Codec:
+    def __init__(self, name: str = CODEC, compress: bool = COMPRESS, dictionary: bytes = None, level: int = 3):
+        """
+        name: "msgpack" or "orjson"
+        compress: zstd compress payloads
+        dictionary: trained zstd dictionary, defaults to the DB_ZSTD_DICT file when set
+        """
+        if name not in ("msgpack", "orjson"):
+            raise CodecError(f"Unknown codec: {name}")
+        self.name = name
+        self.compress = compress
+        if dictionary is None and DICT_PATH:
+            with open(DICT_PATH, "rb") as f:
+                dictionary = f.read()
+        zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        self._cctx = zstandard.ZstdCompressor(level=level, dict_data=zdict)
+        self._dctx = zstandard.ZstdDecompressor(dict_data=zdict)
+        self._header = MSGPACK if name == "msgpack" else ORJSON
+
+    def encode(self, value) -> bytes:
+        payload = ormsgpack.packb(value) if self._header == MSGPACK else orjson.dumps(value)
+        if self.compress:
+            return bytes([self._header | ZSTD]) + self._cctx.compress(payload)
+        return bytes([self._header]) + payload
+
+    def decode(self, raw: bytes):
+        """Decode a value in any format this module has written, whatever the configured codec."""
+        header = raw[0] if raw else 0x20
+        if header >= 0x20:
+            return json.loads(raw) # stored before codecs
+        payload = raw[1:]
+        if header & ZSTD:
+            payload = self._dctx.decompress(payload)
+            header &= ~ZSTD
+        if header == MSGPACK:
+            return ormsgpack.unpackb(payload)
+        if header == ORJSON:
+            return orjson.loads(payload)
+        raise CodecError(f"Unknown value header: {raw[0]:#04x}")
+
+def train_dictionary(samples, size: int = 16384) -> bytes:
+    """zstd dictionary trained on encoded (uncompressed) values."""
+    return zstandard.train_dictionary(size, list(samples)).as_bytes()
@@ -1,83 +1,210 @@
-import json
+import logging
+import os
 import lmdb as tool
-from collections import OrderedDict
 from utils import dighash
+from .batch import WriteBatch
+from .cache import CACHE_BYTES, LRUCache
+from .codec import Codec
 
-CACHESIZE = 30
+# 1: values and the key index in two environments (path, index_path)
+# 2: one environment with named sub-DBs: data (hash -> value), index (key -> hash), meta
+FORMAT_VERSION = 2
+MAP_SIZE = int(os.getenv("LMDB_MAP_SIZE", 1 << 30)) # data and index share one map now
 
 class DBError(Exception):
     pass
 
+def is_legacy(env) -> bool:
+    """True for a format 1 environment: values stored straight in the main DB."""
+    with env.begin() as txn:
+        return env.stat()["entries"] > 0 and txn.get(b"meta") is None
+
+def upgrade(env, index_path: str) -> int:
+    """Move a format 1 store into sub-DBs of `env` in one write transaction.
+    The old index environment at `index_path` is only read, it can be deleted afterwards.
+    Returns the number of keys moved.
+    """
+    if not is_legacy(env):
+        return 0
+    keys = []
+    if os.path.exists(index_path):
+        index = tool.open(index_path, readonly=True)
+        with index.begin() as txn:
+            keys = list(txn.cursor())
+        index.close()
+    with env.begin(write=True) as txn:
+        values = list(txn.cursor())
+        for k, _ in values:
+            txn.delete(k)
+        data = env.open_db(b"data", txn=txn)
+        idx = env.open_db(b"index", txn=txn)
+        meta = env.open_db(b"meta", txn=txn)
+        for k, v in values:
+            txn.put(k, v, db=data)
+        for k, h in keys:
+            txn.put(k, h, db=idx)
+        txn.put(b"format", str(FORMAT_VERSION).encode(), db=meta)
+    return len(keys)
+
 class DB:
-    def __init__(self, path="trustmesh.db", index_path="trustmesh_index.db", max_dbs=2):
-        self.cache = OrderedDict()
-        self.cache_size = CACHESIZE
-        self.db = tool.open(path, max_dbs=max_dbs)
-        self.index = tool.open(index_path, max_dbs=max_dbs)
+    def __init__(self, path="trustmesh.db", index_path="trustmesh_index.db", max_dbs=8, map_size=MAP_SIZE, cache_bytes=CACHE_BYTES, codec=None):
+        """
+        path: the LMDB environment
+        index_path: index environment of a format 1 store, migrated into `path` on open
+        max_dbs: named sub-DBs allowed, data/index/meta use three, the rest are for secondary indexes
+        map_size: upper bound of the environment in bytes, only reserved address space
+        cache_bytes: capacity of the read cache
+        codec: db.codec.Codec for values, from DB_CODEC / DB_ZSTD / DB_ZSTD_DICT by default
+        """
+        self.cache = LRUCache(cache_bytes)
+        self.codec = codec or Codec()
+        self.env = tool.open(path, max_dbs=max_dbs, map_size=map_size)
+        if is_legacy(self.env):
+            moved = upgrade(self.env, index_path)
+            logging.warning(f"DB: migrated {path} to storage format {FORMAT_VERSION} ({moved} keys)")
+        self._subdbs = {}
+        self.data = self.subdb("data")
+        self.index = self.subdb("index")
+        meta = self.subdb("meta")
+        with self.env.begin(write=True) as txn:
+            version = txn.get(b"format", db=meta)
+            if version is None:
+                txn.put(b"format", str(FORMAT_VERSION).encode(), db=meta)
+            elif int(version) > FORMAT_VERSION:
+                self.env.close()
+                raise DBError(f"{path} has storage format {int(version)}, this build reads up to {FORMAT_VERSION}")
 
-    def _cache_set(self, key, value):
-        if len(self.cache) >= self.cache_size:
-            self.cache.popitem(last=False)
-        self.cache[key] = value
+    def subdb(self, name: str):
+        """Handle of a named sub-DB of the environment, created on first use."""
+        if name not in self._subdbs:
+            self._subdbs[name] = self.env.open_db(name.encode())
+        return self._subdbs[name]
 
     def get(self, key: str):
         if not key:
             raise DBError("Key can't be empty")
-        if key in self.cache:
-            return self.cache[key]
-        with self.db.begin(write=False) as txn:
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        version = self.cache.version
+        with self.env.begin(write=False) as txn:
             hash_key = dighash(key.encode())
-            value = txn.get(hash_key)
+            value = txn.get(hash_key, db=self.data)
             if value is None:
                 raise DBError(f"Value for key {key} not found")
-            decoded = json.loads(value.decode())
-            self._cache_set(key, decoded)
+            decoded = self.codec.decode(value)
+            self.cache.set(key, decoded, len(key) + len(value), version)
             return decoded
 
+    def get_many(self, keys):
+        """Fetch several keys in one read transaction.
+        Returns (found, missing): a dict of key -> value and the list of keys not stored.
+        """
+        found, missing, todo = {}, [], []
+        for key in keys:
+            cached = self.cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                todo.append(key)
+        if todo:
+            version = self.cache.version
+            with self.env.begin(write=False) as txn:
+                for key in todo:
+                    value = txn.get(dighash(key.encode()), db=self.data)
+                    if value is None:
+                        missing.append(key)
+                        continue
+                    decoded = self.codec.decode(value)
+                    self.cache.set(key, decoded, len(key) + len(value), version)
+                    found[key] = decoded
+        return found, missing
+
     def put(self, key: str, value: str):
-        if not key:
-            raise DBError("Key can't be empty")
-        if not value:
-            raise DBError("Value can't be empty")
-        self._cache_set(key, value)
-        val = json.dumps(value)
-        hash_key = dighash(key.encode())
+        with self.batch() as b:
+            b.put(key, value)
+
+    def put_many(self, items):
+        """Insert several (key, value) pairs in one batch."""
+        with self.batch() as b:
+            for key, value in items:
+                b.put(key, value)
+
+    def delete(self, key: str):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        """Remove keys, missing keys are ignored."""
+        with self.batch() as b:
+            for key in keys:
+                b.delete(key)
+
+    def batch(self):
+        """Group puts and deletes into one write; see db.batch.WriteBatch."""
+        return WriteBatch(self._commit, DBError)
+
+    def _commit(self, ops):
+        # values and their index entries commit together
         try:
-            with self.db.begin(write=True) as txn:
-                txn.put(hash_key, val.encode())
-            with self.index.begin(write=True) as txn:
-                txn.put(key.encode(), hash_key)
+            with self.env.begin(write=True) as txn:
+                for key, value in ops.items():
+                    hash_key = dighash(key.encode())
+                    if value is None:
+                        txn.delete(key.encode(), db=self.index)
+                        txn.delete(hash_key, db=self.data)
+                    else:
+                        txn.put(hash_key, self.codec.encode(value), db=self.data)
+                        txn.put(key.encode(), hash_key, db=self.index)
         except Exception as e:
-            print(e)
-            raise DBError(f"Can't insert item: {key}:{value}")
+            raise DBError(f"Can't write {len(ops)} items: {e}")
+        # writes only invalidate, the next get caches the decoded value
+        self.cache.invalidate(ops)
 
-    def iterate(self, prefix: str):
+    def iterate(self, prefix: str, start_after: str = None, limit: int = None, keys_only: bool = False, page: int = 256):
         """
-        Iterate over all keys in the index database with a given prefix (e.g. 'ec:').
+        Yield (key, value) for every key with a given prefix (e.g. 'ec:'), in key order.
 
-        Returns:
-            prefix_bytes = prefix.encode()  # LMDB keys must be bytes, so encode the prefix
+        start_after: resume after this key, e.g. the last key seen by an earlier scan
+        limit: stop after this many rows
+        keys_only: yield keys alone, values are neither read nor decoded
+        page: rows read per read transaction, no transaction stays open while the caller runs
         """
-        results = []
-        with self.index.begin(write=False) as txn:
-            cursor = txn.cursor()
-            prefix_bytes = prefix.encode()
-            if cursor.set_range(prefix_bytes):
-                with self.db.begin(write=False) as dtxn:
-                    # iterate from the current cursor position and stop when keys no longer match the prefix
-                    for k, v in cursor:
-                        if not k.startswith(prefix_bytes):
-                            break
-                        # v is the hash_key, fetch from main DB
-                        val = dtxn.get(v)
+        prefix_bytes = prefix.encode() # LMDB keys must be bytes, so encode the prefix
+        after = start_after.encode() if start_after else None
+        left = limit
+        while left is None or left > 0:
+            rows, done = [], True
+            want = page if left is None else min(page, left)
+            with self.env.begin(write=False) as txn:
+                cursor = txn.cursor(db=self.index)
+                found = cursor.set_range(max(after, prefix_bytes) if after else prefix_bytes)
+                if found and cursor.key() == after:
+                    found = cursor.next()
+                # walk from the cursor position and stop when keys no longer match the prefix
+                while found and cursor.key().startswith(prefix_bytes):
+                    if len(rows) == want:
+                        done = False
+                        break
+                    k, v = cursor.item()
+                    after = k
+                    if keys_only:
+                        rows.append(k.decode())
+                    else:
+                        # v is the hash_key, fetch from the data sub-DB
+                        val = txn.get(v, db=self.data)
                         if val:
-                            # Decode key and value before appending for clarity
-                            decoded_key = k.decode()
-                            decoded_val = json.loads(val.decode())
-                            results.append((decoded_key, decoded_val))
-        return results
+                            rows.append((k.decode(), self.codec.decode(val)))
+                    found = cursor.next()
+            yield from rows
+            if done:
+                return
+            if left is not None:
+                left -= len(rows)
+
+    def cache_stats(self) -> dict:
+        """Read cache counters: entries, bytes, hits, misses, evictions and hit_rate."""
+        return self.cache.stats()
 
     def close(self):
         self.cache.clear()
-        self.db.close()
-        self.index.close()
+        self.env.close()
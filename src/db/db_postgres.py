@@ -1,103 +1,251 @@
+import csv
+import io
+import json
 import os
-import psycopg2
-from collections import OrderedDict
-from utils import dighash
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+from utils import dighash, newuuid
+from .batch import WriteBatch
+from .cache import CACHE_BYTES, LRUCache
 
-CACHESIZE = 30
 
 class DBError(Exception):
     pass
 
+BATCH_SIZE = int(os.getenv("PG_BATCH_SIZE", "1000")) # rows per multi-row upsert or COPY
+COPY_MIN = int(os.getenv("PG_COPY_MIN", "5000")) # writes of at least this many rows go through COPY
+POOL_MIN = int(os.getenv("PG_POOL_MIN", "2"))
+POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+
+def hash_text(key: str) -> str:
+    # the \x-hex text a bytes parameter turns into in the TEXT column, kept for existing rows
+    return "\\x" + dighash(key.encode()).hex()
+
+def text_value(value) -> str:
+    """A value as the TEXT column stores it: strings as they are, records (dicts, lists) as JSON."""
+    return value if isinstance(value, str) else json.dumps(value)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS kv_store (
+        hash_key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS kv_index (
+        key TEXT PRIMARY KEY,
+        hash_key TEXT NOT NULL REFERENCES kv_store(hash_key)
+    );
+    """,
+]
+
+UPSERT_VALUES = "INSERT INTO kv_store (hash_key, value) VALUES %s ON CONFLICT (hash_key) DO UPDATE SET value = EXCLUDED.value"
+UPSERT_INDEX = "INSERT INTO kv_index (key, hash_key) VALUES %s ON CONFLICT (key) DO UPDATE SET hash_key = EXCLUDED.hash_key"
+STAGING = "CREATE TEMP TABLE IF NOT EXISTS kv_staging (hash_key TEXT, key TEXT, value TEXT) ON COMMIT DELETE ROWS"
+MERGE_VALUES = """
+    INSERT INTO kv_store (hash_key, value) SELECT hash_key, value FROM kv_staging
+    ON CONFLICT (hash_key) DO UPDATE SET value = EXCLUDED.value
+"""
+MERGE_INDEX = """
+    INSERT INTO kv_index (key, hash_key) SELECT key, hash_key FROM kv_staging
+    ON CONFLICT (key) DO UPDATE SET hash_key = EXCLUDED.hash_key
+"""
+
 class DB:
-    def __init__(self, dsn=None):
+    """Key-value layout: values in kv_store under the sha256 of their key, keys in kv_index.
+    Each call takes its own connection from a thread-safe pool, so threads sharing the DB (db.offload.AsyncDB)
+    neither see each other's open transaction nor wait on one connection.
+    """
+    SCHEMA = SCHEMA
+
+    def __init__(self, dsn=None, cache_bytes=CACHE_BYTES, batch_size=BATCH_SIZE, copy_min=COPY_MIN,
+                 min_size=POOL_MIN, max_size=POOL_MAX):
         """
         dsn: Postgres connection string, e.g. from os.environ["DATABASE_URL"]
+        cache_bytes: capacity of the read cache
+        batch_size: rows sent per multi-row upsert or COPY
+        copy_min: writes of at least this many rows are COPYed into a staging table and merged
+        min_size, max_size: connections kept in the pool, max_size must cover the threads using the DB
         """
-        self.cache = OrderedDict()
-        self.cache_size = CACHESIZE
-        self.conn = psycopg2.connect(dsn or os.environ["DATABASE_URL"])
-        self.conn.autocommit = True
+        self.batch_size = batch_size
+        self.copy_min = copy_min
+        self.cache = LRUCache(cache_bytes)
+        self.pool = ThreadedConnectionPool(min_size, max_size, dsn or os.environ["DATABASE_URL"])
         self._init_schema()
 
+    @contextmanager
+    def _conn(self):
+        """An autocommit connection from the pool, returned (or dropped if broken) afterwards."""
+        conn = self.pool.getconn()
+        try:
+            conn.autocommit = True
+            yield conn
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+
     def _init_schema(self):
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS kv_store (
-                    hash_key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS kv_index (
-                    key TEXT PRIMARY KEY,
-                    hash_key TEXT NOT NULL REFERENCES kv_store(hash_key)
-                );
-            """)
-
-    def _cache_set(self, key, value):
-        if len(self.cache) >= self.cache_size:
-            self.cache.popitem(last=False)
-        self.cache[key] = value
+        with self._conn() as conn, conn.cursor() as cur:
+            for statement in self.SCHEMA:
+                cur.execute(statement)
 
     def get(self, key: str):
         if not key:
             raise DBError("Key can't be empty")
-        if key in self.cache:
-            return self.cache[key]
-
-        hash_key = dighash(key.encode())
-        with self.conn.cursor() as cur:
-            cur.execute("SELECT value FROM kv_store WHERE hash_key = %s", (hash_key,))
-            row = cur.fetchone()
-            if not row:
-                raise DBError(f"Value for key {key} not found")
-            decoded = row[0]
-            self._cache_set(key, decoded)
-            return decoded
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        version = self.cache.version
+        with self._conn() as conn, conn.cursor() as cur:
+            decoded = self._fetch(cur, key)
+        if decoded is None:
+            raise DBError(f"Value for key {key} not found")
+        self.cache.set(key, decoded, len(key) + len(decoded), version)
+        return decoded
+
+    def _fetch(self, cur, key: str):
+        cur.execute("SELECT value FROM kv_store WHERE hash_key = %s", (hash_text(key),))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        """Fetch several keys in one round trip.
+        Returns (found, missing): a dict of key -> value and the list of keys not stored.
+        """
+        found, todo = {}, []
+        for key in keys:
+            cached = self.cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                todo.append(key)
+        if todo:
+            version = self.cache.version
+            with self._conn() as conn, conn.cursor() as cur:
+                for k, v in self._fetch_many(cur, todo):
+                    self.cache.set(k, v, len(k) + len(v), version)
+                    found[k] = v
+        return found, [k for k in keys if k not in found]
+
+    def _fetch_many(self, cur, keys):
+        cur.execute("""
+            SELECT kv_index.key, kv_store.value
+            FROM kv_index
+            JOIN kv_store ON kv_index.hash_key = kv_store.hash_key
+            WHERE kv_index.key = ANY(%s)
+        """, (keys,))
+        return cur.fetchall()
 
     def put(self, key: str, value: str):
-        if not key:
-            raise DBError("Key can't be empty")
-        if not value:
-            raise DBError("Value can't be empty")
+        with self.batch() as b:
+            b.put(key, value)
+
+    @contextmanager
+    def _tx(self):
+        """Group statements in one transaction on a pooled autocommit connection."""
+        with self._conn() as conn, conn.cursor() as cur:
+            cur.execute("BEGIN")
+            try:
+                yield cur
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+
+    def put_many(self, items):
+        """Insert several (key, value) pairs in one batch."""
+        with self.batch() as b:
+            for key, value in items:
+                b.put(key, value)
 
-        self._cache_set(key, value)
-        hash_key = dighash(key.encode())
+    def delete(self, key: str):
+        self.delete_many([key])
 
+    def delete_many(self, keys):
+        """Remove keys, missing keys are ignored."""
+        with self.batch() as b:
+            for key in keys:
+                b.delete(key)
+
+    def batch(self):
+        """Group puts and deletes into one transaction; see db.batch.WriteBatch."""
+        return WriteBatch(self._commit, DBError)
+
+    def _commit(self, ops):
+        items = [(key, text_value(value)) for key, value in ops.items() if value is not None]
+        gone = [key for key, value in ops.items() if value is None]
         try:
-            with self.conn.cursor() as cur:
-                # Upsert into kv_store
-                cur.execute("""
-                    INSERT INTO kv_store (hash_key, value)
-                    VALUES (%s, %s)
-                    ON CONFLICT (hash_key) DO UPDATE SET value = EXCLUDED.value
-                """, (hash_key, value))
-                # Upsert into kv_index
-                cur.execute("""
-                    INSERT INTO kv_index (key, hash_key)
-                    VALUES (%s, %s)
-                    ON CONFLICT (key) DO UPDATE SET hash_key = EXCLUDED.hash_key
-                """, (key, hash_key))
+            with self._tx() as cur:
+                if gone:
+                    self._delete(cur, gone)
+                write = self._copy if len(items) >= self.copy_min else self._upsert
+                for i in range(0, len(items), self.batch_size):
+                    write(cur, items[i:i + self.batch_size])
         except Exception as e:
-            raise DBError(f"Can't insert item: {e}")
+            raise DBError(f"Can't write {len(ops)} items: {e}")
+        # writes only invalidate, the next get caches the value as read back
+        self.cache.invalidate(ops)
+
+    def _delete(self, cur, keys):
+        cur.execute("DELETE FROM kv_index WHERE key = ANY(%s)", (keys,))
+        cur.execute("DELETE FROM kv_store WHERE hash_key = ANY(%s)", ([hash_text(k) for k in keys],))
 
-    def iterate(self, prefix: str):
+    def _upsert(self, cur, items):
+        # one multi-row statement per table instead of a round trip per row
+        rows = [(hash_text(k), k, v) for k, v in items]
+        execute_values(cur, UPSERT_VALUES, [(h, v) for h, _, v in rows], page_size=self.batch_size)
+        execute_values(cur, UPSERT_INDEX, [(k, h) for h, k, _ in rows], page_size=self.batch_size)
+
+    def _copy(self, cur, items):
+        """COPY rows into the session's staging table and merge them into kv_store and kv_index."""
+        buf = io.StringIO()
+        csv.writer(buf).writerows((hash_text(k), k, v) for k, v in items)
+        buf.seek(0)
+        cur.execute(STAGING)
+        cur.copy_expert("COPY kv_staging (hash_key, key, value) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(MERGE_VALUES)
+        cur.execute(MERGE_INDEX)
+        cur.execute("TRUNCATE kv_staging")
+
+    def iterate(self, prefix: str, start_after: str = None, limit: int = None, keys_only: bool = False, page: int = 256):
+        """
+        Yield (key, value) for every key in the index with a given prefix (e.g. 'ec:'), in key order.
+
+        start_after: resume after this key, e.g. the last key seen by an earlier scan
+        limit: stop after this many rows
+        keys_only: yield keys alone, kv_store is not joined
+        page: rows fetched per round trip from the server-side cursor
         """
-        Iterate over all keys in the index with a given prefix (e.g. 'ec:').
+        query = self._scan_query(keys_only)
+        params = [prefix.replace("%", r"\%").replace("_", r"\_") + "%", start_after or ""]
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        # named (server-side) cursor, WITH HOLD so it works on the autocommit connection,
+        # which stays checked out until the scan ends
+        with self._conn() as conn, conn.cursor(name=f"iterate_{newuuid().hex}", withhold=True) as cur:
+            cur.itersize = page
+            cur.execute(query, params)
+            for row in cur:
+                yield row[0] if keys_only else (row[0], row[1])
+
+    def _scan_query(self, keys_only: bool) -> str:
+        """Rows of keys LIKE %s and > %s in key order."""
+        if keys_only:
+            return "SELECT key FROM kv_index WHERE key LIKE %s AND key > %s ORDER BY key"
+        return """
+            SELECT kv_index.key, kv_store.value
+            FROM kv_index
+            JOIN kv_store ON kv_index.hash_key = kv_store.hash_key
+            WHERE kv_index.key LIKE %s AND kv_index.key > %s
+            ORDER BY kv_index.key
         """
-        results = []
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                SELECT kv_index.key, kv_store.value
-                FROM kv_index
-                JOIN kv_store ON kv_index.hash_key = kv_store.hash_key
-                WHERE kv_index.key LIKE %s
-                ORDER BY kv_index.key
-            """, (prefix + '%',))
-            for k, v in cur.fetchall():
-                results.append((k, v))
-        return results
+
+    def cache_stats(self) -> dict:
+        """Read cache counters: entries, bytes, hits, misses, evictions and hit_rate."""
+        return self.cache.stats()
 
     def close(self):
         self.cache.clear()
-        self.conn.close()
+        self.pool.closeall()
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import asyncpg
+from .batch import AsyncWriteBatch
+from .cache import CACHE_BYTES, LRUCache
+from .db_postgres import (BATCH_SIZE, COPY_MIN, MERGE_INDEX, MERGE_VALUES, POOL_MAX, POOL_MIN, SCHEMA, STAGING,
+                          DBError, hash_text, text_value)
+
+GET = "SELECT value FROM kv_store WHERE hash_key = $1"
+GET_MANY = """
+    SELECT kv_index.key, kv_store.value
+    FROM kv_index
+    JOIN kv_store ON kv_index.hash_key = kv_store.hash_key
+    WHERE kv_index.key = ANY($1::text[])
+"""
+# multi-row upserts: one statement per chunk, rows passed as arrays
+PUT_VALUES = """
+    INSERT INTO kv_store (hash_key, value) SELECT * FROM unnest($1::text[], $2::text[])
+    ON CONFLICT (hash_key) DO UPDATE SET value = EXCLUDED.value
+"""
+PUT_INDEX = """
+    INSERT INTO kv_index (key, hash_key) SELECT * FROM unnest($1::text[], $2::text[])
+    ON CONFLICT (key) DO UPDATE SET hash_key = EXCLUDED.hash_key
+"""
+
+class DB:
+    """Postgres backend on an asyncpg connection pool, same tables and interface as db_postgres.DB
+    except that methods are coroutines, `batch()` is an async context manager and `iterate` an async
+    generator. asyncpg prepares each statement once per pooled connection and reuses it.
+    """
+    def __init__(self, dsn=None, cache_bytes=CACHE_BYTES, min_size=POOL_MIN, max_size=POOL_MAX,
+                 batch_size=BATCH_SIZE, copy_min=COPY_MIN):
+        """
+        dsn: Postgres connection string, e.g. from os.environ["DATABASE_URL"]
+        cache_bytes: capacity of the read cache
+        min_size, max_size: connections kept in the pool
+        batch_size: rows sent per multi-row upsert or COPY
+        copy_min: writes of at least this many rows are COPYed into a staging table and merged
+        """
+        self.batch_size = batch_size
+        self.copy_min = copy_min
+        self.dsn = dsn or os.environ["DATABASE_URL"]
+        self.cache = LRUCache(cache_bytes)
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def pool(self) -> asyncpg.Pool:
+        """The connection pool, created with the schema on first use."""
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+                    async with pool.acquire() as conn:
+                        for statement in SCHEMA:
+                            await conn.execute(statement)
+                    self._pool = pool
+        return self._pool
+
+    async def get(self, key: str):
+        if not key:
+            raise DBError("Key can't be empty")
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        pool = await self.pool()
+        version = self.cache.version # a put may commit while the fetch is awaited
+        value = await pool.fetchval(GET, hash_text(key))
+        if value is None:
+            raise DBError(f"Value for key {key} not found")
+        self.cache.set(key, value, len(key) + len(value), version)
+        return value
+
+    async def get_many(self, keys):
+        """Fetch several keys in one round trip.
+        Returns (found, missing): a dict of key -> value and the list of keys not stored.
+        """
+        found, todo = {}, []
+        for key in keys:
+            cached = self.cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                todo.append(key)
+        if todo:
+            pool = await self.pool()
+            version = self.cache.version
+            for k, v in await pool.fetch(GET_MANY, todo):
+                self.cache.set(k, v, len(k) + len(v), version)
+                found[k] = v
+        return found, [k for k in keys if k not in found]
+
+    async def put(self, key: str, value: str):
+        async with self.batch() as b:
+            b.put(key, value)
+
+    async def put_many(self, items):
+        """Insert several (key, value) pairs in one batch."""
+        async with self.batch() as b:
+            for key, value in items:
+                b.put(key, value)
+
+    async def delete(self, key: str):
+        await self.delete_many([key])
+
+    async def delete_many(self, keys):
+        """Remove keys, missing keys are ignored."""
+        async with self.batch() as b:
+            for key in keys:
+                b.delete(key)
+
+    def batch(self):
+        """Group puts and deletes into one transaction; see db.batch.AsyncWriteBatch."""
+        return AsyncWriteBatch(self._commit, DBError)
+
+    async def _commit(self, ops):
+        rows = [(hash_text(key), key, text_value(value)) for key, value in ops.items() if value is not None]
+        gone = [key for key, value in ops.items() if value is None]
+        pool = await self.pool()
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    if gone:
+                        await conn.execute("DELETE FROM kv_index WHERE key = ANY($1::text[])", gone)
+                        await conn.execute("DELETE FROM kv_store WHERE hash_key = ANY($1::text[])", [hash_text(k) for k in gone])
+                    copy = len(rows) >= self.copy_min
+                    for i in range(0, len(rows), self.batch_size):
+                        chunk = rows[i:i + self.batch_size]
+                        if copy:
+                            await self._copy(conn, chunk)
+                        else:
+                            hashes, keys, values = map(list, zip(*chunk))
+                            await conn.execute(PUT_VALUES, hashes, values)
+                            await conn.execute(PUT_INDEX, keys, hashes)
+        except Exception as e:
+            raise DBError(f"Can't write {len(ops)} items: {e}")
+        # writes only invalidate, the next get caches the value as read back
+        self.cache.invalidate(ops)
+
+    async def _copy(self, conn, rows):
+        """COPY rows into the session's staging table and merge them into kv_store and kv_index."""
+        await conn.execute(STAGING)
+        await conn.copy_records_to_table("kv_staging", records=rows, columns=["hash_key", "key", "value"])
+        await conn.execute(MERGE_VALUES)
+        await conn.execute(MERGE_INDEX)
+        await conn.execute("TRUNCATE kv_staging")
+
+    async def iterate(self, prefix: str, start_after: str = None, limit: int = None, keys_only: bool = False, page: int = 256):
+        """
+        Yield (key, value) for every key in the index with a given prefix (e.g. 'ec:'), in key order.
+
+        start_after: resume after this key, e.g. the last key seen by an earlier scan
+        limit: stop after this many rows
+        keys_only: yield keys alone, kv_store is not joined
+        page: rows prefetched per round trip from the server-side cursor
+        """
+        if keys_only:
+            query = "SELECT key FROM kv_index WHERE key LIKE $1 AND key > $2 ORDER BY key"
+        else:
+            query = """
+                SELECT kv_index.key, kv_store.value
+                FROM kv_index
+                JOIN kv_store ON kv_index.hash_key = kv_store.hash_key
+                WHERE kv_index.key LIKE $1 AND kv_index.key > $2
+                ORDER BY kv_index.key
+            """
+        args = [prefix.replace("%", r"\%").replace("_", r"\_") + "%", start_after or ""]
+        if limit is not None:
+            query += " LIMIT $3"
+            args.append(limit)
+        pool = await self.pool()
+        async with pool.acquire() as conn:
+            # asyncpg cursors are server-side and need a transaction
+            async with conn.transaction():
+                async for row in conn.cursor(query, *args, prefetch=page):
+                    yield row[0] if keys_only else (row[0], row[1])
+
+    def cache_stats(self) -> dict:
+        """Read cache counters: entries, bytes, hits, misses, evictions and hit_rate."""
+        return self.cache.stats()
+
+    async def close(self):
+        self.cache.clear()
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+from psycopg2.extras import execute_values
+from utils import newuuid
+from .db_postgres import DB as KVDB, DBError
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS escrow_kv (
+        key TEXT COLLATE "C" PRIMARY KEY,
+        state TEXT NOT NULL,
+        escrow_id BIGINT,
+        block_number BIGINT,
+        status TEXT,
+        payload JSONB,
+        value TEXT NOT NULL
+    );
+    """,
+    # "C" keys: the primary key btree serves LIKE 'ec:%' scans in key order, no JOIN or hashing
+    "CREATE INDEX IF NOT EXISTS escrow_kv_state_id ON escrow_kv (state, escrow_id)",
+    "CREATE INDEX IF NOT EXISTS escrow_kv_status_id ON escrow_kv (status, escrow_id) WHERE status IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS escrow_kv_block ON escrow_kv (block_number) WHERE block_number IS NOT NULL",
+]
+COLUMNS = "key, state, escrow_id, block_number, status, payload, value"
+UPSERT = f"""
+    INSERT INTO escrow_kv ({COLUMNS}) VALUES %s
+    ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, escrow_id = EXCLUDED.escrow_id,
+        block_number = EXCLUDED.block_number, status = EXCLUDED.status, payload = EXCLUDED.payload, value = EXCLUDED.value
+"""
+STAGING = "CREATE TEMP TABLE IF NOT EXISTS escrow_kv_staging (LIKE escrow_kv) ON COMMIT DELETE ROWS"
+MERGE = f"""
+    INSERT INTO escrow_kv ({COLUMNS}) SELECT {COLUMNS} FROM escrow_kv_staging
+    ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, escrow_id = EXCLUDED.escrow_id,
+        block_number = EXCLUDED.block_number, status = EXCLUDED.status, payload = EXCLUDED.payload, value = EXCLUDED.value
+"""
+
+def _json(value):
+    """Parsed value when it is a JSON object or array, else None."""
+    try:
+        parsed = json.loads(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if isinstance(parsed, (dict, list)) else None
+
+def columns(key: str, value: str) -> tuple:
+    """Typed columns of a key-value pair.
+    state is the key prefix (ec, lk, ..., latest, ship, tm), escrow_id the numeric suffix.
+    latest:{id} rows also carry the escrow's current state in status, and their event in "data".
+    """
+    state, _, suffix = key.partition(":")
+    payload = _json(value)
+    event, status = payload, None
+    if state == "latest" and isinstance(payload, dict):
+        status = payload.get("state")
+        event = payload.get("data")
+        if isinstance(event, str):  # latest records written before values were stored as dicts
+            event = _json(event)
+    block = event.get("blockNumber") if isinstance(event, dict) else None
+    return (key, state, int(suffix) if suffix.isdigit() else None, block, status,
+            None if payload is None else json.dumps(payload), value)
+
+class DB(KVDB):
+    """Normalized layout: one escrow_kv row per key with typed columns next to the value.
+    Same interface as db_postgres.DB; select it with DB_BACKEND=postgres and PG_SCHEMA=normalized.
+    """
+    SCHEMA = SCHEMA
+
+    def _fetch(self, cur, key: str):
+        cur.execute("SELECT value FROM escrow_kv WHERE key = %s", (key,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def _fetch_many(self, cur, keys):
+        cur.execute("SELECT key, value FROM escrow_kv WHERE key = ANY(%s)", (keys,))
+        return cur.fetchall()
+
+    def _delete(self, cur, keys):
+        cur.execute("DELETE FROM escrow_kv WHERE key = ANY(%s)", (keys,))
+
+    def _upsert(self, cur, items):
+        execute_values(cur, UPSERT, [columns(k, v) for k, v in items],
+                       template="(%s, %s, %s, %s, %s, %s::jsonb, %s)", page_size=self.batch_size)
+
+    def _copy(self, cur, items):
+        """COPY rows into the session's staging table and merge them into escrow_kv."""
+        buf = io.StringIO()
+        csv.writer(buf).writerows(columns(k, v) for k, v in items)
+        buf.seek(0)
+        cur.execute(STAGING)
+        cur.copy_expert(f"COPY escrow_kv_staging ({COLUMNS}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(MERGE)
+        cur.execute("TRUNCATE escrow_kv_staging")
+
+    def _scan_query(self, keys_only: bool) -> str:
+        if keys_only:
+            return "SELECT key FROM escrow_kv WHERE key LIKE %s AND key > %s ORDER BY key"
+        return "SELECT key, value FROM escrow_kv WHERE key LIKE %s AND key > %s ORDER BY key"
+
+    def escrow_ids(self, status: str):
+        """Ids of escrows whose latest state is `status` (a state prefix such as "ex"), in id order.
+        An index-only scan of escrow_kv_status_id.
+        """
+        with self._conn() as conn, conn.cursor() as cur:
+            cur.execute("SELECT escrow_id FROM escrow_kv WHERE status = %s ORDER BY escrow_id", (status,))
+            return [row[0] for row in cur.fetchall()]
+
+    def import_kv(self) -> int:
+        """Copy every key of the kv_store/kv_index layout into escrow_kv, returns the number of keys."""
+        count = 0
+        with self._conn() as conn, conn.cursor(name=f"import_{newuuid().hex}", withhold=True) as cur:
+            cur.itersize = self.batch_size
+            cur.execute(KVDB._scan_query(self, keys_only=False), ("%", ""))
+            while True:
+                rows = cur.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                self.put_many(rows)
+                count += len(rows)
+        return count
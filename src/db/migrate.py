@@ -0,0 +1,28 @@
+"""
+In-place migration of an LMDB store to the current storage format.
+Format 1 kept values and the key index in two environments; format 2 keeps them as named sub-DBs
+of the main environment. db_lmdb.DB also upgrades on open, this runs it offline.
+Run from src/: python -m db.migrate [--path trustmesh.db] [--index-path trustmesh_index.db]
+"""
+import argparse
+import lmdb as tool
+from .db_lmdb import FORMAT_VERSION, MAP_SIZE, is_legacy, upgrade
+
+def main(path: str, index_path: str, max_dbs: int):
+    env = tool.open(path, max_dbs=max_dbs, map_size=MAP_SIZE)
+    try:
+        if not is_legacy(env):
+            print(f"{path}: nothing to migrate")
+            return
+        moved = upgrade(env, index_path)
+        print(f"{path}: moved {moved} keys to storage format {FORMAT_VERSION}, {index_path} is no longer used")
+    finally:
+        env.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="trustmesh.db")
+    parser.add_argument("--index-path", default="trustmesh_index.db")
+    parser.add_argument("--max-dbs", type=int, default=8)
+    args = parser.parse_args()
+    main(args.path, args.index_path, args.max_dbs)
@@ -0,0 +1,149 @@
+import asyncio
+import inspect
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from .batch import AsyncWriteBatch
+
+READERS = int(os.getenv("DB_READERS", "4"))
+WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "64"))
+
+class AsyncDB:
+    """Async facade over a blocking backend (db_lmdb.DB, db_postgres.DB) that keeps its I/O off the event loop.
+    Writes are queued to a single writer thread, which merges whatever batches are waiting (up to
+    `max_batch`) into one commit; reads run on a pool of `readers` threads. Methods mirror the backend
+    as coroutines, `batch()` is an async context manager and `iterate` an async generator.
+    """
+    def __init__(self, db, readers: int = READERS, max_batch: int = WRITE_BATCH):
+        self.sync_db = db
+        self.cache = db.cache
+        self.max_batch = max_batch
+        self._error = inspect.getmodule(db).DBError
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix="db-read")
+        self._queue = queue.Queue() # (ops, loop, future), None stops the writer
+        self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        # backend-specific reads, only exposed when the backend has them (Storage checks with hasattr)
+        if hasattr(db, "escrow_ids"):
+            self.escrow_ids = self._escrow_ids
+
+    async def _read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, fn, *args)
+
+    async def get(self, key: str):
+        return await self._read(self.sync_db.get, key)
+
+    async def get_many(self, keys):
+        return await self._read(self.sync_db.get_many, list(keys))
+
+    async def _escrow_ids(self, status: str):
+        """db_postgres_normalized.DB.escrow_ids on a reader thread."""
+        return await self._read(self.sync_db.escrow_ids, status)
+
+    async def iterate(self, prefix: str, page: int = 256, **kwargs):
+        """DB.iterate, `page` rows pulled per reader call."""
+        rows = self.sync_db.iterate(prefix, page=page, **kwargs)
+        while True:
+            chunk = await self._read(lambda: list(islice(rows, page)))
+            if not chunk:
+                return
+            for row in chunk:
+                yield row
+
+    async def put(self, key: str, value: str):
+        async with self.batch() as b:
+            b.put(key, value)
+
+    async def put_many(self, items):
+        """Insert several (key, value) pairs in one batch."""
+        async with self.batch() as b:
+            for key, value in items:
+                b.put(key, value)
+
+    async def delete(self, key: str):
+        await self.delete_many([key])
+
+    async def delete_many(self, keys):
+        """Remove keys, missing keys are ignored."""
+        async with self.batch() as b:
+            for key in keys:
+                b.delete(key)
+
+    def batch(self):
+        """Group puts and deletes, committed by the writer thread; see db.batch.AsyncWriteBatch."""
+        return AsyncWriteBatch(self._submit, self._error)
+
+    async def _submit(self, ops):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((dict(ops), loop, fut))
+        await fut
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            group = [item]
+            while len(group) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None) # stop once this group is written
+                    break
+                group.append(item)
+            self._apply(group)
+
+    def _apply(self, group):
+        try:
+            self._commit([ops for ops, _, _ in group])
+        except Exception as e:
+            if len(group) == 1:
+                self._resolve(group[0], e)
+                return
+            # commit the batches one by one so only the failing ones see the error
+            for item in group:
+                try:
+                    self._commit([item[0]])
+                    self._resolve(item, None)
+                except Exception as err:
+                    self._resolve(item, err)
+            return
+        for item in group:
+            self._resolve(item, None)
+
+    def _commit(self, batches):
+        # queue order is kept: a later batch overrides an earlier one on the same key
+        with self.sync_db.batch() as b:
+            for ops in batches:
+                for key, value in ops.items():
+                    if value is None:
+                        b.delete(key)
+                    else:
+                        b.put(key, value)
+
+    @staticmethod
+    def _resolve(item, err):
+        _, loop, fut = item
+        def done():
+            if fut.done():
+                return
+            if err is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(err)
+        loop.call_soon_threadsafe(done)
+
+    def cache_stats(self) -> dict:
+        return self.sync_db.cache_stats()
+
+    async def close(self):
+        """Finish queued writes, then close the backend."""
+        self._queue.put(None)
+        await asyncio.to_thread(self._writer.join)
+        self._readers.shutdown()
+        self.sync_db.close()
@@ -0,0 +1,30 @@
+"""
+Train a zstd dictionary on the escrow and shipment values of an LMDB store.
+Run from src/: python -m db.zdict [--path trustmesh.db] [--out trustmesh.zdict]
+then set DB_ZSTD=1 and DB_ZSTD_DICT to the output file.
+"""
+import argparse
+from .codec import CODEC, Codec, CodecError, train_dictionary
+from .db_lmdb import DB
+
+PREFIXES = ["ec:", "lk:", "ex:", "cn:", "xp:", "rf:", "rl:", "latest:", "ship:"]
+
+def main(path: str, out: str, size: int, name: str):
+    db = DB(path=path)
+    codec = Codec(name, compress=False)
+    samples = [codec.encode(v) for prefix in PREFIXES for _, v in db.iterate(prefix)]
+    db.close()
+    if len(samples) < 100:
+        raise CodecError(f"Only {len(samples)} values in {path}, too few to train a dictionary")
+    with open(out, "wb") as f:
+        f.write(train_dictionary(samples, size))
+    print(f"{out}: {size} byte dictionary from {len(samples)} values")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="trustmesh.db")
+    parser.add_argument("--out", default="trustmesh.zdict")
+    parser.add_argument("--size", type=int, default=16384)
+    parser.add_argument("--codec", default=CODEC)
+    args = parser.parse_args()
+    main(args.path, args.out, args.size, args.codec)
@@ -3,8 +3,10 @@ Docstring for db_test
 A small unit to test db.py: make sure to peform tests before using to detect early errors
 when used on other machines
 """
+import json
 import os
 import tempfile
+from contextlib import asynccontextmanager
 import pytest
 from db import DB, DBError
 from core import EscrowType, Storage
@@ -46,14 +48,64 @@ def test_missing_key_raises(temp_db):
 
 def test_cache_eviction(temp_db):
     # Small cache for testing
-    temp_db.cache_size = 2
-    temp_db.put("a", "1")
-    temp_db.put("b", "2")
-    temp_db.put("c", "3")
-    # Oldest ("a") should be evicted
+    temp_db.cache.max_entries = 2
+    for key, value in [("a", "1"), ("b", "2"), ("c", "3")]:
+        temp_db.put(key, value)
+        temp_db.get(key)
+    # Least recently used ("a") should be evicted
     assert "a" not in temp_db.cache
     assert "b" in temp_db.cache
     assert "c" in temp_db.cache
+    assert temp_db.cache_stats()["evictions"] == 1
+
+def test_cache_is_lru(temp_db):
+    temp_db.cache.max_entries = 2
+    temp_db.put_many([("a", "1"), ("b", "2"), ("c", "3")])
+    temp_db.get("a")
+    temp_db.get("b")
+    temp_db.get("a")  # hit, "b" is now the oldest
+    temp_db.get("c")
+    assert "a" in temp_db.cache and "c" in temp_db.cache
+    assert "b" not in temp_db.cache
+    stats = temp_db.cache_stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
+
+def test_cache_is_byte_bounded(temp_db):
+    temp_db.cache.max_bytes = 40  # one 20 char value with its key
+    temp_db.put_many([("k1", "x" * 20), ("k2", "y" * 20), ("big", "z" * 100)])
+    temp_db.get("k1")
+    temp_db.get("k2")
+    assert temp_db.cache.bytes <= 40
+    assert "k1" not in temp_db.cache  # evicted to fit k2
+    assert temp_db.get("big") == "z" * 100
+    assert "big" not in temp_db.cache  # larger than the whole cache
+
+def test_put_invalidates_cached_value(temp_db):
+    temp_db.put("inv", {"n": 1})
+    assert temp_db.get("inv") == {"n": 1}
+    temp_db.put("inv", {"n": 2})
+    assert "inv" not in temp_db.cache
+    assert temp_db.get("inv") == {"n": 2}
+
+def test_read_before_write_does_not_recache_old_value(temp_db):
+    import threading
+    temp_db.put("latest:1", "lk")
+    reading, release = threading.Event(), threading.Event()
+    decode = temp_db.codec.decode
+    def slow_decode(raw):
+        if not reading.is_set():
+            reading.set()
+            release.wait(5)  # the old value is read, the write lands before it is cached
+        return decode(raw)
+    temp_db.codec.decode = slow_decode
+    reader = threading.Thread(target=temp_db.get, args=("latest:1",))
+    reader.start()
+    assert reading.wait(5)
+    temp_db.put("latest:1", "ex")
+    release.set()
+    reader.join()
+    assert "latest:1" not in temp_db.cache
+    assert temp_db.get("latest:1") == "ex"
 
 def test_iterate_returns_only_prefixed_keys(temp_db):
     # Insert some keys with prefix "ec:" and some without
@@ -87,6 +139,418 @@ def test_iterate_empty_prefix_returns_all(temp_db):
     assert "a:1" in keys
     assert "b:1" in keys
 
+def test_iterate_pages_and_resumes(temp_db):
+    temp_db.put_many([(f"pg:{i:02}", f"v{i}") for i in range(10)])
+    temp_db.put("ph:1", "next prefix")
+    rows = temp_db.iterate("pg:", page=3)
+    assert next(rows) == ("pg:00", "v0")  # a generator, pages are read lazily
+    assert [k for k, _ in rows] == [f"pg:{i:02}" for i in range(1, 10)]
+    first = list(temp_db.iterate("pg:", limit=4, page=3))
+    assert [k for k, _ in first] == ["pg:00", "pg:01", "pg:02", "pg:03"]
+    rest = list(temp_db.iterate("pg:", start_after=first[-1][0], limit=4))
+    assert [k for k, _ in rest] == ["pg:04", "pg:05", "pg:06", "pg:07"]
+    assert list(temp_db.iterate("pg:", start_after="pg:07", keys_only=True)) == ["pg:08", "pg:09"]
+    assert list(temp_db.iterate("pg:", start_after="pg:09")) == []
+    assert list(temp_db.iterate("pg:", start_after="a", limit=1)) == [("pg:00", "v0")]
+
+def test_put_many_and_delete_many(temp_db):
+    temp_db.put_many([("tm:1", "a"), ("tm:2", "b"), ("tm:3", "c")])
+    temp_db.cache.clear()
+    assert temp_db.get("tm:2") == "b"
+    temp_db.delete_many(["tm:1", "tm:3", "tm:404"])
+    assert [k for k, _ in temp_db.iterate("tm:")] == ["tm:2"]
+    with pytest.raises(DBError):
+        temp_db.get("tm:1")
+
+def test_get_many_reports_missing_without_raising(temp_db):
+    temp_db.put_many([("gm:1", "a"), ("gm:2", "b")])
+    temp_db.cache.clear()
+    found, missing = temp_db.get_many(["gm:1", "gm:404", "gm:2"])
+    assert found == {"gm:1": "a", "gm:2": "b"}
+    assert missing == ["gm:404"]
+    # served from cache the second time
+    assert "gm:1" in temp_db.cache
+
+def test_put_many_rejects_empty_value(temp_db):
+    with pytest.raises(DBError):
+        temp_db.put_many([("k1", "v1"), ("k2", "")])
+
+def test_batch_commits_on_exit(temp_db):
+    temp_db.put("bt:old", "x")
+    with temp_db.batch() as b:
+        b.put("bt:1", "a")
+        b.put("bt:2", "b")
+        b.delete("bt:old")
+        b.put("bt:1", "a2")  # last op on a key wins
+        assert list(temp_db.iterate("bt:")) == [("bt:old", "x")]
+    temp_db.cache.clear()
+    assert list(temp_db.iterate("bt:")) == [("bt:1", "a2"), ("bt:2", "b")]
+
+def test_batch_discarded_on_error(temp_db):
+    with pytest.raises(RuntimeError):
+        with temp_db.batch() as b:
+            b.put("bx:1", "a")
+            raise RuntimeError("boom")
+    assert list(temp_db.iterate("bx:")) == []
+    with pytest.raises(DBError):
+        temp_db.get("bx:1")
+
+def test_migrate_format1_store():
+    import lmdb
+    from utils import dighash
+    from db.migrate import main as migrate
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path, index_path = os.path.join(tmpdir, "data"), os.path.join(tmpdir, "index")
+        data, index = lmdb.open(path, max_dbs=2), lmdb.open(index_path, max_dbs=2)
+        for key, value in [("ec:1", "created"), ("lk:1", "linked")]:
+            with data.begin(write=True) as txn:
+                txn.put(dighash(key.encode()), json.dumps(value).encode())
+            with index.begin(write=True) as txn:
+                txn.put(key.encode(), dighash(key.encode()))
+        data.close()
+        index.close()
+        migrate(path, index_path, max_dbs=8)
+        db = DB(path=path, index_path=index_path)
+        try:
+            assert db.get("lk:1") == "linked"
+            assert list(db.iterate("ec:")) == [("ec:1", "created")]
+            db.put("rf:1", "refunded")
+            with db.env.begin() as txn:
+                assert txn.get(b"format", db=db.subdb("meta")) == b"2"
+        finally:
+            db.close()
+
+@pytest.mark.parametrize("name", ["msgpack", "orjson"])
+@pytest.mark.parametrize("compress", [False, True])
+def test_codec_roundtrip(name, compress):
+    from db.codec import Codec
+    codec = Codec(name, compress=compress)
+    for value in ['{"escrowId": 1}', {"state": "lk", "data": [1, 2]}, 42]:
+        assert codec.decode(codec.encode(value)) == value
+    # reads any header regardless of the configured codec, and pre-codec JSON text
+    other = Codec("orjson" if name == "msgpack" else "msgpack", compress=not compress)
+    assert codec.decode(other.encode({"a": 1})) == {"a": 1}
+    assert codec.decode(b'"legacy json"') == "legacy json"
+
+def test_codec_zstd_dictionary():
+    from db.codec import Codec, train_dictionary
+    events = [json.dumps({"escrowId": i, "buyer": "0x" + f"{i:040x}", "seller": "0x" + f"{i * 7:040x}",
+                          "amount": i * 1000, "shipmentId": f"ship-{i}"}) for i in range(1000)]
+    plain = Codec("msgpack", compress=False)
+    dictionary = train_dictionary([plain.encode(e) for e in events], size=4096)
+    codec = Codec("msgpack", compress=True, dictionary=dictionary)
+    assert codec.decode(codec.encode(events[5])) == events[5]
+    assert len(codec.encode(events[5])) < len(plain.encode(events[5]))
+
+def test_db_reads_values_from_other_codecs(temp_db):
+    from db.codec import Codec
+    temp_db.put("cd:1", "written as msgpack")
+    temp_db.codec = Codec("orjson", compress=True)
+    temp_db.put("cd:2", "written as orjson")
+    temp_db.cache.clear()
+    assert list(temp_db.iterate("cd:")) == [("cd:1", "written as msgpack"), ("cd:2", "written as orjson")]
+
+def test_normalized_columns():
+    from db.db_postgres_normalized import columns
+    event = json.dumps({"escrowId": 5, "blockNumber": 120})
+    key, state, escrow_id, block, status, payload, value = columns("lk:5", event)
+    assert (state, escrow_id, block, status, value) == ("lk", 5, 120, None, event)
+    assert json.loads(payload) == {"escrowId": 5, "blockNumber": 120}
+    latest = json.dumps({"state": "ex", "data": event})
+    assert columns("latest:5", latest)[1:5] == ("latest", 5, 120, "ex")
+    assert columns("ship:abc", "in transit")[1:6] == ("ship", None, None, None, None)
+    # latest records stored as dicts, the postgres backends write them as one JSON document
+    latest = json.dumps({"state": "ex", "data": {"escrowId": 5, "blockNumber": 120}})
+    assert columns("latest:5", latest)[1:5] == ("latest", 5, 120, "ex")
+
+def test_postgres_writes_records_as_json_text(recorded_pg):
+    from db.db_postgres import hash_text
+    recorded_pg.put("latest:1", {"state": "lk", "data": {"escrowId": 1}})
+    conn, = recorded_pg.pool.conns
+    assert conn.log[1][2] == [(hash_text("latest:1"), '{"state": "lk", "data": {"escrowId": 1}}')]
+
+class RecordingCursor:
+    """psycopg2 cursor stand-in, statements go to the connection's log.
+    execute_values rows are logged as ("values", statement head, rows), COPY as ("copy", statement, data).
+    """
+    def __init__(self, conn):
+        self.connection = conn
+        self.itersize = 0
+        self._rows = []
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        pass
+    def __iter__(self):
+        return iter([])
+    def mogrify(self, template, args):
+        self._rows.append(tuple(args))
+        return b"()"
+    def execute(self, sql, params=None):
+        if isinstance(sql, bytes):  # an execute_values page
+            self.connection.log.append(("values", sql.split(b" VALUES ")[0].decode(), self._rows))
+            self._rows = []
+        else:
+            self.connection.log.append((" ".join(sql.split()), params))
+    def copy_expert(self, sql, buf):
+        self.connection.log.append(("copy", sql, buf.read()))
+    def fetchone(self):
+        return None
+    def fetchall(self):
+        return []
+
+class RecordingConn:
+    encoding = "UTF8"
+    closed = 0
+    def __init__(self):
+        self.autocommit = False
+        self.log = []
+    def cursor(self, name=None, withhold=False):
+        return RecordingCursor(self)
+
+class RecordingPool:
+    """psycopg2 ThreadedConnectionPool stand-in handing out RecordingConns."""
+    def __init__(self, minconn, maxconn, dsn):
+        self.conns, self.free = [], []
+    def getconn(self):
+        if not self.free:
+            self.conns.append(RecordingConn())
+            self.free.append(self.conns[-1])
+        return self.free.pop()
+    def putconn(self, conn, close=False):
+        self.free.append(conn)
+    def closeall(self):
+        pass
+
+@pytest.fixture
+def recorded_pg(monkeypatch):
+    import db.db_postgres
+    monkeypatch.setattr(db.db_postgres, "ThreadedConnectionPool", RecordingPool)
+    pg = db.db_postgres.DB(dsn="postgresql://test", batch_size=3, copy_min=5)
+    for conn in pg.pool.conns:
+        conn.log.clear()  # schema statements
+    return pg
+
+def test_postgres_reads_do_not_join_an_open_write(recorded_pg):
+    with recorded_pg._tx() as cur:
+        cur.execute("SELECT 1")
+        recorded_pg.get_many(["ec:1"])  # e.g. an AsyncDB reader while the writer is mid-commit
+    writer, reader = recorded_pg.pool.conns
+    assert [s for s, _ in writer.log] == ["BEGIN", "SELECT 1", "COMMIT"]
+    assert len(reader.log) == 1 and reader.log[0][0].startswith("SELECT kv_index.key")
+    assert writer.autocommit and reader.autocommit
+
+def test_postgres_upsert_chunks_by_batch_size(recorded_pg):
+    from db.db_postgres import hash_text
+    recorded_pg.put_many([(f"k{i}", f"v{i}") for i in range(4)])  # below copy_min=5
+    conn, = recorded_pg.pool.conns
+    assert conn.log[0][0] == "BEGIN" and conn.log[-1][0] == "COMMIT"
+    pages = conn.log[1:-1]
+    assert [(kind, head.split(" (")[0]) for kind, head, _ in pages] == [
+        ("values", "INSERT INTO kv_store"), ("values", "INSERT INTO kv_index")] * 2
+    assert [len(rows) for _, _, rows in pages] == [3, 3, 1, 1]
+    assert pages[0][2] == [(hash_text(f"k{i}"), f"v{i}") for i in range(3)]
+    assert pages[3][2] == [("k3", hash_text("k3"))]
+
+def test_postgres_copies_from_copy_min(recorded_pg):
+    from db.db_postgres import MERGE_INDEX, MERGE_VALUES, STAGING
+    recorded_pg.put_many([(f"k{i}", f"v{i}") for i in range(5)])
+    conn, = recorded_pg.pool.conns
+    statements = [entry[0] if entry[0] != "copy" else "copy" for entry in conn.log]
+    chunk = [" ".join(STAGING.split()), "copy", " ".join(MERGE_VALUES.split()), " ".join(MERGE_INDEX.split()),
+             "TRUNCATE kv_staging"]
+    assert statements == ["BEGIN"] + chunk * 2 + ["COMMIT"]
+    copies = [entry[2] for entry in conn.log if entry[0] == "copy"]
+    assert [data.count("\r\n") for data in copies] == [3, 2]
+
+def test_postgres_copy_escapes_csv(recorded_pg):
+    import csv, io
+    from db.db_postgres import hash_text
+    items = [("ec:1", "a,b"), ("ec:2", 'say "hi"'), ("ec:3", "line\nbreak"), ("ec,4", "crlf\r\nend"),
+             ('ec"5', "plain")]
+    recorded_pg.put_many(items)
+    conn, = recorded_pg.pool.conns
+    data = "".join(entry[2] for entry in conn.log if entry[0] == "copy")
+    assert '"say ""hi"""' in data and '"a,b"' in data and '"line\nbreak"' in data
+    assert list(csv.reader(io.StringIO(data, newline=""))) == [[hash_text(k), k, v] for k, v in items]
+
+def test_postgres_delete_then_put_same_key(recorded_pg):
+    from db.db_postgres import hash_text
+    recorded_pg.cache.set("k1", "old", 5)
+    with recorded_pg.batch() as b:
+        b.delete("k1")
+        b.put("k1", "new")  # the last operation on a key wins
+        b.put("k2", "x")
+        b.delete("k2")
+        b.delete("k3")
+    conn, = recorded_pg.pool.conns
+    assert conn.log[1:3] == [
+        ("DELETE FROM kv_index WHERE key = ANY(%s)", (["k2", "k3"],)),
+        ("DELETE FROM kv_store WHERE hash_key = ANY(%s)", ([hash_text("k2"), hash_text("k3")],)),
+    ]
+    assert [rows for _, _, rows in conn.log[3:5]] == [[(hash_text("k1"), "new")], [("k1", hash_text("k1"))]]
+    assert conn.log[5][0] == "COMMIT" and len(conn.log) == 6
+    assert recorded_pg.cache.get("k1") is None
+
+class RecordingAsyncConn:
+    """asyncpg connection stand-in, statements are logged as (statement, args) and COPY as ("copy", table, records)."""
+    def __init__(self):
+        self.log = []
+    async def execute(self, sql, *args):
+        self.log.append((" ".join(sql.split()), args))
+    async def copy_records_to_table(self, table, records, columns):
+        assert columns == ["hash_key", "key", "value"]
+        self.log.append(("copy", table, list(records)))
+    @asynccontextmanager
+    async def transaction(self):
+        self.log.append(("BEGIN", ()))
+        try:
+            yield
+        except Exception:
+            self.log.append(("ROLLBACK", ()))
+            raise
+        self.log.append(("COMMIT", ()))
+
+class RecordingAsyncPool:
+    """asyncpg pool stand-in with a single RecordingAsyncConn."""
+    def __init__(self):
+        self.conn = RecordingAsyncConn()
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+    async def close(self):
+        pass
+
+@pytest.fixture
+def recorded_pg_async(monkeypatch):
+    import db.db_postgres_async
+    pool = RecordingAsyncPool()
+    async def create_pool(dsn, min_size, max_size):
+        return pool
+    monkeypatch.setattr(db.db_postgres_async.asyncpg, "create_pool", create_pool)
+    pg = db.db_postgres_async.DB(dsn="postgresql://test", batch_size=3, copy_min=5)
+    pg.log = pool.conn.log
+    return pg
+
+@pytest.mark.asyncio
+async def test_postgres_async_upsert_chunks_by_batch_size(recorded_pg_async):
+    from db.db_postgres_async import PUT_INDEX, PUT_VALUES, hash_text
+    await recorded_pg_async.pool()
+    recorded_pg_async.log.clear()  # schema statements
+    await recorded_pg_async.put_many([(f"k{i}", f"v{i}") for i in range(4)])
+    log = recorded_pg_async.log
+    put_values, put_index = " ".join(PUT_VALUES.split()), " ".join(PUT_INDEX.split())
+    assert [sql for sql, _ in log] == ["BEGIN"] + [put_values, put_index] * 2 + ["COMMIT"]
+    assert log[1][1] == ([hash_text(f"k{i}") for i in range(3)], [f"v{i}" for i in range(3)])
+    assert log[4][1] == (["k3"], [hash_text("k3")])
+
+@pytest.mark.asyncio
+async def test_postgres_async_copies_from_copy_min(recorded_pg_async):
+    from db.db_postgres_async import MERGE_INDEX, MERGE_VALUES, STAGING, hash_text
+    await recorded_pg_async.pool()
+    recorded_pg_async.log.clear()
+    items = [("ec:1", "a,b"), ("ec:2", 'say "hi"'), ("ec:3", "line\nbreak"), ("ec:4", "v4"), ("ec:5", "v5")]
+    await recorded_pg_async.put_many(items)
+    log = recorded_pg_async.log
+    chunk = [" ".join(STAGING.split()), "copy", " ".join(MERGE_VALUES.split()), " ".join(MERGE_INDEX.split()),
+             "TRUNCATE kv_staging"]
+    assert [entry[0] for entry in log] == ["BEGIN"] + chunk * 2 + ["COMMIT"]
+    # records go to COPY as they are, asyncpg encodes them in the binary format
+    copies = [entry[2] for entry in log if entry[0] == "copy"]
+    assert copies == [[(hash_text(k), k, v) for k, v in items[:3]], [(hash_text(k), k, v) for k, v in items[3:]]]
+
+@pytest.mark.asyncio
+async def test_postgres_async_delete_then_put_same_key(recorded_pg_async):
+    from db.db_postgres_async import hash_text
+    await recorded_pg_async.pool()
+    recorded_pg_async.log.clear()
+    recorded_pg_async.cache.set("k1", "old", 5)
+    async with recorded_pg_async.batch() as b:
+        b.delete("k1")
+        b.put("k1", "new")
+        b.put("k2", "x")
+        b.delete("k2")
+    log = recorded_pg_async.log
+    assert log[1:3] == [
+        ("DELETE FROM kv_index WHERE key = ANY($1::text[])", (["k2"],)),
+        ("DELETE FROM kv_store WHERE hash_key = ANY($1::text[])", ([hash_text("k2")],)),
+    ]
+    assert [args for _, args in log[3:5]] == [([hash_text("k1")], ["new"]), (["k1"], [hash_text("k1")])]
+    assert log[5][0] == "COMMIT" and len(log) == 6
+    assert recorded_pg_async.cache.get("k1") is None
+
+@pytest.mark.asyncio
+async def test_escrows_in_state(temp_db):
+    storage = Storage(db=temp_db)
+    await storage.save_escrow_events([
+        (3, EscrowType.EXTENDED, "ex-3"),
+        (1, EscrowType.LINKED, "lk-1"),
+        (1, EscrowType.EXTENDED, "ex-1"),
+        (2, EscrowType.EXTENDED, "ex-2"),
+        (2, EscrowType.EXPIRED, "xp-2"),
+    ])
+    assert await storage.escrows_in_state(EscrowType.EXTENDED) == [1, 3]
+    assert await storage.escrows_in_state(EscrowType.EXPIRED) == [2]
+
+@pytest.mark.asyncio
+async def test_escrows_in_state_uses_the_index_through_async_db(temp_db):
+    import threading
+    from db.offload import AsyncDB
+    calls = []
+    def escrow_ids(status):  # db_postgres_normalized.DB.escrow_ids
+        calls.append((status, threading.current_thread().name))
+        return [1, 3]
+    def iterate(*args, **kwargs):
+        raise AssertionError("escrows_in_state scanned latest: records")
+    temp_db.escrow_ids, temp_db.iterate = escrow_ids, iterate
+    adb = AsyncDB(temp_db)
+    assert await Storage(db=adb).escrows_in_state(EscrowType.EXTENDED) == [1, 3]
+    assert calls[0][0] == "ex" and calls[0][1].startswith("db-read")
+    adb._queue.put(None)
+    adb._writer.join()
+
+@pytest.mark.asyncio
+async def test_escrows_in_state_scans_through_async_db_without_index(temp_db):
+    from db.offload import AsyncDB
+    adb = AsyncDB(temp_db)
+    assert not hasattr(adb, "escrow_ids")
+    storage = Storage(db=adb)
+    await storage.save_escrow_events([(2, EscrowType.EXTENDED, "ex-2"), (5, EscrowType.LINKED, "lk-5")])
+    assert await storage.escrows_in_state(EscrowType.EXTENDED) == [2]
+    adb._queue.put(None)
+    adb._writer.join()
+
+@pytest.mark.asyncio
+async def test_async_db_merges_queued_writes(temp_db):
+    import asyncio
+    import threading
+    from db.offload import AsyncDB
+    gate, commits = threading.Event(), []
+    batch = temp_db.batch
+    def gated_batch():
+        commits.append(1)
+        gate.wait(5)  # hold the writer so the next writes pile up
+        return batch()
+    temp_db.batch = gated_batch
+    adb = AsyncDB(temp_db)
+    first = asyncio.ensure_future(adb.put("aw:0", "v0"))
+    await asyncio.sleep(0.05)
+    rest = [asyncio.ensure_future(adb.put(f"aw:{i}", f"v{i}")) for i in range(1, 20)]
+    await asyncio.sleep(0.05)
+    gate.set()
+    await asyncio.gather(first, *rest)
+    assert len(commits) == 2  # the 19 queued puts went in one commit
+    assert await adb.get("aw:7") == "v7"
+    assert (await adb.get_many(["aw:1", "aw:404"]))[1] == ["aw:404"]
+    assert [k async for k, _ in adb.iterate("aw:", page=4)] == sorted(f"aw:{i}" for i in range(20))
+    with pytest.raises(DBError):
+        await adb.put("aw:x", "")
+    await adb.delete("aw:0")
+    with pytest.raises(DBError):
+        await adb.get("aw:0")
+    adb._queue.put(None)
+    adb._writer.join()
+
 class DummyDB(DB):
     def __init__(self):
         self.store = {}
@@ -94,6 +558,12 @@ class DummyDB(DB):
         self.store[key] = value
     def get(self, key):
         return self.store.get(key)
+    def put_many(self, items):
+        for key, value in items:
+            self.put(key, value)
+    def get_many(self, keys):
+        found = {k: self.store[k] for k in keys if k in self.store}
+        return found, [k for k in keys if k not in found]
 
 @pytest.mark.asyncio
 async def test_get_latest_returns_correct_state():
@@ -114,7 +584,98 @@ async def test_get_latest_none_if_no_data():
     storage = Storage(db=db)
     assert await storage.get_latest(99) is None
 
-def test_save_shipment():
+@pytest.mark.asyncio
+async def test_get_latest_is_a_single_read():
+    db = DummyDB()
+    storage = Storage(db=db)
+    await storage.save_escrow_event(3, EscrowType.CREATED, "created-data")
+    await storage.save_escrow_event(3, EscrowType.LINKED, "linked-data")
+    reads = []
+    get_many = db.get_many
+    db.get_many = lambda keys: reads.append(keys) or get_many(keys)
+    assert await storage.get_latest(3) == ("lk", "linked-data")
+    assert reads == [["latest:3"]]
+
+@pytest.mark.asyncio
+async def test_get_latest_ignores_replayed_older_state():
+    storage = Storage(db=DummyDB())
+    await storage.save_escrow_event(4, EscrowType.EXTENDED, "extended-data")
+    await storage.save_escrow_event(4, EscrowType.LINKED, "linked-replayed")
+    assert await storage.get_latest(4) == ("ex", "extended-data")
+    # pre-existing data without a latest record still resolves
+    storage.db.store.pop("latest:4")
+    assert await storage.get_latest(4) == ("ex", "extended-data")
+
+@pytest.mark.asyncio
+async def test_get_latest_many():
+    storage = Storage(db=DummyDB())
+    await storage.save_escrow_event(1, EscrowType.LINKED, "linked-1")
+    await storage.save_escrow_event(2, EscrowType.EXPIRED, "expired-2")
+    storage.db.store["ec:3"] = "created-3"  # saved before latest records existed
+    latest = await storage.get_latest_many([1, 2, 3, 404])
+    assert latest == {1: ("lk", "linked-1"), 2: ("xp", "expired-2"), 3: ("ec", "created-3")}
+
+@pytest.mark.asyncio
+async def test_save_escrow_events_is_one_write():
+    storage = Storage(db=DummyDB())
+    writes = []
+    put_many = storage.db.put_many
+    storage.db.put_many = lambda items: writes.append(list(items)) or put_many(items)
+    await storage.save_escrow_events([
+        (5, EscrowType.CREATED, "created-5"),
+        (5, EscrowType.LINKED, "linked-5"),
+        (6, EscrowType.EXPIRED, "expired-6"),
+    ])
+    assert len(writes) == 1
+    assert await storage.get_latest_many([5, 6]) == {5: ("lk", "linked-5"), 6: ("xp", "expired-6")}
+    assert storage.cache.pending == 2
+
+class AsyncDummyDB:
+    """Coroutine interface of db_postgres_async.DB over a dict."""
+    def __init__(self):
+        self.store = {}
+    async def get(self, key):
+        return self.store.get(key)
+    async def put(self, key, value):
+        self.store[key] = value
+    async def put_many(self, items):
+        self.store.update(items)
+    async def get_many(self, keys):
+        found = {k: self.store[k] for k in keys if k in self.store}
+        return found, [k for k in keys if k not in found]
+    async def delete_many(self, keys):
+        for k in keys:
+            self.store.pop(k, None)
+    async def iterate(self, prefix, **kwargs):
+        for k in sorted(self.store):
+            if k.startswith(prefix):
+                yield k, self.store[k]
+
+@pytest.mark.asyncio
+async def test_timer_journal_on_async_backend():
+    from core import TimerScheduler
+    adb = AsyncDummyDB()
+    sched = TimerScheduler(db=adb)
+    sched.set_timer(1, delay=60, reason="release funds")
+    sched.set_timer(2, delay=60, reason="cancelled")
+    sched.cancel(2)
+    await sched.flush()  # awaited in the background, nothing blocks the loop
+    restarted = TimerScheduler(db=adb)
+    assert await restarted.load() == 1
+    assert restarted.get(1).reason == "release funds"
+
+@pytest.mark.asyncio
+async def test_storage_awaits_async_backend():
+    storage = Storage(db=AsyncDummyDB())
+    await storage.save_escrow_events([(7, EscrowType.CREATED, "created-7"), (7, EscrowType.LINKED, "linked-7")])
+    assert await storage.get_latest(7) == ("lk", "linked-7")
+    assert await storage.get_latest_many([7, 8]) == {7: ("lk", "linked-7")}
+    assert await storage.get_escrow_by_id(7) == {"ec:7": "created-7", "lk:7": "linked-7"}
+    await storage.save_shipment_states("s1", {"details": "in transit"})
+    assert await storage.get_shipment_state("s1") == "in transit"
+
+@pytest.mark.asyncio
+async def test_save_shipment():
     ships ={
         "details":[{
             "Shipid":"ship-12",
@@ -123,5 +684,5 @@ def test_save_shipment():
     }
     db =DummyDB()
     store = Storage(db)
-    store.save_shipment_states("ship-12",ships)
-    assert store.get_shipment_state("ship-12") == ships["details"]
\ No newline at end of file
+    await store.save_shipment_states("ship-12",ships)
+    assert await store.get_shipment_state("ship-12") == ships["details"]
\ No newline at end of file
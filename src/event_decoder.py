@@ -0,0 +1,95 @@
+import re
+import weakref
+from typing import Optional
+from eth_utils import to_checksum_address
+from web3.contract import Contract
+from web3.datastructures import AttributeDict
+
+# events the escrow listener and the demo decode
+ESCROW_EVENTS = ("EscrowCreated", "ShipmentLinked", "FundsReleased", "FundsRefunded",
+                 "EscrowExtended", "EscrowExpired", "EscrowCancelled")
+
+# ABI types decoded directly, anything else (tuples, arrays) goes through web3's process_log
+ELEMENTARY = re.compile(r"^(u?int\d*|address|bool|string|bytes\d*)$")
+
+class EventDecoder:
+    """Decode contract logs by their topic0.
+    The topic0 -> event table is built once with each event's argument names and types, a log is decoded
+    with the one event its topic0 names: one ABI decode for the topics, one for the data. The result is
+    what web3's process_log returns for the same log, without trying every event until it stops raising.
+    """
+    def __init__(self, contract: Contract, names=ESCROW_EVENTS):
+        self.contract = contract
+        self.codec = contract.w3.codec
+        self.events = {}
+        for name in names:
+            event = contract.events[name]()
+            self.events[_bytes(event.topic)] = _Event(event)
+
+    def decode(self, log):
+        """Decoded event of `log`, None for anonymous logs, other events or data that does not match the ABI."""
+        topics = log.get("topics")
+        if not topics:
+            return None
+        event = self.events.get(_bytes(topics[0]))
+        if event is None:
+            return None
+        try:
+            if event.slow:
+                return event.event.process_log(log)
+            return event.decode(self.codec, log)
+        except Exception:
+            return None
+
+class _Event:
+    """Argument names and types of one event, split into topics and data."""
+    def __init__(self, event):
+        self.event = event
+        self.name = event.abi["name"]
+        inputs = event.abi["inputs"]
+        self.slow = not all(ELEMENTARY.match(i["type"]) for i in inputs)
+        indexed = [i for i in inputs if i["indexed"]]
+        plain = [i for i in inputs if not i["indexed"]]
+        # indexed strings and bytes only leave their hash in the topic
+        self.topic_types = [i["type"] if i["type"] not in ("string", "bytes") else "bytes32" for i in indexed]
+        self.topic_names = [i["name"] for i in indexed]
+        self.data_types = [i["type"] for i in plain]
+        self.data_names = [i["name"] for i in plain]
+
+    def decode(self, codec, log):
+        topics = log["topics"][1:]
+        if len(topics) != len(self.topic_types):
+            raise ValueError(f"{self.name}: expected {len(self.topic_types)} topics, got {len(topics)}")
+        values = codec.decode(self.topic_types, b"".join(_bytes(t) for t in topics))
+        args = dict(zip(self.topic_names, _checksummed(self.topic_types, values)))
+        values = codec.decode(self.data_types, _bytes(log["data"]))
+        args.update(zip(self.data_names, _checksummed(self.data_types, values)))
+        decoded = {
+            "args": args,
+            "event": self.name,
+            "logIndex": log["logIndex"],
+            "transactionIndex": log["transactionIndex"],
+            "transactionHash": log["transactionHash"],
+            "address": log["address"],
+            "blockHash": log["blockHash"],
+            "blockNumber": log["blockNumber"],
+        }
+        return AttributeDict.recursive(decoded) if isinstance(log, AttributeDict) else decoded
+
+def _checksummed(types, values):
+    return [to_checksum_address(v) if t == "address" else v for t, v in zip(types, values)]
+
+_decoders = weakref.WeakKeyDictionary()
+
+def decode_log(contract: Contract, log):
+    """EventDecoder.decode with a decoder kept per contract."""
+    decoder: Optional[EventDecoder] = _decoders.get(contract)
+    if decoder is None:
+        decoder = _decoders[contract] = EventDecoder(contract)
+    return decoder.decode(log)
+
+def _bytes(value) -> bytes:
+    """Topics and data arrive as HexBytes from web3 and as 0x strings from raw JSON-RPC."""
+    if isinstance(value, str):
+        return bytes.fromhex(value.removeprefix("0x"))
+    return bytes(value)
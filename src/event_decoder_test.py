@@ -0,0 +1,56 @@
+import json
+from web3 import Web3
+from event_decoder import ESCROW_EVENTS, EventDecoder, decode_log
+
+with open("trustmesh.json") as f:
+    ABI = json.load(f)
+CONTRACT = Web3().eth.contract(address="0x" + "1" * 40, abi=ABI)
+VALUES = {"uint256": 7, "address": "0x" + "2" * 40, "string": "SHIP-7"}
+
+def make_log(name, block=1, index=0, topic0=True):
+    """Log as emitted by the contract for `name`, every argument set from VALUES."""
+    event = CONTRACT.events[name]()
+    inputs = event.abi["inputs"]
+    topics = [bytes.fromhex(event.topic[2:])] if topic0 else []
+    topics += [Web3().codec.encode([i["type"]], [VALUES[i["type"]]]) for i in inputs if i["indexed"]]
+    plain = [i for i in inputs if not i["indexed"]]
+    data = Web3().codec.encode([i["type"] for i in plain], [VALUES[i["type"]] for i in plain])
+    return {"address": CONTRACT.address, "topics": topics, "data": data, "blockNumber": block, "logIndex": index,
+            "transactionIndex": 0, "transactionHash": b"\x01" * 32, "blockHash": b"\x02" * 32, "removed": False}
+
+def legacy_decode(log):
+    for name in ESCROW_EVENTS:
+        try:
+            return CONTRACT.events[name]().process_log(log)
+        except Exception:
+            continue
+    return None
+
+def test_decoder_matches_process_log_for_every_event():
+    decoder = EventDecoder(CONTRACT)
+    for name in ESCROW_EVENTS:
+        log = make_log(name)
+        decoded = decoder.decode(log)
+        assert decoded["event"] == name
+        assert decoded == legacy_decode(log)
+        assert dict(decoded["args"])["escrowId"] == 7
+
+def test_decoder_skips_unknown_logs():
+    decoder = EventDecoder(CONTRACT)
+    assert decoder.decode(make_log("OwnerUpdated")) is None  # in the ABI but not an escrow event
+    assert decoder.decode(make_log("EscrowCreated", topic0=False)) is None
+    broken = make_log("ShipmentLinked")
+    broken["data"] = b""
+    assert decoder.decode(broken) is None
+
+def test_decode_log_accepts_hex_topics():
+    log = make_log("FundsReleased")
+    log["topics"] = ["0x" + t.hex() for t in log["topics"]]
+    assert decode_log(CONTRACT, log) == legacy_decode(make_log("FundsReleased"))
+
+def test_decoder_keeps_attribute_dicts():
+    from web3.datastructures import AttributeDict
+    log = AttributeDict(make_log("EscrowCreated"))
+    decoded = EventDecoder(CONTRACT).decode(log)
+    assert isinstance(decoded, AttributeDict) and decoded.args.buyer == Web3.to_checksum_address(VALUES["address"])
+    assert decoded == legacy_decode(log)
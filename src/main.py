@@ -1,11 +1,13 @@
 import os, asyncio, json
 import signal
-from typing import List
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_agent
 from langchain_core.prompts import ChatPromptTemplate
-from core import ArcHandler, BatchRunner, Cache, EscrowRef, EscrowType, Storage, TimerScheduler
-from tools import make_tools
+from db import DB
+from db.offload import AsyncDB
+from core import ArcHandler, BatchRunner, Cache, EscrowRef, EscrowType, Storage, TimerScheduler, load_value
+from timer_wheel import TimingWheel
+from tools import EscrowActions, decide_batch, make_tools, settle_timer
 import logging
 from logging_setup import setup_logging, shutdown_logging
 from async_utils import create_monitored_task, set_loop_exception_handler
@@ -62,13 +64,25 @@ async def _main():
     log.info("Initializing components")
     cache = Cache()
     log.info("Cache initialized")
-    storage = Storage(cache=cache)
+    db = DB()
+    if os.getenv("DB_BACKEND") != "postgres_async":
+        # blocking backend: writes go through one writer thread, reads through a thread pool
+        db = AsyncDB(db)
+    storage = Storage(db=db, cache=cache)
     log.info("Storage initialized")
-    timer = TimerScheduler()
+    # "wheel" keeps insert/cancel O(1) when every active escrow has a pending timer
+    timer_backend = TimingWheel() if os.getenv("TIMER_BACKEND", "heap") == "wheel" else None
+    # the journal shares the storage db, its flushes run in the background on either kind of backend
+    timer = TimerScheduler(db=storage.db, backend=timer_backend, max_inflight=int(os.getenv("TIMER_CONCURRENCY", "8")))
+    await timer.load()
     log.info("TimerScheduler initialized")
     arc = ArcHandler(provider_url, contract_address, abi, agent_key, storage)
     log.info("ArcHandler initialized")
-    batch_runner = BatchRunner(cache, interval=10)
+    # one worker per concurrent model call, bounded by the model API rate limit
+    concurrency = int(os.getenv("AI_CONCURRENCY", "4"))
+    # batch mode decides a whole batch in one model call, so the runner hands out full batches
+    batch_mode = os.getenv("AI_BATCH_MODE", "0") == "1"
+    batch_runner = BatchRunner(cache, interval=10, concurrency=1 if batch_mode else concurrency)
     log.info("BatchRunner initialized")
 
     tools = make_tools(arc, storage, timer)
@@ -81,52 +95,63 @@ async def _main():
     executor = agent
     log.info("AgentExecutor initialized")
     # --- AI callback for BatchRunner ---
+    async def ai_single(e):
+        escrow_info = {
+        "escrow_id": e.escrow_id,
+        "etype": e.etype.name,
+        "seen_count": e.seen_count,
+        }
+        #await toolsbase["get_escrow_by_id"].coroutine(e.escrow_id)
+        try:
+            await executor.ainvoke(
+            {"messages": [{"role": "user", "content": f"Process escrow event: {json.dumps(escrow_info)}"}]})
+        except Exception as ex:
+            log.error(f"ai_callback: {ex}")
+            log.warning("Falling back to manual handling")
+            await ai_fallback([e])
+
+    decider = model.with_structured_output(EscrowActions)
+    async def ai_batch(batch):
+        """One model call for the whole batch, escrows it can't settle go through ai_single."""
+        async def decide(prompt):
+            return await decider.ainvoke([("system", system_prompt), ("user", prompt)])
+        await decide_batch(batch, tools, decide, ai_single, concurrency)
+
     async def ai_callback(batch):
+        if batch_mode and len(batch) > 1:
+            await ai_batch(batch)
+            return
         for e in batch:
-            escrow_info = {
-            "escrow_id": e.escrow_id,
-            "etype": e.etype.name,
-            "seen_count": e.seen_count,
-            }
-            #await toolsbase["get_escrow_by_id"].coroutine(e.escrow_id)
-            try:
-                await executor.ainvoke(
-                {"messages": [{"role": "user", "content": f"Process escrow event: {json.dumps(escrow_info)}"}]})
-            except Exception as e:
-                log.error(f"ai_callback: {e}")
-                log.warning("Falling back to manual handling")
-                await ai_fallback(batch)
+            await ai_single(e)
         
 
-    async def timer_callback(entry):
+    async def timer_agent(entry):
         escrow_info = {
             "escrow_id":entry.escrow_id,
             "reason": entry.reason,
             "attempts": entry.attempt,
             "due_at": entry.due_at,
         }
-        
-        try:
-            await executor.ainvoke({
+        await executor.ainvoke({
             "messages": [{"role": "user", "content": f"Set timer elapsed: {json.dumps(escrow_info)}"}]
         })
-        except Exception as e:
-                log.error(f"timer_callback: {e}")
-                log.warning("Falling back to manual handling")
-                batch:List[EscrowRef] = []
-                 # reconstruct EscrowRef
-                prefix, data = await toolsbase["get_escrow_by_id"].coroutine(entry.escrow_id)
-                etype = PREFIX_TO_ETYPE.get(prefix, EscrowType.CREATED)
-                
-                ref = EscrowRef(
-                escrow_id=entry.escrow_id,
-                etype=etype,
-                first_seen_at=entry.due_at,
-                last_seen_at=entry.due_at,
-                seen_count=entry.attempt,
-                )
-                # reuse ai_callback fallback
-                await ai_fallback([ref], send=1)
+
+    async def timer_fallback(entry):
+        # reconstruct EscrowRef
+        prefix, data = await toolsbase["get_escrow_by_id"].coroutine(entry.escrow_id)
+        etype = PREFIX_TO_ETYPE.get(prefix, EscrowType.CREATED)
+        ref = EscrowRef(
+        escrow_id=entry.escrow_id,
+        etype=etype,
+        first_seen_at=entry.due_at,
+        last_seen_at=entry.due_at,
+        seen_count=entry.attempt,
+        )
+        # reuse ai_callback fallback, its errors reach settle_timer
+        await ai_fallback([ref], send=1, reraise=True)
+
+    async def timer_callback(entry):
+        await settle_timer(entry, timer_agent, timer_fallback)
         
 
     async def test_ai():
@@ -137,7 +162,7 @@ async def _main():
         log.info(f"Test AI response: {response}")
     toolsbase = {t.name: t for t in tools} 
     
-    async def ai_fallback(batch, send:int=None):
+    async def ai_fallback(batch, send:int=None, reraise:bool=False):
         for e in batch:
             ## possibly extensible
             escrow_info = {
@@ -153,7 +178,7 @@ async def _main():
                     log.info(f"ai_fallback: retrieving escrow details from storage")
                     prefix,_details = await toolsbase["get_escrow_by_id"].coroutine(e.escrow_id)
                     etype = PREFIX_TO_ETYPE.get(prefix, EscrowType.CREATED)
-                    details = json.loads(_details)
+                    details = load_value(_details)
                     if e.escrow_id == details["escrowId"]: ## sec check
                         log.info(f"ai_fallback: requesting shipment details for {details["shipmentId"]}")
                         status = await toolsbase["query_shipment"].coroutine(details["shipmentId"])
@@ -189,6 +214,8 @@ async def _main():
                             await toolsbase["set_timer"].coroutine(e.escrow_id, 5, "waiting for more details")
             except Exception as ex:
                 log.error(f"ai_fallback processing {escrow_info['escrow_id']}: {ex}", exc_info=True)
+                if reraise:
+                    raise
     # --- Run main tasks ---
     tasks = [
         #create_monitored_task(test_ai()),  # test AI invocation
@@ -209,6 +236,10 @@ async def _main():
     for t in tasks:
         t.cancel()
     await asyncio.gather(*tasks, return_exceptions=True)
+    # the writer thread is a daemon: let it finish queued events and the last timer journal write
+    await timer.drain()
+    await storage.db.close()
+    await arc.close()
     log.info("Shutdown complete")
 
 def main():
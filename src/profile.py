@@ -4,6 +4,7 @@ import json, time
 from typing import List, Optional
 from web3 import Web3
 from web3.contract import Contract
+from event_decoder import decode_log
 
 USDC_DECIMALS = 6
 logging.basicConfig(level=logging.INFO)
@@ -219,20 +220,7 @@ def capture_events(arc, w3, start_block):
         time.sleep(2)
 
 def _decode_log(contract: Contract, log):
-    for ev in [
-        contract.events.EscrowCreated,
-        contract.events.ShipmentLinked,
-        contract.events.FundsReleased,
-        contract.events.FundsRefunded,
-        contract.events.EscrowExtended,
-        contract.events.EscrowExpired,
-        contract.events.EscrowCancelled,
-    ]:
-        try:
-            return ev().process_log(log)
-        except Exception:
-            continue
-    return None
+    return decode_log(contract, log)
 
 def loaddemo(arc, cfg, w3):
     buyer = w3.eth.account.from_key(cfg["BUYER_KEY"])
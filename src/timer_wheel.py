@@ -0,0 +1,147 @@
+import heapq
+import math
+import time
+from typing import List, Optional
+
+
+class TimingWheel:
+    """Hierarchical timing wheel backend for core.TimerScheduler.
+
+    `levels` wheels of `slots` buckets; a bucket of level i spans tick * slots**i seconds.
+    Insert and cancel are O(1): an entry is appended to the bucket of its level, cancelling only flags it
+    and it is dropped once its bucket comes up. Upper level buckets are cascaded down as time advances.
+    Timers fire at most one tick late. Entries only need `due_at` and `cancelled` attributes.
+    """
+    def __init__(self, tick: float = 0.01, slots: int = 256, levels: int = 4, start: Optional[float] = None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._counts = [0] * levels # entries (live or cancelled) per level
+        self._div = [slots ** i for i in range(levels)] # ticks per bucket of each level
+        self._span = [slots ** (i + 1) for i in range(levels)] # ticks covered by each level
+        self._ready = [] # due at or before the current tick
+        self._overflow = [] # (tick, seq, entry) too far out for the top level
+        self._seq = 0
+        self._cur = int((time.time() if start is None else start) / tick)
+        self._live = 0
+        self._stale = 0
+
+    def __len__(self):
+        return self._live
+
+    def push(self, entry):
+        self._live += 1
+        self._place(entry, math.ceil(entry.due_at / self.tick))
+
+    def discard(self, entry):
+        """Account for an entry the scheduler flagged as cancelled, it is dropped lazily."""
+        self._live -= 1
+        self._stale += 1
+        if self._stale > 2 * self._live + 1024:
+            self.rebuild(self._entries())
+
+    def rebuild(self, entries):
+        entries = list(entries)
+        start = self._cur * self.tick
+        self.__init__(self.tick, self.slots, self.levels, start)
+        for e in entries:
+            self.push(e)
+
+    def next_due(self) -> Optional[float]:
+        """Earliest time pop_due may return something (a lower bound within one bucket)."""
+        if self._ready:
+            return self._cur * self.tick
+        S = self.slots
+        best = None
+        for level in range(self.levels):
+            if not self._counts[level]:
+                continue
+            base = self._cur // self._div[level]
+            buckets = self._wheels[level]
+            for k in range(1, S + 1):
+                if buckets[(base + k) % S]:
+                    t = (base + k) * self._div[level]
+                    best = t if best is None else min(best, t)
+                    break
+        if self._overflow:
+            t = max(self._cur + 1, self._overflow[0][0] - self._span[-1] + 1)
+            best = t if best is None else min(best, t)
+        return None if best is None else best * self.tick
+
+    def pop_due(self, now: float) -> List:
+        """Remove and return live entries due by `now`, earliest first."""
+        self._advance(int(now / self.tick))
+        if not self._ready:
+            return []
+        ready, self._ready = self._ready, []
+        due = []
+        for e in ready:
+            if e.cancelled:
+                self._stale -= 1
+            else:
+                self._live -= 1
+                due.append(e)
+        due.sort(key=lambda e: e.due_at)
+        return due
+
+    def _place(self, entry, t: int):
+        delta = t - self._cur
+        if delta <= 0:
+            self._ready.append(entry)
+            return
+        for level in range(self.levels):
+            if delta < self._span[level]:
+                self._wheels[level][(t // self._div[level]) % self.slots].append(entry)
+                self._counts[level] += 1
+                return
+        self._seq += 1
+        heapq.heappush(self._overflow, (t, self._seq, entry))
+
+    def _advance(self, to: int):
+        S = self.slots
+        while self._cur < to:
+            if self._counts[0]:
+                self._cur += 1
+            else:
+                # nothing on the lowest wheel, jump straight to the next cascade point
+                nxt = (self._cur // S + 1) * S
+                if nxt > to:
+                    self._cur = to
+                    break
+                self._cur = nxt
+            T = self._cur
+            if T % S == 0:
+                self._cascade(1, T)
+            bucket = self._wheels[0][T % S]
+            if bucket:
+                self._wheels[0][T % S] = []
+                self._counts[0] -= len(bucket)
+                self._ready.extend(bucket)
+            while self._overflow and self._overflow[0][0] - T < self._span[-1]:
+                t, _, e = heapq.heappop(self._overflow)
+                self._place(e, t)
+
+    def _cascade(self, level: int, T: int):
+        if level >= self.levels:
+            return
+        idx = (T // self._div[level]) % self.slots
+        if idx == 0:
+            self._cascade(level + 1, T)
+        bucket = self._wheels[level][idx]
+        if not bucket:
+            return
+        self._wheels[level][idx] = []
+        self._counts[level] -= len(bucket)
+        for e in bucket:
+            if e.cancelled:
+                self._stale -= 1
+            else:
+                self._place(e, math.ceil(e.due_at / self.tick))
+
+    def _entries(self):
+        for wheel in self._wheels:
+            for bucket in wheel:
+                yield from (e for e in bucket if not e.cancelled)
+        yield from (e for e in self._ready if not e.cancelled)
+        yield from (e for _, _, e in self._overflow if not e.cancelled)
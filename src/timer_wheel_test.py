@@ -0,0 +1,63 @@
+import asyncio, random, time, pytest
+from core import HeapTimers, TimerEntry, TimerScheduler
+from timer_wheel import TimingWheel
+
+def drain(backend, start, end, step):
+    fired = []
+    now = start
+    while now <= end:
+        fired.extend((e.escrow_id, now) for e in backend.pop_due(now))
+        now += step
+    return fired
+
+def test_wheel_fires_same_timers_as_heap():
+    rng = random.Random(3)
+    wheel = TimingWheel(tick=0.01, slots=16, levels=3, start=0.0)
+    heap = HeapTimers()
+    due_at = {}
+    # spread over every level and into the overflow (16**3 ticks = 40.96s)
+    for i in range(2000):
+        due_at[i] = rng.uniform(0, 60)
+        for backend in (wheel, heap):
+            e = TimerEntry(due_at=due_at[i], escrow_id=i, reason="r")
+            backend.push(e)
+            if i % 7 == 0:
+                e.cancelled = True
+                backend.discard(e)
+    assert len(wheel) == len(heap)
+    wheel_fired = drain(wheel, 0.0, 61.0, 0.25)
+    heap_fired = drain(heap, 0.0, 61.0, 0.25)
+    assert [i for i, _ in wheel_fired] == [i for i, _ in heap_fired]
+    # never early, at most one step (plus one tick) late
+    assert all(due_at[i] <= t < due_at[i] + 0.26 for i, t in wheel_fired)
+
+def test_wheel_cancel_and_next_due():
+    wheel = TimingWheel(tick=0.1, slots=8, levels=2, start=0.0)
+    a = TimerEntry(due_at=0.55, escrow_id=1, reason="a")
+    b = TimerEntry(due_at=30.0, escrow_id=2, reason="b")
+    wheel.push(a)
+    wheel.push(b)
+    assert len(wheel) == 2
+    assert wheel.next_due() == pytest.approx(0.6)
+    a.cancelled = True
+    wheel.discard(a)
+    assert len(wheel) == 1
+    assert wheel.pop_due(1.0) == []
+    assert wheel.next_due() <= 30.0
+    assert wheel.pop_due(30.05) == [b]
+    assert len(wheel) == 0
+
+@pytest.mark.asyncio
+async def test_scheduler_with_wheel_backend():
+    fired = []
+    async def cb(entry): fired.append(entry.escrow_id)
+    sched = TimerScheduler(backend=TimingWheel(tick=0.01))
+    sched.set_timer(1, delay=0.2, reason="a")
+    sched.set_timer(2, delay=0.1, reason="b")
+    sched.set_timer(3, delay=0.15, reason="c")
+    sched.cancel(3)
+    task = asyncio.create_task(sched.run(cb))
+    await asyncio.sleep(0.35)
+    task.cancel()
+    assert fired == [2, 1]
+    assert sched.stats["max_lag"] < 0.05
@@ -1,12 +1,141 @@
+import asyncio
 import json
 import logging
+import time
 import httpx
-from pydantic import BaseModel
+from typing import Dict, List, Literal, Optional
+from pydantic import BaseModel, Field
 from langchain.tools import tool
-from core import ArcHandler, Storage, TimerScheduler
+from core import ArcHandler, Storage, TimerScheduler, load_value
 
 BASE = "http://127.0.0.1:8000"
 
+# --- Batched decisions: one model call for a whole batch of escrows ---
+# Actions the model may pick per latest state prefix, anything else goes back to single-escrow handling.
+ALLOWED_ACTIONS = {
+    "lk": {"extend_escrow", "set_timer", "refund_funds"},
+    "ex": {"release_funds", "extend_escrow", "set_timer", "refund_funds"},
+    "xp": {"finalize_expired_refund", "refund_funds"},
+    "cn": {"refund_funds"},
+    "ec": {"set_timer"},
+}
+TIMED_ACTIONS = {"extend_escrow", "set_timer"}
+
+class EscrowAction(BaseModel):
+    escrow_id: int
+    action: Literal["release_funds", "refund_funds", "extend_escrow", "finalize_expired_refund", "set_timer"]
+    reason: str = Field(description="audit reason, include shipment status")
+    seconds: Optional[int] = Field(default=None, description="required for extend_escrow and set_timer")
+
+class EscrowActions(BaseModel):
+    """One action per escrow of the batch."""
+    actions: List[EscrowAction]
+
+def build_batch_prompt(rows: List[dict]) -> str:
+    """Render escrows as a compact pipe table so N escrows share one prompt."""
+    cols = ["escrow_id", "state", "seen", "shipmentId", "shipment_status", "expectedBy"]
+    lines = ["|".join(cols)]
+    for r in rows:
+        lines.append("|".join(str(r.get(c, "")) for c in cols))
+    return (
+        "Decide one action for each escrow below using the shipment status already provided, "
+        "do not call tools. Return an action for every escrow_id.\n" + "\n".join(lines)
+    )
+
+def validate_action(a: EscrowAction, rows: Dict[int, dict]) -> Optional[str]:
+    """Return why an action can't be applied, None when it's valid."""
+    row = rows.get(a.escrow_id)
+    if row is None:
+        return "unknown escrow"
+    if a.action not in ALLOWED_ACTIONS.get(row["state"], set()):
+        return f"{a.action} not allowed in state {row['state']}"
+    if a.action in TIMED_ACTIONS and not (a.seconds and a.seconds > 0):
+        return f"{a.action} needs positive seconds"
+    if not a.reason.strip():
+        return "empty reason"
+    return None
+
+async def apply_actions(decided: EscrowActions, rows: Dict[int, dict], tools) -> List[int]:
+    """Run validated actions through the tools from make_tools.
+    Returns escrow ids that still need a single-escrow invocation (missing, invalid, duplicated or failed).
+    """
+    toolsbase = {t.name: t for t in tools}
+    done = set()
+    for a in decided.actions:
+        if a.escrow_id in done:
+            logging.warning(f"apply_actions: duplicate action for {a.escrow_id} ignored")
+            continue
+        err = validate_action(a, rows)
+        if err:
+            logging.warning(f"apply_actions: rejected {a.action} for {a.escrow_id}: {err}")
+            continue
+        try:
+            fn = toolsbase[a.action].coroutine
+            if a.action in TIMED_ACTIONS:
+                out = await fn(a.escrow_id, a.seconds, a.reason)
+            else:
+                out = await fn(a.escrow_id, a.reason)
+            logging.info(f"apply_actions: {out}")
+            done.add(a.escrow_id)
+        except Exception as e:
+            logging.error(f"apply_actions: {a.action} failed for {a.escrow_id}: {e}")
+    return [i for i in rows if i not in done]
+
+async def collect_rows(batch, tools) -> Dict[int, dict]:
+    """Latest state and shipment status of each escrow in the batch, fetched concurrently."""
+    toolsbase = {t.name: t for t in tools}
+    latest = await toolsbase["get_escrows_by_ids"].coroutine([e.escrow_id for e in batch])
+    async def row(e):
+        prefix, data = latest.get(e.escrow_id, ("unknown", None))
+        r = {"escrow_id": e.escrow_id, "state": prefix, "seen": e.seen_count}
+        try:
+            details = load_value(data)
+        except ValueError:
+            return r
+        if not isinstance(details, dict):
+            return r
+        r["expectedBy"] = details.get("expectedBy", "")
+        if details.get("shipmentId"):
+            r["shipmentId"] = details["shipmentId"]
+            status = await toolsbase["query_shipment"].coroutine(details["shipmentId"])
+            try:
+                r["shipment_status"] = status["details"][0]["status"]
+            except (TypeError, KeyError, IndexError):
+                r["shipment_status"] = "unknown"
+        return r
+    rows = await asyncio.gather(*(row(e) for e in batch))
+    return {r["escrow_id"]: r for r in rows}
+
+async def decide_batch(batch, tools, decide, single, concurrency: int = 1):
+    """Settle a batch with one decision: `decide(prompt)` gets the build_batch_prompt table and returns
+    EscrowActions, which apply_actions runs. Escrows it leaves open, or the whole batch when collecting
+    the rows or deciding fails, go through `single(e)`, at most `concurrency` at a time.
+    """
+    try:
+        rows = await collect_rows(batch, tools)
+        decided = await decide(build_batch_prompt(list(rows.values())))
+        retry = set(await apply_actions(decided, rows, tools))
+    except Exception as ex:
+        logging.error(f"decide_batch: {ex}")
+        retry = {e.escrow_id for e in batch}
+    if retry:
+        logging.info(f"decide_batch: {len(retry)}/{len(batch)} escrows fall back to single invocation")
+        sem = asyncio.Semaphore(concurrency)
+        async def one(e):
+            async with sem:
+                await single(e)
+        await asyncio.gather(*(one(e) for e in batch if e.escrow_id in retry))
+
+async def settle_timer(entry, agent, fallback):
+    """Timer callback: `agent(entry)` handles the elapsed timer, `fallback(entry)` when the agent fails.
+    If the fallback fails too its error propagates, so TimerScheduler retries the timer with backoff.
+    """
+    try:
+        await agent(entry)
+    except Exception as ex:
+        logging.error(f"settle_timer: agent failed for {entry.escrow_id}: {ex}")
+        logging.warning("Falling back to manual handling")
+        await fallback(entry)
 
 def make_tools(arc: ArcHandler, storage: Storage, timer: TimerScheduler):
     # --- Tool functions ---
@@ -41,7 +170,7 @@ def make_tools(arc: ArcHandler, storage: Storage, timer: TimerScheduler):
             async with httpx.AsyncClient() as client:
                 res = await client.post(f"{BASE}/query", data=json.dumps({"ids":id}))
                 if res.status_code == 200:
-                    storage.save_shipment_states(id, res.json())
+                    await storage.save_shipment_states(id, res.json())
                     return res.json()
                 return f"Error {res.status_code}: {res.text}"
         except Exception as e:
@@ -49,8 +178,11 @@ def make_tools(arc: ArcHandler, storage: Storage, timer: TimerScheduler):
     
     @tool("set_timer")
     async def set_timer(escrow_id:int, seconds:int, notes:str) -> str:
-        "schedules a timer"
-        timer.set_timer(escrow_id, seconds, notes)
+        "schedules a timer, an earlier pending timer for the same escrow is kept"
+        previous = timer.get(escrow_id)
+        entry = timer.set_timer(escrow_id, seconds, notes)
+        if entry is previous:
+            return f"Timer for escrow {escrow_id} already pending in {max(0, int(entry.due_at - time.time()))}s: {entry.reason}"
         return f"Timer set for escrow {escrow_id} in {seconds}s: {notes}"
 
     @tool("get_escrow_by_id")
@@ -62,7 +194,12 @@ def make_tools(arc: ArcHandler, storage: Storage, timer: TimerScheduler):
             return state
         return f"Escrow for {escrow_id} not found", "None"
     
-    return [get_escrow_by_id, set_timer, 
+    @tool("get_escrows_by_ids")
+    async def get_escrows_by_ids(escrow_ids: list[int]) -> dict[int, tuple[str, str]]:
+        """Return the latest state of several Escrows at once, unknown ids are left out"""
+        return await storage.get_latest_many(escrow_ids)
+
+    return [get_escrow_by_id, get_escrows_by_ids, set_timer, 
             query_shipment, release_funds, refund_funds,extend_escrow,
             finalize_expired_refund
             ]
\ No newline at end of file
@@ -1,6 +1,7 @@
 import pytest
-from tools import make_tools
+from tools import EscrowAction, EscrowActions, apply_actions, build_batch_prompt, collect_rows, make_tools
 from core import ArcHandler, Storage, TimerScheduler
+from db import DB
 
 class DummyReceipt():
     def __init__(self, tx="0xabc"):
@@ -14,9 +15,15 @@ class DummyArc(ArcHandler):
     async def FinalizeExpiredRefund(self, id, reason) -> dict[str, object]: return {"transactionHash": b"\x78"*32}
 
 @pytest.fixture
-def Basetool():
-    arc = DummyArc()
-    storage = Storage()
+def tmp_storage(tmp_path):
+    db = DB(path=str(tmp_path / "db"))
+    yield Storage(db=db)
+    db.close()
+
+@pytest.fixture
+def Basetool(tmp_storage):
+    storage = tmp_storage
+    arc = DummyArc(storage=storage)
     timer = TimerScheduler()
     Basetools = {t.name: t for t in make_tools(arc, storage, timer)}
     
@@ -45,6 +52,116 @@ async def test_refund_tool(Basetool):
     assert f"Refunded escrow 5 with reason 'refund', tx={tx.hex()}" in out
 
 
+@pytest.mark.asyncio
+async def test_collect_rows_reads_dict_and_json_text_records():
+    import json
+    from types import SimpleNamespace
+    from core import EscrowRef, EscrowType
+    latest = {1: ("lk", {"escrowId": 1, "shipmentId": "s-1", "expectedBy": 5}),
+              2: ("ex", json.dumps({"escrowId": 2, "shipmentId": "s-2"})),  # stored before records were dicts
+              3: ("xp", "not json")}
+    async def get_escrows_by_ids(ids):
+        return {i: latest[i] for i in ids if i in latest}
+    async def query_shipment(shipment_id):
+        return {"details": [{"status": f"{shipment_id} DELIVERED"}]}
+    tools = [SimpleNamespace(name="get_escrows_by_ids", coroutine=get_escrows_by_ids),
+             SimpleNamespace(name="query_shipment", coroutine=query_shipment)]
+    batch = [EscrowRef(escrow_id=i, etype=EscrowType.LINKED, first_seen_at=0, last_seen_at=0) for i in (1, 2, 3, 4)]
+    rows = await collect_rows(batch, tools)
+    assert rows[1]["shipment_status"] == "s-1 DELIVERED" and rows[1]["expectedBy"] == 5
+    assert rows[2]["shipment_status"] == "s-2 DELIVERED"
+    assert "shipmentId" not in rows[3] and rows[4]["state"] == "unknown"
+
+@pytest.mark.asyncio
+async def test_decide_batch_falls_back_when_collecting_rows_fails(monkeypatch):
+    import tools
+    from core import EscrowRef, EscrowType
+    async def collect_rows(batch, tools):
+        raise ValueError("storage unavailable")
+    monkeypatch.setattr(tools, "collect_rows", collect_rows)
+    decided, singles = [], []
+    async def decide(prompt):
+        decided.append(prompt)
+    async def single(e):
+        singles.append(e.escrow_id)
+    batch = [EscrowRef(escrow_id=i, etype=EscrowType.LINKED, first_seen_at=0, last_seen_at=0) for i in (1, 2, 3)]
+    await tools.decide_batch(batch, [], decide, single, concurrency=2)
+    assert decided == []
+    assert sorted(singles) == [1, 2, 3]
+
+@pytest.mark.asyncio
+async def test_decide_batch_retries_only_undecided_escrows(tmp_storage):
+    from core import EscrowRef, EscrowType
+    from tools import decide_batch
+    await tmp_storage.save_escrow_events([(i, EscrowType.LINKED, {"escrowId": i}) for i in (1, 2)])
+    timer = TimerScheduler()
+    tools = make_tools(DummyArc(storage=tmp_storage), tmp_storage, timer)
+    prompts, singles = [], []
+    async def decide(prompt):
+        prompts.append(prompt)
+        return EscrowActions(actions=[EscrowAction(escrow_id=1, action="set_timer", reason="in transit", seconds=30)])
+    async def single(e):
+        singles.append(e.escrow_id)
+    batch = [EscrowRef(escrow_id=i, etype=EscrowType.LINKED, first_seen_at=0, last_seen_at=0) for i in (1, 2)]
+    await decide_batch(batch, tools, decide, single)
+    assert len(prompts) == 1 and list(timer._timers) == [1]
+    assert singles == [2]
+
+@pytest.mark.asyncio
+async def test_timer_retried_when_agent_and_fallback_fail():
+    import asyncio
+    from tools import settle_timer
+    calls = []
+    async def agent(entry):
+        calls.append(("agent", entry.attempt))
+        raise RuntimeError("model unavailable")
+    async def fallback(entry):  # main.ai_fallback(reraise=True)
+        calls.append(("fallback", entry.attempt))
+        if entry.attempt == 1:
+            raise RuntimeError("shipment feed down")
+    sched = TimerScheduler(max_attempts=3, retry_base=0.1)
+    async def callback(entry):
+        await settle_timer(entry, agent, fallback)
+    sched.set_timer(7, delay=0, reason="release funds")
+    task = asyncio.create_task(sched.run(callback))
+    await asyncio.sleep(0.05)
+    retry = sched.get(7)  # rescheduled with backoff instead of dropped
+    assert retry is not None and retry.attempt == 2 and retry.reason == "release funds"
+    await asyncio.sleep(0.2)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert calls == [("agent", 1), ("fallback", 1), ("agent", 2), ("fallback", 2)]
+    assert sched.get(7) is None  # the fallback settled it on the retry
+
+def test_build_batch_prompt_one_row_per_escrow():
+    rows = [{"escrow_id": 1, "state": "lk", "shipmentId": "s-1", "shipment_status": "DELIVERED"},
+            {"escrow_id": 2, "state": "xp"}]
+    table = build_batch_prompt(rows).splitlines()[1:]
+    assert table[0] == "escrow_id|state|seen|shipmentId|shipment_status|expectedBy"
+    assert table[1].startswith("1|lk||s-1|DELIVERED")
+    assert table[2].startswith("2|xp|")
+
+@pytest.mark.asyncio
+async def test_apply_actions_falls_back_on_invalid_items(tmp_storage):
+    arc = DummyArc(storage=tmp_storage)
+    timer = TimerScheduler()
+    tools = make_tools(arc, tmp_storage, timer)
+    rows = {1: {"escrow_id": 1, "state": "xp"},
+            2: {"escrow_id": 2, "state": "lk"},
+            3: {"escrow_id": 3, "state": "lk"},
+            4: {"escrow_id": 4, "state": "ex"}}
+    decided = EscrowActions(actions=[
+        EscrowAction(escrow_id=1, action="finalize_expired_refund", reason="expired"),
+        EscrowAction(escrow_id=2, action="release_funds", reason="delivered"),  # not allowed while LINKED
+        EscrowAction(escrow_id=3, action="set_timer", reason="in transit"),  # missing seconds
+        EscrowAction(escrow_id=4, action="set_timer", reason="hold period", seconds=45),
+        EscrowAction(escrow_id=99, action="refund_funds", reason="not in batch"),
+    ])
+    retry = await apply_actions(decided, rows, tools)
+    assert retry == [2, 3]
+    assert list(timer._timers) == [4]
+
+
 """
 def test_query_shipment(monkeypatch, Basetool):
     class DummyResp: